@@ -4,6 +4,15 @@ import socket
 import select
 import struct
 import errno
+import threading
+import time
+import re
+import json
+try:
+    # optional, and several times faster than json on large replies
+    import ujson as TrFastJSON
+except ImportError:
+    TrFastJSON = None
 
 import platform
 import optparse
@@ -58,13 +67,332 @@ sceneName = ''
 
 ## ------------------------------------------------------------- ##
 
+class TrConnectionPool (object):
+    '''
+    Idle HTTP/1.1 keep-alive connections to tractor engines, kept by
+    (host, port) for TrHttpRPC transactions made with keepalive=True.
+    At most maxidle connections are kept per engine, and connections
+    left idle for idletimeout seconds are closed rather than reused,
+    since the engine may have dropped them in the meantime.
+    '''
+
+    def __init__(self, maxidle=4, idletimeout=15.0):
+        self.maxidle = maxidle
+        self.idletimeout = idletimeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def Get (self, host, port):
+        '''
+        Return an idle connection to the engine, or None.
+        '''
+        now = time.time()
+        stale = []
+        s = None
+        with self.lock:
+            conns = self.idle.get( (host, port), [] )
+            while conns:
+                c, t = conns.pop()
+                if now - t < self.idletimeout and not self.isClosed(c):
+                    s = c
+                    break
+                stale.append(c)
+        for c in stale:
+            c.close()
+        return s
+
+    def Put (self, host, port, s):
+        '''
+        Keep a connection for reuse, or close it if the pool is full.
+        '''
+        with self.lock:
+            conns = self.idle.setdefault( (host, port), [] )
+            if len(conns) < self.maxidle:
+                conns.append( (s, time.time()) )
+                return
+        s.close()
+
+    def Clear (self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for conns in idle.values():
+            for c, t in conns:
+                c.close()
+
+    def isClosed (self, s):
+        # an idle connection has nothing to read, unless the engine
+        # has closed it (or sent something unexpected), so drop it
+        try:
+            r,w,x = select.select([s], [], [], 0)
+        except Exception:
+            return True
+        return bool(r)
+
+
+TrKeepAlivePool = TrConnectionPool()
+
+## ------------------------------------------------------------- ##
+
+def trJSONLoads (text):
+    '''
+    Decode JSON text, with the faster decoder if it is installed
+    (see TrFastJSON), or else the standard one.
+    '''
+    if TrFastJSON:
+        return TrFastJSON.loads(text)
+    return json.loads(text)
+
+## ------------------------------------------------------------- ##
+
+class TrJSONArrayStream (object):
+    '''
+    An incremental decoder for a JSON array, or for the array held
+    under key by a JSON object, returning its items as the reply text
+    arrives in pieces, so that large replies needn't be kept whole.
+    The object's other members are scanned past and dropped.
+
+    A value cut off at the end of a piece is scanned as the following
+    pieces arrive, from where the scan stopped, and decoded once it is
+    complete, so that the text is read in linear time whatever the
+    size of the pieces.
+    '''
+
+    WS = " \t\r\n"
+    NUMBER = "0123456789+-.eE"
+
+    # the characters a scan stops at: outside of strings, inside them,
+    # and those that end a number or a literal (true, false, null)
+    STRUCTURE = re.compile(r'["\[\]{}]')
+    STRING = re.compile(r'["\\]')
+    SCALAREND = re.compile(r'[,\]}\s]')
+
+    def __init__(self, key=None):
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.state = "start"
+        self.found = False
+        self.name = None
+
+        # the pieces of a value that continues past the text so far,
+        # and where its scan is, see scan()
+        self.parts = None
+        self.depth = 0
+        self.instring = False
+        self.escaped = False
+        self.scalar = False
+
+    def Feed (self, data):
+        '''
+        Add the next piece of text, and return the items it completed.
+        '''
+        items = []
+        if self.parts is not None:
+            end = self.scan(data, 0)
+            if end is None:
+                self.parts.append(data)
+                return items
+            self.parts.append(data[:end])
+            text = "".join(self.parts)
+            self.parts = None
+            self.take(text, items)
+            data = data[end:]
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        while self.state != "done" and self.step(items):
+            pass
+        return items
+
+    def Close (self):
+        '''
+        Check that the whole array was read.
+        '''
+        if self.state != "done":
+            raise ValueError("incomplete or invalid JSON reply")
+        if self.key is not None and not self.found:
+            raise ValueError("no '%s' array in JSON reply" % self.key)
+
+    def step (self, items):
+        # advance by one token or value, or return False if more
+        # text is needed first
+        buf = self.buf
+        pos = self.pos
+        n = len(buf)
+        while pos < n and buf[pos] in self.WS:
+            pos += 1
+        self.pos = pos
+        if pos >= n:
+            return False
+
+        c = buf[pos]
+        state = self.state
+
+        if state == "start":
+            if self.key is None:
+                self.expect(c, "[")
+                self.state = "first"
+            else:
+                self.expect(c, "{")
+                self.state = "firstmember"
+            self.pos += 1
+
+        elif state in ("first", "next"):
+            if c == "]":
+                self.pos += 1
+                self.state = "done"
+            elif state == "next":
+                self.expect(c, ",")
+                self.pos += 1
+                self.state = "item"
+            else:
+                self.state = "item"
+
+        elif state in ("firstmember", "nextmember"):
+            if c == "}":
+                self.pos += 1
+                self.state = "done"
+            elif state == "nextmember":
+                self.expect(c, ",")
+                self.pos += 1
+                self.state = "member"
+            else:
+                self.state = "member"
+
+        elif state == "colon":
+            self.expect(c, ":")
+            self.pos += 1
+            if self.name == self.key:
+                self.found = True
+                self.state = "array"
+            else:
+                self.state = "skip"
+
+        elif state == "array":
+            self.expect(c, "[")
+            self.pos += 1
+            self.state = "first"
+
+        else:
+            # an item, a member's name, or a skipped member's value
+            return self.startValue(items)
+
+        return True
+
+    def startValue (self, items):
+        # take the value at pos if it is all here, or else start to
+        # scan it, keeping what there is of it until the rest arrives
+        buf = self.buf
+        pos = self.pos
+        if self.state != "skip":
+            try:
+                value, end = self.decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            # a number may yet continue past the text so far
+            if end is not None and (buf[pos] in '"[{' or
+                    end < len(buf) and buf[end] not in self.NUMBER):
+                self.pos = end
+                self.took(value, items)
+                return True
+
+        c = buf[pos]
+        self.depth = 0
+        self.instring = False
+        self.escaped = False
+        self.scalar = c not in '"[{'
+        end = self.scan(buf, pos)
+        if end is None:
+            self.parts = [ buf[pos:] ]
+            self.buf = ""
+            self.pos = 0
+            return False
+        if end == pos:
+            raise ValueError("expected a value in JSON reply, found '%s'" % c)
+        self.pos = end
+        self.take(buf[pos:end], items)
+        return True
+
+    def scan (self, text, pos):
+        # find the end of the value being scanned, carrying on from
+        # where the scan of the last piece of text stopped; return the
+        # index just past it, or None if it continues past text
+        if self.scalar:
+            m = self.SCALAREND.search(text, pos)
+            return m and m.start()
+
+        n = len(text)
+        while pos < n:
+            if self.escaped:
+                self.escaped = False
+                pos += 1
+            elif self.instring:
+                m = self.STRING.search(text, pos)
+                if not m:
+                    return None
+                pos = m.end()
+                if m.group() == "\\":
+                    self.escaped = True
+                else:
+                    self.instring = False
+                    if not self.depth:
+                        return pos
+            else:
+                m = self.STRUCTURE.search(text, pos)
+                if not m:
+                    return None
+                pos = m.end()
+                c = m.group()
+                if c == '"':
+                    self.instring = True
+                elif c in "[{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if not self.depth:
+                        return pos
+        return None
+
+    def take (self, text, items):
+        # a whole value, as scanned: decoded, unless it is skipped
+        if self.state == "skip":
+            self.state = "nextmember"
+            return
+        value, end = self.decoder.raw_decode(text)
+        if text[end:].strip():
+            raise ValueError("invalid JSON value in reply")
+        self.took(value, items)
+
+    def took (self, value, items):
+        # a decoded item, or a member's name
+        if self.state == "item":
+            items.append(value)
+            self.state = "next"
+        else:
+            self.name = value
+            self.state = "colon"
+
+    def expect (self, c, want):
+        if c != want:
+            raise ValueError("expected '%s' in JSON reply, found '%s'" % (want, c))
+
+## ------------------------------------------------------------- ##
+
 class TrHttpRPC(object):
 
-    def __init__(self, host, port=80, logger=None, apphdrs={}):
+    def __init__(self, host, port=80, logger=None, apphdrs={},
+                timeout=30.0, keepalive=False):
         self.host = host
         self.port = port
         self.logger = logger
         self.appheaders = apphdrs
+        self.timeout = timeout
+
+        # opt-in HTTP/1.1 requests over connections pooled per engine
+        # (see TrKeepAlivePool), rather than a new socket per request
+        self.keepalive = keepalive
 
         if port <= 0:
             h,c,p = host.partition(':')
@@ -90,64 +418,11 @@ class TrHttpRPC(object):
         """
         outdata = None
         errcode = 0
-        s = None
 
         try:
-            # like:  http://tractor-engine:80/Tractor/task?q=nextcmd&...
-            t = "/Tractor/" + tractorverb
-
-            # we use POST when making changes to the destination (REST)
-            req = "POST " + t + " HTTP/1.0\r\n"
-            for h in self.appheaders:
-                req += h + ": " + self.appheaders[h] + "\r\n"
-            for h in xheaders:
-                req += h + ": " + xheaders[h] + "\r\n"
-
-            if formdata:
-                t = formdata.strip()
-                req += "Content-Type: application/x-www-form-urlencoded\r\n"
-                req += "Content-Length: %d\r\n" % len(t)
-                req += "\r\n"  # end of http headers
-                req += t
-            else:
-                req += "\r\n"  # end of http headers
-
             # error checking?  why be a pessimist?
-            # that's why we have exceptions
-
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect( (self.host, self.port) )
-            s.sendall(req)
-
-            mustTimeWait = False
-
-            t = ""  # build up the reply text
-            while 1:
-                r,w,x = select.select([s], [], [], 30.0)
-                if r:
-                    if 0 == len(r):
-                        self.Debug("time-out waiting for http reply")
-                        mustTimeWait = True
-                        break
-                    else:
-                        r = s.recv(4096)
-                if not r:
-                    break
-                else:
-                    t += r
-
-            # Attempt to reduce descriptors held in TIME_WAIT on the
-            # engine by dismantling this request socket immediately
-            # if we've received an answer.  Usually the close() call
-            # returns immediately (no lingering close), but the socket
-            # persists in TIME_WAIT in the background for some seconds.
-            # Instead, we force it to dismantle early by turning ON
-            # linger-on-close() but setting the timeout to zero seconds.
-            #
-            if not mustTimeWait:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
-                                 struct.pack('ii', 1, 0))
-            s.close()
+            # that's why we have exceptions!
+            t = self.send( self.formatRequest(tractorverb, formdata, xheaders) )
 
             if t and len(t):
                 n = t.find("\r\n\r\n")
@@ -156,9 +431,7 @@ class TrHttpRPC(object):
                 n += 4
                 outdata = t[n:].strip()  # body, or error msg, no CRLF
 
-                n = h.find(' ') + 1
-                e = h.find(' ', n)
-                errcode = int( h[n:e] )
+                errcode = self.statusCode(h)
 
                 if errcode == 200:
                     errcode = 0
@@ -182,39 +455,323 @@ class TrHttpRPC(object):
                 errcode = -1
 
         except Exception, e:
-            if e[0] in (errno.ECONNREFUSED, errno.WSAECONNREFUSED):
-                outdata = "connection refused"
-                errcode = e[0]
-            elif e[0] in (errno.ECONNRESET, errno.WSAECONNRESET):
-                outdata = "connection dropped"
-                errcode = e[0]
-            else:
-                errcode = -1
-                outdata = "http transaction: " + self.Xmsg()
+            errcode, outdata = self.errorReply(e)
 
         return (errcode, outdata)
 
 
+    def TransactionItems (self, tractorverb, formdata, itemhandler,
+                            key=None, xheaders={}, analyzer=None):
+        """
+        Make an HTTP request whose reply is a JSON array, or a JSON
+        object holding an array under key, such as a large queue
+        listing, and call itemhandler with each item of the array as
+        it arrives, rather than reading and decoding the whole reply
+        first.  Returns (0, number of items) on success, and the same
+        errors as Transaction otherwise.
+        """
+        stream = TrJSONArrayStream(key)
+        counted = [0]
+
+        def sinkFor (h):
+            # error replies are read whole, as by Transaction
+            if self.statusCode(h) != 200:
+                return None
+            def sink (data):
+                for item in stream.Feed(data):
+                    itemhandler(item)
+                    counted[0] += 1
+            return sink
+
+        try:
+            t = self.send( self.formatRequest(tractorverb, formdata, xheaders),
+                           sinkFor )
+            if not t:
+                return (-1, "no data received")
+
+            n = t.find("\r\n\r\n")
+            h = t[0:n] # headers
+            errcode = self.statusCode(h)
+
+            if analyzer:
+                analyzer( h )
+
+            if errcode != 200:
+                return (errcode, t[n+4:].strip())
+
+            stream.Close()
+            return (0, counted[0])
+
+        except Exception, e:
+            return self.errorReply(e)
+
+
+    def formatRequest (self, tractorverb, formdata, xheaders):
+        # like:  http://tractor-engine:80/Tractor/task?q=nextcmd&...
+        t = "/Tractor/" + tractorverb
+
+        # we use POST when making changes to the destination (REST)
+        if self.keepalive:
+            req = "POST " + t + " HTTP/1.1\r\n"
+            req += "Host: %s:%d\r\n" % (self.host, self.port)
+            req += "Connection: keep-alive\r\n"
+        else:
+            req = "POST " + t + " HTTP/1.0\r\n"
+        for h in self.appheaders:
+            req += h + ": " + self.appheaders[h] + "\r\n"
+        for h in xheaders:
+            req += h + ": " + xheaders[h] + "\r\n"
+
+        if formdata:
+            t = formdata.strip()
+            req += "Content-Type: application/x-www-form-urlencoded\r\n"
+            req += "Content-Length: %d\r\n" % len(t)
+            req += "\r\n"  # end of http headers
+            req += t
+        elif self.keepalive:
+            req += "Content-Length: 0\r\n"
+            req += "\r\n"  # end of http headers
+        else:
+            req += "\r\n"  # end of http headers
+
+        return req
+
+    def send (self, req, sinkFor=None):
+        # returns the reply text, see recvReply
+        if self.keepalive:
+            return self.keepAliveTransfer(req, sinkFor)
+        else:
+            return self.transfer(req, sinkFor)
+
+
+    def statusCode (self, h):
+        # from the status line, like:  HTTP/1.0 200 OK
+        n = h.find(' ') + 1
+        e = h.find(' ', n)
+        return int( h[n:e] )
+
+
+    def errorReply (self, e):
+        # the (errcode, outdata) of a failed transaction
+        code = e.args and e.args[0] or None
+        if code in (errno.ECONNREFUSED, errno.WSAECONNREFUSED):
+            return (code, "connection refused")
+        elif code in (errno.ECONNRESET, errno.WSAECONNRESET):
+            return (code, "connection dropped")
+        else:
+            return (-1, "http transaction: " + self.Xmsg())
+
+
+    def transfer (self, req, sinkFor=None):
+        """
+        Send a request over a new connection, and return the reply
+        text.  The reply is read up to its Content-Length, when given,
+        rather than until the engine closes the connection.
+        """
+        s = socket.create_connection( (self.host, self.port), self.timeout )
+        try:
+            s.sendall(req)
+
+            t, complete, reusable = self.recvReply(s, sinkFor)
+
+            # Attempt to reduce descriptors held in TIME_WAIT on the
+            # engine by dismantling this request socket immediately
+            # if we've received an answer.  Usually the close() call
+            # returns immediately (no lingering close), but the socket
+            # persists in TIME_WAIT in the background for some seconds.
+            # Instead, we force it to dismantle early by turning ON
+            # linger-on-close() but setting the timeout to zero seconds.
+            #
+            if complete:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                 struct.pack('ii', 1, 0))
+        finally:
+            s.close()
+
+        return t
+
+
+    def keepAliveTransfer (self, req, sinkFor=None):
+        """
+        Send a request over a pooled keep-alive connection, or a new
+        one, and return the reply text.  A pooled connection that the
+        engine has since closed or reset is replaced by a new one, once,
+        unless part of the reply was already received on it.
+        Connections are returned to the pool only after a complete reply.
+        """
+        started = []
+
+        def sinkStarted (h):
+            started.append(h)
+            return sinkFor and sinkFor(h)
+
+        for attempt in (0, 1):
+            s = TrKeepAlivePool.Get(self.host, self.port)
+            reused = s is not None
+            if not reused:
+                s = socket.create_connection( (self.host, self.port),
+                                              self.timeout )
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            try:
+                s.sendall(req)
+                t, complete, reusable = self.recvReply(s, sinkStarted)
+            except socket.error, e:
+                s.close()
+                if reused and not started and \
+                   e[0] in (errno.ECONNRESET, errno.WSAECONNRESET,
+                            errno.EPIPE, errno.ECONNABORTED):
+                    self.Debug("keep-alive connection dropped, reconnecting")
+                    continue
+                raise
+            except:
+                s.close()
+                raise
+
+            if not t and reused:
+                # closed by the engine before replying
+                s.close()
+                continue
+
+            if reusable:
+                TrKeepAlivePool.Put(self.host, self.port, s)
+            else:
+                s.close()
+            return t
+
+        return ""
+
+
+    def recvReply (self, s, sinkFor=None):
+        """
+        Read one HTTP reply, framed by its Content-Length or chunked
+        encoding, or else ending when the engine closes the connection.
+        The body is collected in a list of received blocks, joined once,
+        or passed block by block to the sink returned by sinkFor(headers),
+        if any, and not kept.  Returns the reply text (headers and kept
+        body, de-chunked), whether the reply was complete, and whether
+        the connection may be reused for another request.
+        """
+        chunks = []
+        buf = ""
+        timedout = []
+
+        def recvMore ():
+            r,w,x = select.select([s], [], [], self.timeout)
+            if not r:
+                self.Debug("time-out waiting for http reply")
+                timedout.append(True)
+                return ""
+            return s.recv(65536)
+
+        # headers
+        while "\r\n\r\n" not in buf:
+            r = recvMore()
+            if not r:
+                return buf, False, False
+            buf += r
+
+        n = buf.find("\r\n\r\n") + 4
+        h = buf[0:n]
+        body = buf[n:]
+        hlower = h.lower()
+
+        reusable = True
+        if "\r\nconnection: close" in hlower or hlower.startswith("http/1.0"):
+            reusable = False
+
+        length = None
+        m = re.search(r"\r\ncontent-length:\s*(\d+)", hlower)
+        if m:
+            length = int( m.group(1) )
+
+        sink = sinkFor and sinkFor( h[0:n-4] )
+        if not sink:
+            sink = chunks.append
+
+        if "\r\ntransfer-encoding: chunked" in hlower:
+            complete = self.recvChunked(body, recvMore, sink)
+
+        elif length is None:
+            # no framing, the reply ends when the engine closes
+            sink(body)
+            while 1:
+                r = recvMore()
+                if not r:
+                    break
+                sink(r)
+            complete = not timedout
+            reusable = False
+
+        else:
+            # stop at the end of the body, without waiting for a close
+            sink(body)
+            got = len(body)
+            while got < length:
+                r = recvMore()
+                if not r:
+                    break
+                sink(r)
+                got += len(r)
+            complete = got >= length
+
+        return h + "".join(chunks), complete, reusable and complete
+
+
+    def recvChunked (self, data, recvMore, sink):
+        """
+        Decode a chunked body, reading more as needed, and pass its data
+        to sink as it arrives.  Returns whether the body was complete.
+        """
+        pos = 0
+        while 1:
+            while data.find("\r\n", pos) < 0:
+                r = recvMore()
+                if not r:
+                    return False
+                data = data[pos:] + r
+                pos = 0
+            e = data.find("\r\n", pos)
+            size = int( data[pos:e].split(";")[0].strip() or "0", 16 )
+            pos = e + 2
+
+            left = size
+            while left:
+                if pos >= len(data):
+                    data = recvMore()
+                    pos = 0
+                    if not data:
+                        return False
+                piece = data[pos:pos + left]
+                sink(piece)
+                pos += len(piece)
+                left -= len(piece)
+
+            # the CRLF ending each chunk, no trailers expected
+            while len(data) - pos < 2:
+                r = recvMore()
+                if not r:
+                    return False
+                data = data[pos:] + r
+                pos = 0
+            pos += 2
+
+            if size == 0:
+                return True
+
+
     def parseJSON(self, json):
         #
-        # A simpleminded "converter" from inbound json to python dicts.
+        # Convert inbound json to python dicts (or lists, etc).
         #
-        # Expect a JSON object, which of course also happens to be the
-        # same format as a python dictionary:
+        # Expect a JSON object, like:
         #  { "user": "yoda", "jid": 123, ..., "cmdline": "pixar ..." }
         #
-        # NOTE: python eval() will *fail* on strings ending in CRLF (\r\n),
-        # they must be stripped!  (by our caller, if necessary)
-        #
-        # We add local variables to stand in for the three JSON
-        # "native" types that aren't available in python, however
-        # these types aren't expected to appear in tractor data.
+        # The text is decoded by a JSON parser (see trJSONLoads), not
+        # evaluated as python, so engine replies can't run code here,
+        # and null, true and false come back as None, True and False.
         #
-        null = None
-        true = True
-        false = False
-
-        return eval( json )
+        return trJSONLoads( json )
 
 
     def Debug (self, txt):
@@ -230,6 +787,67 @@ class TrHttpRPC(object):
 
 ## ------------------------------------------------------------- ##
 
+def trTransactAll (calls, maxconcurrent=8):
+    '''
+    Make several tractor requests at once, on at most maxconcurrent
+    threads, rather than waiting on each round trip in turn.  calls
+    is a list of (label, function, args), each function returning
+    (errcode, outdata) like TrHttpRPC.Transaction, and bounded in time
+    by its TrHttpRPC timeout.  Returns (label, errcode, outdata) for
+    every call, in the order of calls, whatever the others' results;
+    an exception raised by a call is returned as errcode -1.
+    '''
+    results = [None] * len(calls)
+    pending = iter( enumerate(calls) )
+    lock = threading.Lock()
+
+    def work ():
+        while 1:
+            with lock:
+                try:
+                    i, (label, function, args) = pending.next()
+                except StopIteration:
+                    return
+            try:
+                errcode, outdata = function(*args)
+            except Exception:
+                errclass, excobj = sys.exc_info()[:2]
+                errcode = -1
+                outdata = "%s - %s" % (errclass.__name__, str(excobj))
+            results[i] = (label, errcode, outdata)
+
+    threads = []
+    for n in range( min(maxconcurrent, len(calls)) ):
+        t = threading.Thread(target=work)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        # joined with a time-out, so that ^C still interrupts the wait
+        while t.isAlive():
+            t.join(0.5)
+
+    return results
+
+
+def trReportAll (results):
+    '''
+    Print the outcome of each of a batch of requests from trTransactAll,
+    failures to stderr, and return 0 if all succeeded, else the errcode
+    of the first failure.
+    '''
+    rc = 0
+    for label, errcode, outdata in results:
+        if errcode:
+            print >>sys.stderr, "%s: %s" % (label, outdata)
+            rc = rc or errcode
+        else:
+            print "%s: %s" % (label, outdata or "OK")
+    return rc
+
+## ------------------------------------------------------------- ##
+
 
 sys.path.insert(1, os.path.join(sys.path[0], "blade-modules"))
 
@@ -314,7 +932,8 @@ def Spool (argv):
 
     optparser.add_option("--jdelete", dest="jdel_id",
             type="string", default=None,
-            help="delete the requested job from the queue")
+            help="delete the requested job from the queue, or several "
+                 "comma-separated jobs")
 
     optparser.set_defaults(loglevel=1)
     optparser.add_option("-v",
@@ -328,6 +947,22 @@ def Spool (argv):
             action="store_true", default=False,
             help="submit job in paused mode")
 
+    optparser.add_option("--keepalive", dest="keepalive",
+            action="store_true", default=False,
+            help="reuse HTTP/1.1 connections to the engine across requests, "
+                 "rather than connecting for each one")
+
+    optparser.add_option("--parallel", dest="parallel",
+            type="int", default=1,
+            help="number of jobs spooled (or deleted) at once; by default "
+                 "they are spooled one at a time, stopping at the first "
+                 "failure, rather than all attempted")
+
+    optparser.add_option("--timeout", dest="timeout",
+            type="float", default=30.0,
+            help="seconds to wait on the engine for each request, "
+                 "default: 30")
+
     rc = 0
     xcpt = None
 
@@ -338,6 +973,11 @@ def Spool (argv):
             if len(jobfiles) > 0:
                 optparser.error("too many arguments for jdelete")
                 return 1
+
+            jids = options.jdel_id.split(",")
+            if len(jids) > 1:
+                return trReportAll( jobDeleteAll(jids, options,
+                                                 max(options.parallel, 1)) )
             else:
                 return jobDelete(options)
 
@@ -375,6 +1015,8 @@ def Spool (argv):
             rc = createRibRenderJob(jobfiles, options)
             if rc == 0:
                 rc, xcpt = jobSpool(jobfiles[0], options)
+        elif options.parallel > 1 and len(jobfiles) > 1:
+            rc = trReportAll( jobSpoolAll(jobfiles, options, options.parallel) )
         else:
             for filename in jobfiles:
                 rc, xcpt = jobSpool(filename, options)
@@ -432,7 +1074,19 @@ def jobSpool (jobfile, options):
         'X-Tractor-Priority':   str(options.priority)
     }
 
-    return TrHttpRPC(options.mtdhost,0).Transaction("spool",alfdata,None,hdrs)
+    return TrHttpRPC(options.mtdhost,0,
+                keepalive=getattr(options, "keepalive", False),
+                timeout=getattr(options, "timeout", 30.0)).Transaction(
+                    "spool",alfdata,None,hdrs)
+
+
+def jobSpoolAll (jobfiles, options, maxconcurrent=8):
+    '''
+    Transfer several jobs to the queue at once, see trTransactAll.
+    Returns (jobfile, errcode, outdata) for each of jobfiles, in order.
+    '''
+    return trTransactAll( [(f, jobSpool, (f, options)) for f in jobfiles],
+                          maxconcurrent )
 
 ## ------------------------------------------------------------- ##
 
@@ -489,11 +1143,7 @@ def jobDelete (options):
     '''
     sjid = str( options.jdel_id )
 
-    q = "queue?q=jdelete&jid=" + sjid
-    q += "&user=" + options.user
-    q += "&hnm=" + options.hname
-
-    rc, msg = TrHttpRPC(options.mtdhost,0).Transaction(q)
+    rc, msg = jobDeleteRequest(sjid, options)
 
     if 0 == rc:
         print "J" + sjid + " delete OK"
@@ -503,6 +1153,29 @@ def jobDelete (options):
     return rc
 
 
+def jobDeleteRequest (jid, options):
+    '''
+    Request that a job be deleted from the tractor queue, returning
+    (errcode, outdata) like TrHttpRPC.Transaction.
+    '''
+    q = "queue?q=jdelete&jid=" + str(jid)
+    q += "&user=" + options.uname
+    q += "&hnm=" + options.hname
+
+    return TrHttpRPC(options.mtdhost,0,
+                keepalive=getattr(options, "keepalive", False),
+                timeout=getattr(options, "timeout", 30.0)).Transaction(q, None)
+
+
+def jobDeleteAll (jids, options, maxconcurrent=8):
+    '''
+    Request that several jobs be deleted at once, see trTransactAll.
+    Returns ("J" + jid, errcode, outdata) for each of jids, in order.
+    '''
+    return trTransactAll( [("J" + str(jid), jobDeleteRequest, (jid, options))
+                            for jid in jids], maxconcurrent )
+
+
 ## ------------------------------------------------------------- ##
 
 def getSceneFilename():
@@ -0,0 +1,358 @@
+#
+#
+#  Copyright (c) 2014, 2015, 2016, 2017 Psyop Media Company, LLC
+#  See license.txt
+#
+#
+
+""" Performance benchmarks for Cryptomatte, runnable without Nuke.
+
+Times hashing, manifest parsing, wildcard expansion, MatteList edits, CSV
+encoding and decoding and expression building, for manifests of 10^2, 10^4
+and 10^6 names by default, and saves the results as JSON. Comparing to the
+results of another version shows regressions:
+
+    python cryptomatte_benchmarks.py --output 1.4.0.json
+    python cryptomatte_benchmarks.py --compare 1.4.0.json
+
+Outside of Nuke, a stand-in nuke module is installed (see stub_nuke), with
+only what cryptomatte_utilities needs outside of gizmos.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+
+DEFAULT_SIZES = [100, 10000, 1000000]
+DEFAULT_REPEAT = 3
+REGRESSION_RATIO = 1.2  # slower than this times the baseline is a regression
+MIN_COMPARED_SECONDS = 0.001  # shorter timings are too noisy to compare
+MATTELIST_EDITS = 20
+CHANNELS = ["cryptoObject00", "cryptoObject01", "cryptoObject02"]
+PATH_PARTS = ["chr", "env", "prop", "hero", "crowd", "tree", "rock", "leaf", "GEO", "Shape"]
+
+
+#############################################
+# Setup
+#############################################
+
+def stub_nuke():
+    """ Installs a stand-in nuke module if Nuke's can't be imported. Returns True if it did. """
+    try:
+        import nuke
+        return False
+    except ImportError:
+        pass
+
+    import types
+
+    class Gizmo(object):
+        pass
+
+    nuke = types.ModuleType("nuke")
+    nuke.GUI = False
+    nuke.NUKE_VERSION_MAJOR = 0
+    nuke.Gizmo = Gizmo
+    nuke.thisView = lambda: "main"
+    nuke.frame = lambda: 1
+    sys.modules["nuke"] = nuke
+    return True
+
+
+def make_names(count, seed=0):
+    """ Returns count unique asset-path-like names, in random order. """
+    rng = random.Random(seed)
+    names = [
+        "%s_%s/%s_%07d" % (rng.choice(PATH_PARTS), rng.randint(0, 99), rng.choice(PATH_PARTS), i)
+        for i in range(count)
+    ]
+    rng.shuffle(names)
+    return names
+
+
+#############################################
+# Benchmarks
+#############################################
+# Each takes a Context and returns the function to time, so setup isn't timed.
+
+class Context(object):
+    """ Names and manifests of one size, shared by the benchmarks. """
+
+    def __init__(self, size, temp_dir):
+        import cryptomatte_manifest
+
+        self.size = size
+        self.temp_dir = temp_dir
+        self.names = make_names(size)
+        id_bits = cryptomatte_manifest.cryptomatte_id_bits(self.names)
+        self.manifest = dict((name, "%08x" % bits) for name, bits in zip(self.names, id_bits))
+        self.manifest_str = json.dumps(self.manifest)
+        self._sidecar = None
+
+    @property
+    def sidecar(self):
+        if self._sidecar is None:
+            self._sidecar = os.path.join(self.temp_dir, "manifest_%s.json" % self.size)
+            with open(self._sidecar, "w") as f:
+                f.write(self.manifest_str)
+        return self._sidecar
+
+
+def bench_hash_names(context):
+    import cryptomatte_utilities as cu
+
+    def run():
+        cu.clear_hash_caches()
+        cu.mm3hash_floats(context.names)
+    return run
+
+
+def bench_hash_id_bits(context):
+    import cryptomatte_manifest
+    return lambda: cryptomatte_manifest.cryptomatte_id_bits(context.names)
+
+
+def bench_manifest_json(context):
+    import cryptomatte_manifest
+    return lambda: cryptomatte_manifest.manifest_to_dicts(json.loads(context.manifest_str))
+
+
+def bench_manifest_index(context):
+    import cryptomatte_manifest
+    manifest = json.loads(context.manifest_str)
+    return lambda: cryptomatte_manifest.ManifestIndex.from_manifest(manifest).to_dicts()
+
+
+def bench_sidecar_stream(context):
+    import cryptomatte_manifest
+    sidecar = context.sidecar
+    return lambda: cryptomatte_manifest.stream_manifest_index(sidecar)
+
+
+def bench_wildcard_expand(context):
+    import cryptomatte_utilities as cu
+    manifest = dict.fromkeys(context.names, 0.0)
+    patterns = ["hero_*", "*/tree_*", "*_00000??", "env_1?/*"]
+
+    def run():
+        cu.reset_manifest_cache()
+        key = ("/benchmark.exr", "0000000", context.size)
+        for pattern in patterns:
+            cu.glob_manifest_names(manifest, pattern, key)
+    return run
+
+
+def bench_mattelist_build(context):
+    import cryptomatte_utilities as cu
+
+    def run():
+        ml = cu.MatteList("")
+        for name in context.names:
+            ml.add(name)
+        return ml.to_nukestr
+    return run
+
+
+def bench_mattelist_edits(context):
+    """ Picking on a long list: each edit is followed by what the gizmo needs. """
+    import cryptomatte_utilities as cu
+    ml = cu.MatteList("")
+    ml._add_mattestrs(ml.encode_rawstr_to_mattestr(x) for x in context.names)
+    ml.to_nukestr
+    ml.IDs
+    picks = make_names(MATTELIST_EDITS, seed=1)
+
+    def run():
+        for name in picks:
+            ml.add("picked/" + name)
+            ml.to_nukestr
+            ml.IDs
+        for name in picks:
+            ml.remove("picked/" + name)
+            ml.to_nukestr
+    return run
+
+
+def bench_csv_encode(context):
+    import cryptomatte_utilities as cu
+    encoder = cu.StringEncoder()
+    mattestrs = [encoder.encode_rawstr_to_mattestr(x) for x in context.names]
+    return lambda: encoder.encode_csvstr_to_nukestr(encoder.encode_mattestr_to_csv(mattestrs))
+
+
+def bench_csv_decode(context):
+    import cryptomatte_utilities as cu
+    encoder = cu.StringEncoder()
+    nukestr = encoder.encode_csvstr_to_nukestr(encoder.encode_mattestr_to_csv(context.names))
+    return lambda: encoder.decode_csvstr_to_mattestrs(encoder.decode_nukestr_to_csv(nukestr))
+
+
+def bench_expression_build(context):
+    import cryptomatte_utilities as cu
+    IDs = cu.mm3hash_floats(context.names)
+    known_IDs = sorted(set(IDs))
+    selected = random.Random(0).sample(IDs, max(1, len(IDs) // 2))
+    return lambda: cu._compile_extraction_expressions(CHANNELS, selected, known_IDs=known_IDs)
+
+
+BENCHMARKS = [
+    ("hash_names", bench_hash_names),
+    ("hash_id_bits", bench_hash_id_bits),
+    ("manifest_json", bench_manifest_json),
+    ("manifest_index", bench_manifest_index),
+    ("sidecar_stream", bench_sidecar_stream),
+    ("wildcard_expand", bench_wildcard_expand),
+    ("mattelist_build", bench_mattelist_build),
+    ("mattelist_edits", bench_mattelist_edits),
+    ("csv_encode", bench_csv_encode),
+    ("csv_decode", bench_csv_decode),
+    ("expression_build", bench_expression_build),
+]
+
+
+def benchmark_extraction_expressions(matte_counts=(10, 100, 1000, 2000, 10000), 
+                                     num_channels=3, manifest_ratio=2):
+    """ Prints the size and build time of extraction expressions against the number of
+    mattes: ID by ID in one piece, and compiled with ranges and split into parts. 
+    Mattes are a random selection of a manifest manifest_ratio times bigger. 
+    Returns the results as a list of dicts. 
+    """
+    import cryptomatte_utilities as cu
+
+    channel_list = ["cryptoObject%02d" % i for i in range(num_channels)]
+    rng = random.Random(0)
+    results = []
+    for count in matte_counts:
+        manifest_IDs = sorted(set(cu.mm3hash_floats(["object_%s" % i for i in range(count * manifest_ratio)])))
+        IDs = rng.sample(manifest_IDs, count)
+
+        start = time.time()
+        single = cu._build_extraction_expression(channel_list, IDs)
+        single_time = time.time() - start
+        start = time.time()
+        parts = cu._compile_extraction_expressions(channel_list, IDs, known_IDs=manifest_IDs)
+        compiled_time = time.time() - start
+
+        result = {
+            "mattes": count,
+            "single_length": len(single),
+            "single_seconds": single_time,
+            "compiled_length": sum(len(x) for x in parts),
+            "compiled_longest_part": max(len(x) for x in parts),
+            "compiled_parts": len(parts),
+            "compiled_seconds": compiled_time,
+        }
+        results.append(result)
+        print(("%(mattes)8d mattes: single %(single_length)10d chars %(single_seconds)7.3fs, "
+               "compiled %(compiled_length)10d chars in %(compiled_parts)d parts "
+               "(longest %(compiled_longest_part)d) %(compiled_seconds)7.3fs") % result)
+    return results
+
+
+#############################################
+# Running and comparing
+#############################################
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, only=None, out=None):
+    """ Runs the benchmarks at each size. Returns the results as a dict, with the best
+    of repeat timings in seconds under "results", by benchmark and size.
+
+    only -- names of benchmarks to run, all if not given.
+    out -- a file to print progress to.
+    """
+    stub_nuke()
+    import cryptomatte_utilities as cu
+    import cryptomatte_manifest
+    import pymmh3
+
+    results = {}
+    temp_dir = tempfile.mkdtemp(prefix="cryptomatte_benchmarks_")
+    try:
+        for size in sizes:
+            context = Context(size, temp_dir)
+            for name, benchmark in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                run = benchmark(context)
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    run()
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                results.setdefault(name, {})[str(size)] = best
+                if out is not None:
+                    out.write("%-18s %9d names %10.4fs\n" % (name, size, best))
+                    out.flush()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        cu.reset_manifest_cache()
+        cu.clear_hash_caches()
+
+    return {
+        "version": cu.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": cryptomatte_manifest.np is not None,
+        "hash_backend": pymmh3.get_backend(),
+        "sizes": list(sizes),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare_results(results, baseline, ratio=REGRESSION_RATIO):
+    """ Returns (benchmark, size, seconds, baseline seconds) for the timings slower
+    than ratio times the baseline's. Timings missing from either are skipped, as
+    are very short ones.
+    """
+    regressions = []
+    for name, timings in sorted(results["results"].items()):
+        baseline_timings = baseline.get("results", {}).get(name, {})
+        for size, seconds in sorted(timings.items(), key=lambda x: int(x[0])):
+            base = baseline_timings.get(size)
+            if base is None or max(seconds, base) < MIN_COMPARED_SECONDS:
+                continue
+            if seconds > base * ratio:
+                regressions.append((name, int(size), seconds, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cryptomatte performance benchmarks, without Nuke.")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+        help="numbers of names (default: %s)" % " ".join(str(x) for x in DEFAULT_SIZES))
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+        help="runs of each benchmark, the best is kept (default: %s)" % DEFAULT_REPEAT)
+    parser.add_argument("-b", "--benchmark", action="append", dest="benchmarks",
+        choices=[x[0] for x in BENCHMARKS], help="only run this benchmark, may be repeated")
+    parser.add_argument("-o", "--output", help="json file to save the results to")
+    parser.add_argument("-c", "--compare", help="json results to compare to")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO,
+        help="slowdown counted as a regression (default: %s)" % REGRESSION_RATIO)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.benchmarks, out=sys.stdout)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.ratio)
+        for name, size, seconds, base in regressions:
+            sys.stdout.write("Regression: %s at %d names, %.4fs, was %.4fs (%s)\n" % (
+                name, size, seconds, base, baseline.get("version", args.compare)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
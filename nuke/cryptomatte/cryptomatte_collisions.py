@@ -0,0 +1,321 @@
+#
+#
+#  Copyright (c) 2014, 2015, 2016, 2017 Psyop Media Company, LLC
+#  See license.txt
+#
+#
+
+""" A database of Cryptomatte names and IDs across shots, to find hash collisions
+between manifests, without Nuke.
+
+Two names hashing to the same ID can't be keyed apart. Validating a manifest
+(see cryptomatte_validate) only finds collisions within it, but assets are reused
+across shots, and may collide with names from other renders. Manifests of rendered
+frames are ingested into an SQLite database, eg. as a post-render farm task:
+
+    python cryptomatte_collisions.py ingest names.db /renders/shot.####.exr --frames 1001-1100
+
+and it's asked whether names or IDs collide with any name seen anywhere:
+
+    python cryptomatte_collisions.py check names.db --name bunny --id 3f2a6f1c
+    python cryptomatte_collisions.py collisions names.db
+
+Names are indexed by ID, so lookups are O(log n) in the number of names, and
+colliding IDs are noted as names are added, so listing them doesn't scan. Manifests
+are ingested once, by the same keys cryptomatte_validate uses (sidecar path, mtime
+and size, or manifest contents), so ingesting a frame range of a shot sharing one
+manifest only loads and adds it once.
+"""
+
+import sys
+import time
+import sqlite3
+import argparse
+import multiprocessing
+
+import cryptomatte_manifest
+import cryptomatte_validate
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS manifests ("
+    "key TEXT PRIMARY KEY, layer TEXT, path TEXT, names INTEGER, added REAL)",
+    "CREATE TABLE IF NOT EXISTS names ("
+    "id INTEGER NOT NULL, name TEXT NOT NULL, manifest INTEGER, "
+    "PRIMARY KEY (id, name)) WITHOUT ROWID",
+    # IDs of more than one name, noted as names are added
+    "CREATE TABLE IF NOT EXISTS colliding (id INTEGER PRIMARY KEY)",
+    "CREATE TRIGGER IF NOT EXISTS note_collision BEFORE INSERT ON names "
+    "WHEN EXISTS (SELECT 1 FROM names WHERE id = NEW.id AND name != NEW.name) "
+    "BEGIN INSERT OR IGNORE INTO colliding (id) VALUES (NEW.id); END",
+]
+
+
+#############################################
+# Database
+#############################################
+
+class CollisionDatabase(object):
+    """ Names and IDs of ingested manifests, in an SQLite database. IDs are the uint32
+    bits of cryptomatte IDs (see cryptomatte_manifest.cryptomatte_id_bits).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+
+    def has_manifest(self, key):
+        return self.connection.execute(
+            "SELECT 1 FROM manifests WHERE key = ?", (_text(key),)).fetchone() is not None
+
+    def add_manifest(self, key, names, id_bits, layer="", path=""):
+        """ Adds the names and IDs of a manifest, once per key, in one transaction.
+        Returns the number of names that weren't in the database yet, or None if 
+        the manifest was already added. Names may be text or utf-8 bytes, and are 
+        stored as text. 
+        """
+        if self.has_manifest(key):
+            return None
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO manifests (key, layer, path, names, added) VALUES (?, ?, ?, ?, ?)",
+                (_text(key), _text(layer), _text(path), len(names), time.time()))
+            manifest = cursor.lastrowid
+            # in ID order, appending to the index rather than inserting all over it
+            rows = sorted((int(id_value), _text(name), manifest) for name, id_value in zip(names, id_bits))
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO names (id, name, manifest) VALUES (?, ?, ?)", rows)
+            return cursor.rowcount
+
+    def names_for_id(self, id_value):
+        """ Returns the names with an ID, as text, sorted. """
+        return [row[0] for row in self.connection.execute(
+            "SELECT name FROM names WHERE id = ? ORDER BY name", (int(id_value),))]
+
+    def collides(self, name):
+        """ Returns the other names with the same ID as name (text or utf-8 bytes), if any. """
+        name = _text(name)
+        id_value = _id_bits([name])[0]
+        return [x for x in self.names_for_id(id_value) if x != name]
+
+    def collisions(self, id_bits=None):
+        """ Returns the IDs shared by more than one name, as (hex ID, sorted names).
+        Only those of id_bits are returned, if given. 
+        """
+        rows = self.connection.execute(
+            "SELECT names.id, names.name FROM colliding JOIN names ON names.id = colliding.id "
+            "ORDER BY names.id, names.name")
+        if id_bits is not None:
+            id_bits = set(int(x) for x in id_bits)
+            rows = (row for row in rows if row[0] in id_bits)
+        return _group_rows(rows)
+
+    def sources(self, id_value):
+        """ Returns the (name, layer, path) that each name with an ID was first ingested from. """
+        return self.connection.execute(
+            "SELECT names.name, manifests.layer, manifests.path FROM names "
+            "LEFT JOIN manifests ON manifests.rowid = names.manifest "
+            "WHERE names.id = ? ORDER BY names.name", (int(id_value),)).fetchall()
+
+
+def _text(string):
+    """ Decodes utf-8 bytes, as Python 2 manifest names are: sqlite3 refuses byte 
+    strings that aren't ascii. 
+    """
+    return string.decode("utf-8") if isinstance(string, bytes) else string
+
+
+def _id_bits(names):
+    """ cryptomatte_id_bits of text names, hashed as utf-8 as on Python 2 they must be. """
+    return cryptomatte_manifest.cryptomatte_id_bits([x.encode("utf-8") for x in names])
+
+
+def _write(out, text):
+    if sys.version_info < (3, 0) and not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    out.write(text)
+
+
+def _group_rows(rows):
+    grouped = []
+    for id_value, name in rows:
+        hex_id = "%08x" % id_value
+        if grouped and grouped[-1][0] == hex_id:
+            grouped[-1][1].append(name)
+        else:
+            grouped.append((hex_id, [name]))
+    return grouped
+
+
+#############################################
+# Ingesting
+#############################################
+
+def load_manifest(job):
+    """ Loads one manifest in a worker. Returns (key, layer, path, names, id_bits, error). """
+    key, layer, path, source = job
+    try:
+        index = cryptomatte_validate.load_source(source)
+    except cryptomatte_validate.READ_ERRORS as e:
+        return key, layer, path, [], [], "unable to read manifest from %s: %s" % (source[1], e)
+    return key, layer, path, index.names(), index.id_bits(), None
+
+
+def ingest_files(database, paths, jobs=None, layer_names=None):
+    """ Adds the manifests of EXR files to a CollisionDatabase, skipping those already
+    in it. Returns a report dict of files, manifests (added), skipped (manifests
+    already in the database), names (added), errors, collisions (of the added
+    manifests' IDs, see CollisionDatabase.collisions) and seconds.
+
+    jobs -- number of processes reading files, defaulting to the number of CPUs.
+    layer_names -- only ingest these layers, if given.
+    """
+    start = time.time()
+    report = {"files": len(paths), "manifests": 0, "skipped": 0, "names": 0,
+              "errors": [], "collisions": []}
+    jobs = jobs or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and len(paths) > 1 else None
+    try:
+        sources = {}
+        for path, layers, error in cryptomatte_validate._map(cryptomatte_validate.scan_file, paths, pool):
+            if error:
+                report["errors"].append(error)
+            for layer in layers:
+                if layer_names and layer["name"] not in layer_names:
+                    continue
+                report["errors"].extend("%s: %s" % (path, x) for x in layer["errors"])
+                key = layer["key"]
+                if not key or key in sources:
+                    continue
+                if database.has_manifest(key):
+                    report["skipped"] += 1
+                    sources[key] = None
+                else:
+                    sources[key] = (key, layer["name"], path, layer["source"])
+
+        load_jobs = [x for x in sources.values() if x is not None]
+        if pool is not None and len(load_jobs) > 1:
+            loaded = pool.imap_unordered(load_manifest, load_jobs)
+        else:
+            loaded = (load_manifest(x) for x in load_jobs)
+
+        seen = {}
+        for key, layer, path, names, id_bits, error in loaded:
+            if error:
+                report["errors"].append(error)
+                continue
+            added = database.add_manifest(key, names, id_bits, layer, path)
+            if added is None:
+                report["skipped"] += 1
+                continue
+            for hex_id, colliding in database.collisions(id_bits):
+                seen[hex_id] = colliding
+            report["manifests"] += 1
+            report["names"] += added
+        report["collisions"] = sorted(seen.items())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    report["seconds"] = time.time() - start
+    return report
+
+
+#############################################
+# Command line
+#############################################
+
+def print_collisions(database, collisions, out=None, limit=None):
+    out = out or sys.stdout
+    for hex_id, names in collisions[:limit]:
+        _write(out, u"collision: %s shared by %s\n" % (hex_id, u", ".join(
+            u"%s (%s, %s)" % x for x in database.sources(int(hex_id, 16)))))
+    if limit is not None and len(collisions) > limit:
+        out.write("... and %d more\n" % (len(collisions) - limit))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Finds Cryptomatte hash collisions across shots, from a database of manifests.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingest = subparsers.add_parser("ingest", help="add the manifests of EXR files")
+    ingest.add_argument("database", help="SQLite database, created if missing")
+    ingest.add_argument("paths", nargs="+",
+        help="EXR files, with #### or %%04d standing for the frame number")
+    ingest.add_argument("-f", "--frames", help="frame range, eg. 1001-1100, 1-99x2 or 1,5,10-20")
+    ingest.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of processes (default: number of CPUs)")
+    ingest.add_argument("-l", "--layer", action="append", dest="layers",
+        help="only ingest this layer, may be repeated")
+
+    check = subparsers.add_parser("check", help="look up names and IDs")
+    check.add_argument("database")
+    check.add_argument("-n", "--name", action="append", dest="names", default=[],
+        help="name to check, may be repeated")
+    check.add_argument("-i", "--id", action="append", dest="ids", default=[],
+        help="ID to check, as 8 hex digits as in manifests, may be repeated")
+
+    collisions = subparsers.add_parser("collisions", help="list every collision")
+    collisions.add_argument("database")
+
+    for subparser in (ingest, collisions):
+        subparser.add_argument("-v", "--verbose", action="store_true", help="list every collision")
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("a command is needed")
+
+    with CollisionDatabase(args.database) as database:
+        if args.command == "ingest":
+            try:
+                frames = cryptomatte_validate.parse_frame_range(args.frames) if args.frames else None
+                paths = [x for path in args.paths for x in cryptomatte_validate.expand_frames(path, frames)]
+            except ValueError as e:
+                parser.error(str(e))
+            report = ingest_files(database, paths, jobs=args.jobs, layer_names=args.layers)
+            for error in report["errors"]:
+                _write(sys.stdout, u"error: %s\n" % _text(error))
+            sys.stdout.write(("%(files)d files, %(manifests)d manifests added, %(skipped)d already "
+                "ingested, %(names)d names added in %(seconds).2fs\n") % report)
+            limit = None if args.verbose else cryptomatte_validate.MAX_LISTED_PROBLEMS
+            print_collisions(database, report["collisions"], limit=limit)
+            return 1 if report["errors"] or report["collisions"] else 0
+
+        if args.command == "collisions":
+            found = database.collisions()
+            limit = None if args.verbose else cryptomatte_validate.MAX_LISTED_PROBLEMS
+            print_collisions(database, found, limit=limit)
+            return 1 if found else 0
+
+        try:
+            lookups = [(x, int(x, 16)) for x in args.ids]
+        except ValueError as e:
+            parser.error("Invalid ID: %s" % e)
+        checked_names = [_text(x) for x in args.names]
+        lookups += zip(checked_names, _id_bits(checked_names))
+
+        collided = False
+        for label, id_value in lookups:
+            names = database.names_for_id(id_value)
+            if len(names) > 1 or (label in checked_names and [x for x in names if x != label]):
+                collided = True
+            _write(sys.stdout, u"%s (%08x): %s\n" % (_text(label), id_value, u", ".join(names) or u"not found"))
+        return 1 if collided else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
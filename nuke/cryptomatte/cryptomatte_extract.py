@@ -0,0 +1,377 @@
+#
+#
+#  Copyright (c) 2014, 2015, 2016, 2017 Psyop Media Company, LLC
+#  See license.txt
+#
+#
+
+""" Extracts Cryptomatte mattes and ID-coloured previews with numpy, without Nuke, 
+eg. for farm jobs and dailies.
+
+The semantics are the gizmo's extraction expression: each cryptomatte channel
+(rank pair) holds IDs in red and blue, and their coverage in green and alpha.
+The matte is the summed coverage of every rank whose ID is selected.
+
+    import cryptomatte_extract
+    mattes = cryptomatte_extract.extract_files(
+        ["shot.1001.exr", "shot.1002.exr"], "cryptoObject", ["bunny", "heroflower"], jobs=4)
+
+Previews colour each pixel's top ranks by ID, blended by coverage, as the
+gizmo's Colors preview does:
+
+    cryptomatte_extract.preview_files(
+        paths, "cryptoObject", writer=cryptomatte_extract.OpenEXRWriter("{base}.preview.exr"))
+
+EXR files are read through a pluggable reader (see register_exr_reader), the
+default one using the OpenEXR python bindings.
+"""
+
+import os
+import re
+import multiprocessing
+
+import numpy as np
+
+import cryptomatte_manifest
+
+CHANNEL_COMPONENTS = {
+    "R": 0, "G": 1, "B": 2, "A": 3,
+    "r": 0, "g": 1, "b": 2, "a": 3,
+    "red": 0, "green": 1, "blue": 2, "alpha": 3,
+}
+NUMBERED_MATTE_RE = re.compile(r"^<(.*)>$")
+
+PREVIEW_RANKS = 4  # as many as the gizmo's preview blends
+PREVIEW_COLOR_FACTORS = (1, 16, 64)
+
+
+#############################################
+# Extraction
+#############################################
+
+def extract_matte(ranks, IDs):
+    """ Returns the matte of IDs, as a float32 array of the image's shape.
+
+    ranks -- the cryptomatte channels, as an array of shape (channels, height, width, 4),
+             or a list of (height, width, 4) arrays, one per channel (eg. cryptoObject00).
+    IDs -- the IDs to extract, see matte_id_bits().
+    """
+    ranks = np.asarray(ranks, dtype=np.float32)
+    if ranks.ndim != 4 or ranks.shape[-1] != 4:
+        raise ValueError("Cryptomatte channels must be of shape (channels, height, width, 4)")
+    selected = np.unique(matte_id_bits(IDs))
+
+    # IDs are compared bit for bit, all ranks at once
+    ids = np.ascontiguousarray(ranks[..., 0::2]).view(np.uint32)
+    coverage = ranks[..., 1::2]
+    mask = isin_sorted(ids, selected)
+    return np.where(mask, coverage, np.float32(0.0)).sum(axis=(0, 3), dtype=np.float32)
+
+
+def ids_by_coverage(ranks):
+    """ Returns the IDs in cryptomatte channels (see extract_matte) and their summed
+    coverage, highest first, as arrays of uint32 ID bits and float64 coverage.
+    Ranks without an ID or coverage (the background) are skipped.
+    """
+    ranks = np.asarray(ranks, dtype=np.float32)
+    if ranks.ndim != 4 or ranks.shape[-1] != 4:
+        raise ValueError("Cryptomatte channels must be of shape (channels, height, width, 4)")
+    ids = ranks[..., 0::2]
+    coverage = ranks[..., 1::2]
+    mask = (ids != 0.0) & (coverage != 0.0)
+
+    unique, inverse = np.unique(
+        np.ascontiguousarray(ids[mask]).view(np.uint32), return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=coverage[mask], minlength=len(unique))
+    order = np.argsort(-totals, kind="mergesort")
+    return unique[order], totals[order]
+
+
+def isin_sorted(values, sorted_unique):
+    """ Same as np.isin(values, sorted_unique), by binary search. np.isin sorts the 
+    values too, which for the millions of IDs of a frame is about twice as slow. 
+    """
+    if not len(sorted_unique):
+        return np.zeros(values.shape, dtype=bool)
+    positions = np.searchsorted(sorted_unique, values)
+    positions[positions == len(sorted_unique)] = 0
+    return sorted_unique[positions] == values
+
+
+def matte_id_bits(mattes):
+    """ Returns the IDs of mattes as uint32 bit patterns.
+
+    mattes may be a MatteList (or anything with IDs), a uint32 array of ID bits, 
+    or a list of float IDs, names, and numbered mattes as in matte lists 
+    (eg. "<1.5e-10>"). 
+    """
+    if hasattr(mattes, "IDs"):
+        mattes = mattes.IDs
+    if isinstance(mattes, np.ndarray) and mattes.dtype == np.uint32:
+        return mattes
+    floats = []
+    names = []
+    for matte in mattes:
+        if not isinstance(matte, cryptomatte_manifest.STRING_TYPES):
+            floats.append(float(matte))
+            continue
+        match = NUMBERED_MATTE_RE.match(matte)
+        try:
+            floats.append(float(match.group(1)))
+        except (AttributeError, ValueError):
+            names.append(matte)
+    bits = np.array(floats, dtype=np.float32).view(np.uint32)
+    hashed = np.array(cryptomatte_manifest.cryptomatte_id_bits(names), dtype=np.uint32)
+    return np.concatenate([bits, hashed])
+
+
+def stack_ranks(channels, layer):
+    """ Stacks a layer's cryptomatte channels, eg. {"cryptoObject00.R": array, ...},
+    into an array of shape (channels, height, width, 4), in channel order.
+    """
+    channel_re = re.compile(r"^%s(\d+)\.(\w+)$" % re.escape(layer))
+    found = {}
+    for name, values in channels.items():
+        match = channel_re.match(name)
+        if match and match.group(2) in CHANNEL_COMPONENTS:
+            found.setdefault(match.group(1), {})[CHANNEL_COMPONENTS[match.group(2)]] = values
+    if not found:
+        raise ValueError("No cryptomatte channels found for %s" % layer)
+
+    ranks = []
+    for number in sorted(found, key=int):
+        components = found[number]
+        if len(components) != 4:
+            raise ValueError("Incomplete cryptomatte channel %s%s" % (layer, number))
+        ranks.append(np.stack([components[i] for i in range(4)], axis=-1))
+    return np.stack(ranks).astype(np.float32, copy=False)
+
+
+#############################################
+# Previews
+#############################################
+
+def id_colors(ids, mode="colors"):
+    """ Returns the preview colours of IDs, float32 IDs or their uint32 bits, as a float32
+    array of shape ids.shape + (3,).
+
+    mode -- "colors", the gizmo's Colors preview: mantissa(abs(ID)) * factor % 0.25, 
+            for factors of 1, 16 and 64, 
+            or "rgb", as id_to_rgb() in cryptomatte_utilities: no red, and the ID's bits 
+            shifted left by 8 and 16 bits, over 2^32 - 1, for green and blue. 
+    """
+    ids = np.ascontiguousarray(ids)
+    if ids.dtype == np.uint32:
+        bits = ids
+    else:
+        bits = ids.astype(np.float32).view(np.uint32)
+
+    if mode == "colors":
+        mantissa = np.frexp(np.abs(bits.view(np.float32)))[0]
+        colors = [np.mod(mantissa * np.float32(x), np.float32(0.25)) for x in PREVIEW_COLOR_FACTORS]
+    elif mode == "rgb":
+        mask = float(2 ** 32 - 1)
+        colors = [
+            np.zeros(bits.shape, dtype=np.float32),
+            ((bits << np.uint32(8)) / mask).astype(np.float32),
+            ((bits << np.uint32(16)) / mask).astype(np.float32),
+        ]
+    else:
+        raise ValueError("Unknown preview mode: %s" % mode)
+    return np.stack(colors, axis=-1)
+
+
+def preview_image(ranks, top=PREVIEW_RANKS, mode="colors"):
+    """ Returns the ID-coloured preview of cryptomatte channels (see extract_matte), 
+    as a float32 array of shape (height, width, 4): the colours (see id_colors) of the 
+    IDs of the top ranks, blended by coverage, and their summed coverage as alpha. 
+
+    top -- the number of ranks (two per channel) to blend, highest coverage first. 
+    """
+    ranks = np.asarray(ranks, dtype=np.float32)
+    if ranks.ndim != 4 or ranks.shape[-1] != 4:
+        raise ValueError("Cryptomatte channels must be of shape (channels, height, width, 4)")
+    ranks = ranks[:-(-top // 2)]
+
+    # ranks in order: the red/green, then blue/alpha of each channel
+    def in_rank_order(components):
+        return np.moveaxis(components, -1, 1).reshape((-1,) + ranks.shape[1:3])[:top]
+
+    ids = in_rank_order(ranks[..., 0::2])
+    coverage = in_rank_order(ranks[..., 1::2])
+    rgb = (id_colors(ids, mode) * coverage[..., np.newaxis]).sum(axis=0, dtype=np.float32)
+    alpha = coverage.sum(axis=0, dtype=np.float32)
+    return np.concatenate([rgb, alpha[..., np.newaxis]], axis=-1)
+
+
+#############################################
+# EXR readers and writers
+#############################################
+
+def openexr_reader(path, channel_filter):
+    """ Reads the channels of an EXR for which channel_filter(name) is true, as float32
+    arrays by name, with the OpenEXR python bindings.
+    """
+    import OpenEXR
+    import Imath
+
+    exr = OpenEXR.InputFile(path)
+    try:
+        header = exr.header()
+        window = header["dataWindow"]
+        width = window.max.x - window.min.x + 1
+        height = window.max.y - window.min.y + 1
+        names = [x for x in header["channels"] if channel_filter(x)]
+        data = exr.channels(names, Imath.PixelType(Imath.PixelType.FLOAT)) if names else []
+    finally:
+        exr.close()
+    return dict(
+        (name, np.frombuffer(buf, dtype=np.float32).reshape(height, width))
+        for name, buf in zip(names, data)
+    )
+
+
+g_exr_readers = {"openexr": openexr_reader}
+DEFAULT_EXR_READER = "openexr"
+
+
+def register_exr_reader(name, reader):
+    """ Registers an EXR reader: a function of (path, channel_filter), returning the
+    channels for which channel_filter(name) is true, as 2d float32 arrays by name.
+    Readers used with a process pool must be module level functions.
+    """
+    g_exr_readers[name] = reader
+
+
+def get_exr_reader(reader=None):
+    """ Returns a reader by name, or the default one. Functions are returned as they are. """
+    if callable(reader):
+        return reader
+    name = reader or DEFAULT_EXR_READER
+    if name not in g_exr_readers:
+        raise ValueError("Unknown EXR reader: %s" % name)
+    return g_exr_readers[name]
+
+
+class OpenEXRWriter(object):
+    """ Writes (height, width, 4) images as RGBA EXRs, with the OpenEXR python bindings. 
+    A writer for preview_files() and extract_files() (mattes are written as Y). 
+    Returns the path written. 
+
+    template -- the output path, formatted with base (the input path without its 
+                extension), dir and name (the input's directory and file name, 
+                without extension).
+    """
+
+    def __init__(self, template="{base}.preview.exr", half=True):
+        self.template = template
+        self.half = half
+
+    def output_path(self, path):
+        base = os.path.splitext(path)[0]
+        return self.template.format(base=base, dir=os.path.dirname(base), name=os.path.basename(base))
+
+    def __call__(self, path, image):
+        import OpenEXR
+        import Imath
+
+        output_path = self.output_path(path)
+        names = "RGBA" if image.ndim == 3 else "Y"
+        planes = [image[..., i] for i in range(4)] if image.ndim == 3 else [image]
+        pixel_type = Imath.PixelType(Imath.PixelType.HALF if self.half else Imath.PixelType.FLOAT)
+        dtype = np.float16 if self.half else np.float32
+
+        header = OpenEXR.Header(image.shape[1], image.shape[0])
+        header["channels"] = dict((name, Imath.Channel(pixel_type)) for name in names)
+        exr = OpenEXR.OutputFile(output_path, header)
+        try:
+            exr.writePixels(dict(
+                (name, np.ascontiguousarray(plane, dtype=dtype).tobytes())
+                for name, plane in zip(names, planes)))
+        finally:
+            exr.close()
+        return output_path
+
+
+#############################################
+# Files
+#############################################
+
+def extract_file(path, layer, mattes, reader=None):
+    """ Returns the matte of mattes (see matte_id_bits) in a layer of an EXR file. """
+    return extract_matte(read_ranks(path, layer, reader), mattes)
+
+
+def read_ranks(path, layer, reader=None):
+    """ Returns the cryptomatte channels of a layer of an EXR file (see stack_ranks). """
+    channels = get_exr_reader(reader)(path, lambda name: name.startswith(layer))
+    return stack_ranks(channels, layer)
+
+
+def preview_file(path, layer, top=PREVIEW_RANKS, mode="colors", reader=None):
+    """ Returns the preview (see preview_image) of a layer of an EXR file. Only the 
+    channels of the top ranks are read. 
+    """
+    channel_re = re.compile(r"^%s(\d+)\." % re.escape(layer))
+    num_channels = -(-top // 2)
+
+    def channel_filter(name):
+        match = channel_re.match(name)
+        return bool(match) and int(match.group(1)) < num_channels
+
+    channels = get_exr_reader(reader)(path, channel_filter)
+    return preview_image(stack_ranks(channels, layer), top, mode)
+
+
+def _extract_file_job(job):
+    path, layer, id_bits, reader, writer = job
+    matte = extract_file(path, layer, id_bits, reader)
+    if writer is not None:
+        return writer(path, matte)
+    return matte
+
+
+def _preview_file_job(job):
+    path, layer, top, mode, reader, writer = job
+    image = preview_file(path, layer, top, mode, reader)
+    if writer is not None:
+        return writer(path, image)
+    return image
+
+
+def extract_files(paths, layer, mattes, jobs=None, reader=None, writer=None):
+    """ Extracts the same mattes from a layer of many EXR files, over a process pool.
+
+    Returns the mattes in the order of paths, or, given a writer function of
+    (path, matte), what it returns for each file. Writing in the workers
+    avoids sending the mattes back. As with readers, a writer used with a
+    process pool must be a module level function.
+
+    jobs -- number of processes, defaulting to the number of CPUs. 1 runs in process.
+    """
+    # names are hashed once here, not in every worker
+    id_bits = matte_id_bits(mattes)
+    job_list = [(path, layer, id_bits, reader, writer) for path in paths]
+    return _map_jobs(_extract_file_job, job_list, jobs)
+
+
+def preview_files(paths, layer, jobs=None, reader=None, writer=None, top=PREVIEW_RANKS, mode="colors"):
+    """ Makes previews (see preview_image) of a layer of many EXR files, over a 
+    process pool. Returns the previews, or what writer returns, as extract_files() does. 
+    OpenEXRWriter writes them to EXRs. 
+    """
+    job_list = [(path, layer, top, mode, reader, writer) for path in paths]
+    return _map_jobs(_preview_file_job, job_list, jobs)
+
+
+def _map_jobs(function, job_list, jobs):
+    jobs = jobs or multiprocessing.cpu_count()
+    if jobs <= 1 or len(job_list) <= 1:
+        return [function(job) for job in job_list]
+    pool = multiprocessing.Pool(min(jobs, len(job_list)))
+    try:
+        return pool.map(function, job_list)
+    finally:
+        pool.close()
+        pool.join()
+
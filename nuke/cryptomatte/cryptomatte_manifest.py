@@ -0,0 +1,886 @@
+#
+#
+#  Copyright (c) 2014, 2015, 2016, 2017 Psyop Media Company, LLC
+#  See license.txt
+#
+#
+
+""" Cryptomatte manifest parsing, indexing and caching. 
+
+Nothing in here depends on Nuke, so it can be used by offline tools as well 
+as by cryptomatte_utilities. numpy is used when available, but is optional. 
+"""
+
+import os
+import re
+import sys
+import json
+import struct
+import bisect
+import fnmatch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MANIFEST_CACHE_DIR_ENVIRON = "CRYPTOMATTE_MANIFEST_CACHE"
+MANIFEST_CACHE_MAX_FILES = 512
+MANIFEST_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# streaming parser for sidecar manifests
+STREAM_CHUNK_SIZE = 1 << 20
+STREAM_MEMORY_LIMIT = 2 * 1024 * 1024 * 1024
+STRING_TYPES = (str, type(u""))
+
+# compiled fnmatch patterns kept by compile_glob()
+GLOB_CACHE_SIZE = 1024
+GLOB_SPECIAL_CHARS = "*?["
+
+EXR_MAGIC = 20000630
+EXR_MULTIPART_FLAG = 0x1000
+EXR_MAX_NAME_LENGTH = 256
+EXR_HEADER_CHUNK_SIZE = 16 * 1024
+EXR_HEADER_CACHE_SIZE = 4096
+CRYPTOMATTE_HASH = "MurmurHash3_32"
+CRYPTOMATTE_CONVERSION = "uint32_to_float32"
+
+# characters JSON escapes, in names appended to Encryptomatte manifests
+JSON_ESCAPED_RE = re.compile(r'[\x00-\x1f"\\]')
+
+INDEX_MAGIC = b"CRYPTIDX"
+INDEX_VERSION = 1
+# magic, version, count, length of the names blob
+INDEX_HEADER = struct.Struct("<8sIIQ")
+
+
+#############################################
+# Manifest index
+#############################################
+
+class ManifestIndex(object):
+    """ Compact index of a manifest. 
+
+    IDs are stored as float32 in ascending order, with the names in the same
+    order in one utf-8 blob, delimited by name_offsets (count + 1 of them). 
+    Names with the same ID keep their manifest order. 
+    """
+
+    def __init__(self, ids, name_offsets, names_blob, buffer=None):
+        self.ids = ids
+        self.name_offsets = name_offsets
+        self.names_blob = names_blob
+        self._buffer = buffer  # keeps a memory map open for as long as we use it
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_items(cls, items):
+        """ Builds an index from (name, float ID) pairs. """
+        items = list(items)
+        order = sorted(range(len(items)), key=lambda i: items[i][1])
+        blobs = [_encode_utf8(items[i][0]) for i in order]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        ids = [items[i][1] for i in order]
+        return cls(_typed_array("f", ids), _typed_array("Q", offsets), b"".join(blobs))
+
+    @classmethod
+    def from_arrays(cls, names, ids):
+        """ Builds an index from a list of names and a float32 numpy array of their IDs. """
+        order = np.argsort(ids, kind="stable")
+        ordered = list(map(names.__getitem__, order.tolist()))
+        blob, lengths = _join_utf8(ordered)
+        offsets = np.zeros(len(ordered) + 1, dtype=np.uint64)
+        np.cumsum(np.fromiter(lengths, dtype=np.uint64, count=len(ordered)), out=offsets[1:])
+        return cls(ids[order], offsets, blob)
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        """ Builds an index from a parsed manifest dict, mapping names to hex strings. """
+        names = list(manifest.keys())
+        hex_strs = list(manifest.values())
+        if np is None:
+            return cls.from_items(zip(names, decode_hex_ids(hex_strs)))
+        return cls.from_arrays(names, hex_ids_to_float32(hex_strs))
+
+    def name_at(self, i):
+        start, end = int(self.name_offsets[i]), int(self.name_offsets[i + 1])
+        return _decode_utf8(bytes(self.names_blob[start:end]))
+
+    def id_at(self, i):
+        return float(self.ids[i])
+
+    def names(self):
+        """ Returns all names, in ID order. """
+        blob = bytes(self.names_blob)
+        offsets = self.name_offsets.tolist() if np is not None else list(self.name_offsets)
+        decoded = _decode_utf8(blob)
+        if len(decoded) != len(blob):
+            # not all ascii, byte offsets are not character offsets
+            return [_decode_utf8(blob[offsets[i]:offsets[i + 1]]) for i in range(len(self))]
+        return [decoded[offsets[i]:offsets[i + 1]] for i in range(len(self))]
+
+    def id_list(self):
+        """ Returns all IDs as python floats, in ID order. """
+        return self.ids.tolist() if np is not None else [float(x) for x in self.ids]
+
+    def id_bits(self):
+        """ Returns all IDs as their uint32 bit patterns, in ID order. """
+        if np is not None:
+            return np.asarray(self.ids, dtype=np.float32).view(np.uint32).tolist()
+        return list(struct.unpack("=%dI" % len(self), _to_bytes("f", self.ids)))
+
+    def items(self):
+        """ Returns (name, float ID) pairs, in ID order. """
+        return list(zip(self.names(), self.id_list()))
+
+    def name_for_id(self, id_value):
+        """ Returns the name for an ID by binary search, or None. If several names 
+        share the ID, the last in manifest order is returned, as with to_dicts(). 
+        """
+        if np is not None:
+            pos = int(np.searchsorted(self.ids, np.float32(id_value), side="right")) - 1
+        else:
+            pos = bisect.bisect_right(self.ids, id_value) - 1
+        if pos >= 0 and self.id_at(pos) == id_value:
+            return self.name_at(pos)
+        return None
+
+    def to_dicts(self):
+        """ Returns (names_to_IDs, ids_to_names) dicts. """
+        names, ids = self.names(), self.id_list()
+        return dict(zip(names, ids)), dict(zip(ids, names))
+
+    def save(self, path):
+        """ Writes the index to path atomically, through a temporary file. """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self), len(self.names_blob)))
+            f.write(_to_bytes("f", self.ids))
+            f.write(_to_bytes("Q", self.name_offsets))
+            f.write(bytes(self.names_blob))
+        getattr(os, "replace", os.rename)(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Memory maps an index written by save(). Raises ValueError if the file is not an index. """
+        import mmap
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < INDEX_HEADER.size:
+                raise ValueError("Truncated manifest index: %s" % path)
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, names_len = INDEX_HEADER.unpack_from(buf, 0)
+        ids_start = INDEX_HEADER.size
+        offsets_start = ids_start + 4 * count
+        names_start = offsets_start + 8 * (count + 1)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or names_start + names_len != size:
+            buf.close()
+            raise ValueError("Not a valid manifest index: %s" % path)
+        try:
+            view = memoryview(buf)
+        except TypeError:
+            # Python 2's mmap has no buffer interface, so the sections are copied
+            view = buf[:]
+            buf.close()
+            buf = None
+        ids = _from_buffer("f", view[ids_start:offsets_start])
+        offsets = _from_buffer("Q", view[offsets_start:names_start])
+        return cls(ids, offsets, view[names_start:], buffer=buf)
+
+
+class ManifestFormatError(ValueError):
+    """ Raised for files that aren't valid manifests or EXR headers. """
+    pass
+
+
+class ManifestMemoryError(MemoryError):
+    """ Raised when parsing a manifest would go over the memory limit. """
+    pass
+
+
+def stream_manifest_index(path, memory_limit=None, progress=None, chunk_size=STREAM_CHUNK_SIZE):
+    """ Parses a sidecar manifest file incrementally into a ManifestIndex. 
+
+    The file is read in chunks, each cut after its last complete "name":"hex"
+    pair and decoded on its own, going straight into a names blob, offsets and 
+    uint32 IDs. The dict json.load would build for the whole file never exists, 
+    so very large manifests fit in about twice the size of their names. 
+
+    memory_limit -- bytes the parser may hold (default STREAM_MEMORY_LIMIT), 
+                    ManifestMemoryError is raised beyond it. 
+    progress -- optional function called with (bytes_read, total_bytes). 
+
+    Raises ManifestFormatError (a ValueError) if the file is not a flat JSON object
+    of hex strings. 
+    """
+    import codecs
+
+    memory_limit = STREAM_MEMORY_LIMIT if memory_limit is None else memory_limit
+    total = os.path.getsize(path)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    blob = bytearray()
+    offsets = _uint_array("Q", [0])
+    id_bits = _uint_array("I")
+    text = ""
+    bytes_read = 0
+    started = False
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            bytes_read += len(chunk)
+            text += decoder.decode(chunk, final=not chunk)
+            if not started:
+                text = text.lstrip()
+                if text:
+                    if text[0] != "{":
+                        raise ManifestFormatError("Manifest is not a JSON object: %s" % path)
+                    text = text[1:]
+                    started = True
+
+            if not chunk:
+                if not started or not text.rstrip().endswith("}"):
+                    raise ManifestFormatError("Manifest is truncated: %s" % path)
+                _extend_stream(blob, offsets, id_bits, "{" + text)
+                text = ""
+            else:
+                end = _last_pair_end(text)
+                if end:
+                    _extend_stream(blob, offsets, id_bits, "{" + text[:end - 1] + "}")
+                    text = text[end:]
+
+            held = len(blob) + 12 * len(id_bits) + 4 * len(text)
+            if held > memory_limit:
+                raise ManifestMemoryError(
+                    "Manifest %s needs more than the %d byte limit" % (path, memory_limit))
+            if progress:
+                progress(bytes_read, total)
+            if not chunk:
+                break
+
+    return _index_from_stream(blob, offsets, id_bits)
+
+
+def _last_pair_end(text):
+    """ Returns the index just past the comma after the last complete pair in text, or 0. 
+
+    Quotes inside JSON strings are always escaped, so a quote without a backslash 
+    before it, followed by a comma, ends a value. A name ending in an escaped 
+    backslash is skipped over, which only makes the cut earlier. 
+    """
+    pos = len(text)
+    while True:
+        pos = text.rfind(",", 0, pos)
+        if pos < 0:
+            return 0
+        quote = len(text[:pos].rstrip()) - 1
+        if quote >= 1 and text[quote] == '"' and text[quote - 1] != "\\":
+            return pos + 1
+
+
+def _extend_stream(blob, offsets, id_bits, segment):
+    """ Decodes one chunk of "name":"hex" pairs, as a JSON object, onto the stream arrays. """
+    try:
+        pairs = json.loads(segment)
+    except ValueError as e:
+        raise ManifestFormatError("Manifest is not valid JSON (%s)" % e)
+    if not isinstance(pairs, dict):
+        raise ManifestFormatError("Manifest is not a JSON object")
+    names = list(pairs.keys())
+    hex_strs = list(pairs.values())
+    if not all(isinstance(x, STRING_TYPES) for x in hex_strs):
+        raise ManifestFormatError("Manifest IDs must be hex strings")
+    if not names:
+        return
+    try:
+        if np is not None:
+            bits = hex_ids_to_uint32(hex_strs).tolist()
+        else:
+            bits = [struct.unpack("=I", struct.pack("=I", int(x, 16)))[0] for x in hex_strs]
+    except (ValueError, struct.error) as e:
+        raise ManifestFormatError("Manifest IDs must be 32 bit hex strings (%s)" % e)
+
+    joined, lengths = _join_utf8(names)
+    base = offsets[-1]
+    blob += joined
+    for length in lengths:
+        base += length
+        offsets.append(base)
+    id_bits.extend(bits)
+
+
+def _index_from_stream(blob, offsets, id_bits, chunk=65536):
+    """ Sorts what stream_manifest_index() collected into a ManifestIndex. """
+    count = len(id_bits)
+    if np is None:
+        ids = _decode_hex_ids_loop(["%08x" % x for x in id_bits])
+        names = [_decode_utf8(bytes(blob[offsets[i]:offsets[i + 1]])) for i in range(count)]
+        return ManifestIndex.from_items(zip(names, ids))
+
+    ids = np.frombuffer(id_bits, dtype=np.uint32).view(np.float32)
+    order = np.argsort(ids, kind="stable")
+    all_offsets = np.frombuffer(offsets, dtype=np.dtype(offsets.typecode)).astype(np.uint64)
+    starts = all_offsets[:-1][order]
+    ends = all_offsets[1:][order]
+
+    # reorder the names blob a chunk at a time, to bound the temporary slices
+    view = memoryview(blob)
+    sorted_blob = bytearray()
+    for i in range(0, count, chunk):
+        sorted_blob += b"".join([view[s:e] for s, e in zip(starts[i:i + chunk].tolist(), ends[i:i + chunk].tolist())])
+    view.release()
+
+    sorted_offsets = np.zeros(count + 1, dtype=np.uint64)
+    np.cumsum(ends - starts, out=sorted_offsets[1:])
+    return ManifestIndex(ids[order], sorted_offsets, bytes(sorted_blob))
+
+
+def manifest_to_dicts(manifest):
+    """ Returns (names_to_IDs, ids_to_names) dicts for a parsed manifest dict, 
+    decoding all hex IDs in one go. If names share an ID, the last one wins. 
+    """
+    names = list(manifest.keys())
+    if sys.version_info < (3, 0):
+        names = [_encode_utf8(x) for x in names]
+    ids = decode_hex_ids(list(manifest.values()))
+    return dict(zip(names, ids)), dict(zip(ids, names))
+
+
+def decode_hex_ids(hex_strs):
+    """ Converts manifest hex strings to float IDs. """
+    if np is not None and hex_strs:
+        return hex_ids_to_float32(hex_strs).tolist()
+    return _decode_hex_ids_loop(hex_strs)
+
+
+def hex_ids_to_float32(hex_strs):
+    """ Converts manifest hex strings to a float32 numpy array, bit for bit. """
+    return hex_ids_to_uint32(hex_strs).view(np.float32)
+
+
+def hex_ids_to_uint32(hex_strs):
+    """ Converts manifest hex strings to a uint32 numpy array. 
+
+    The usual 8 digit strings are decoded all at once, through a nibble lookup
+    table. Anything else is converted one by one, raising the same errors as 
+    the struct based decoding for values that aren't 32 bit. 
+    """
+    count = len(hex_strs)
+    if count and set(map(len, hex_strs)) == set([8]):
+        joined = "".join(hex_strs)
+        try:
+            raw = np.frombuffer(_encode_ascii(joined), dtype=np.uint8)
+        except UnicodeError:
+            raw = None
+        if raw is not None:
+            nibbles = _HEX_NIBBLES[raw].reshape(count, 8)
+            if not (nibbles == 0xff).any():
+                shifted = nibbles.astype(np.uint32) << _NIBBLE_SHIFTS
+                return np.bitwise_or.reduce(shifted, axis=1).astype(np.uint32)
+
+    values = [int(x, 16) for x in hex_strs]
+    for value in values:
+        if not 0 <= value <= 0xffffffff:
+            struct.pack("=I", value)  # raises struct.error, as decoding always did
+    return np.array(values, dtype=np.uint32)
+
+
+def _decode_hex_ids_loop(hex_strs):
+    unpacker = struct.Struct('=f')
+    packer = struct.Struct("=I")
+    ids = []
+    for value in hex_strs:
+        packed = packer.pack(int(value, 16))
+        packed = b'\0' * (4 - len(packed)) + packed
+        ids.append(unpacker.unpack(packed)[0])
+    return ids
+
+
+#############################################
+# Validation
+#############################################
+
+def cryptomatte_id_bits(names):
+    """ Returns the Cryptomatte IDs of names as uint32 bit patterns: their 
+    MurmurHash3_32, with the exponent changed to avoid denormals, inf and NaN. 
+    """
+    import pymmh3
+    bits = []
+    for hash_32 in pymmh3.hash_many(names):
+        hash_32 &= 0xffffffff
+        exp = hash_32 >> 23 & 255
+        if (exp == 0) or (exp == 255):
+            hash_32 ^= 1 << 23
+        bits.append(hash_32)
+    return bits
+
+
+def validate_manifest(names, id_bits):
+    """ Rehashes the names of a manifest and compares them to its IDs (uint32s), 
+    as CryptomatteInfo.test_manifest does. 
+
+    Returns (mismatches, collisions): lists of (name, manifest ID, computed ID) 
+    and of (ID, names), with the IDs as hex strings. 
+    """
+    mismatches = []
+    owners = {}
+    for name, expected, computed in zip(names, id_bits, cryptomatte_id_bits(names)):
+        if expected != computed:
+            mismatches.append((name, "%08x" % expected, "%08x" % computed))
+        else:
+            owners.setdefault(expected, []).append(name)
+    collisions = sorted(("%08x" % x, sorted(y)) for x, y in owners.items() if len(y) > 1)
+    return mismatches, collisions
+
+
+#############################################
+# EXR headers
+#############################################
+
+def read_exr_header(path, skip_manifests=False):
+    """ Returns the string attributes of an EXR header by name, without reading pixels. 
+    Other attribute types are skipped. For multi-part files, the first part 
+    with an attribute wins. Raises IOError, or ValueError if it's not an EXR. 
+
+    skip_manifests -- seek past the values of manifest attributes (eg. 
+                      "cryptomatte/ae93ba3/manifest"), which may be megabytes, and 
+                      return None for them, so their layers are still known to have one. 
+    """
+    attributes = {}
+    with open(path, "rb") as f:
+        reader = _ExrHeaderReader(f)
+        magic, version = struct.unpack("<ii", reader.read(8))
+        if magic != EXR_MAGIC:
+            raise ManifestFormatError("Not an EXR file: %s" % path)
+        multipart = version & EXR_MULTIPART_FLAG
+        while True:
+            empty = True
+            while True:
+                name = reader.cstring()
+                if not name:
+                    break
+                empty = False
+                type_name = reader.cstring()
+                size = struct.unpack("<i", reader.read(4))[0]
+                if size < 0:
+                    raise ManifestFormatError("Invalid EXR header: %s" % path)
+                if type_name != b"string":
+                    reader.skip(size)
+                elif skip_manifests and name.endswith(b"/manifest"):
+                    reader.skip(size)
+                    attributes.setdefault(_decode_utf8(name), None)
+                else:
+                    attributes.setdefault(_decode_utf8(name), _decode_utf8(reader.read(size)))
+            if not multipart or empty:
+                break
+    return attributes
+
+
+_exr_headers = {}
+
+
+def read_exr_header_cached(path, skip_manifests=True):
+    """ Same as read_exr_header(), skipping manifests by default, cached per file until 
+    its modification time or size change. The returned dict is shared, and must not 
+    be modified. 
+    """
+    stat = os.stat(path)
+    key = (path, skip_manifests)
+    cached = _exr_headers.get(key)
+    if cached is not None and cached[0] == (stat.st_mtime, stat.st_size):
+        return cached[1]
+    attributes = read_exr_header(path, skip_manifests)
+    if len(_exr_headers) >= EXR_HEADER_CACHE_SIZE:
+        _exr_headers.clear()
+    _exr_headers[key] = ((stat.st_mtime, stat.st_size), attributes)
+    return attributes
+
+
+def clear_exr_header_cache():
+    _exr_headers.clear()
+
+
+def cryptomatte_layers(metadata):
+    """ Groups cryptomatte metadata by metadata ID, eg. {"ae93ba3": {"name": 
+    "cryptoObject", "hash": "MurmurHash3_32", "manif_file": ...}}. Keys may be 
+    EXR attribute names or Nuke metadata keys (prefixed with "exr/"). 
+    """
+    layers = {}
+    for key, value in metadata.items():
+        parts = key.split("/")
+        if parts[0] == "exr":
+            parts = parts[1:]
+        if len(parts) == 3 and parts[0] == "cryptomatte":
+            layers.setdefault(parts[1], {})[parts[2]] = value
+    return layers
+
+
+class _ExrHeaderReader(object):
+    """ Reads an EXR header from a file in chunks, rather than a byte at a time, 
+    and seeks past skipped values instead of reading them. 
+    """
+
+    def __init__(self, f, chunk_size=EXR_HEADER_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.pos = 0
+
+    def _fill(self, size):
+        while len(self.buffer) - self.pos < size:
+            data = self.f.read(max(self.chunk_size, size - (len(self.buffer) - self.pos)))
+            if not data:
+                raise ManifestFormatError("Truncated EXR header: %s" % getattr(self.f, "name", self.f))
+            self.buffer = self.buffer[self.pos:] + data
+            self.pos = 0
+
+    def read(self, size):
+        self._fill(size)
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def skip(self, size):
+        available = len(self.buffer) - self.pos
+        if size <= available:
+            self.pos += size
+        else:
+            self.f.seek(size - available, 1)
+            self.buffer = b""
+            self.pos = 0
+
+    def cstring(self):
+        while True:
+            end = self.buffer.find(b"\0", self.pos, self.pos + EXR_MAX_NAME_LENGTH + 1)
+            if end >= 0:
+                data = self.buffer[self.pos:end]
+                self.pos = end + 1
+                return data
+            available = len(self.buffer) - self.pos
+            if available > EXR_MAX_NAME_LENGTH:
+                raise ManifestFormatError("Invalid EXR header: %s" % getattr(self.f, "name", self.f))
+            self._fill(available + 1)
+
+
+#############################################
+# Wildcards
+#############################################
+
+_glob_patterns = {}
+
+
+def compile_glob(pattern):
+    """ Returns the match function of an fnmatch pattern, compiled once. 
+    Matches are case sensitive, as with fnmatch.fnmatchcase. 
+    """
+    match = _glob_patterns.get(pattern)
+    if match is None:
+        if len(_glob_patterns) >= GLOB_CACHE_SIZE:
+            _glob_patterns.clear()
+        match = re.compile(fnmatch.translate(pattern)).match
+        _glob_patterns[pattern] = match
+    return match
+
+
+def glob_literal_prefix(pattern):
+    """ Returns the part of an fnmatch pattern before its first special character. """
+    for i, char in enumerate(pattern):
+        if char in GLOB_SPECIAL_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+class NameIndex(object):
+    """ Manifest names in sorted order, for globbing. 
+
+    Only the names starting with a pattern's literal prefix are tested against it, 
+    found by binary search, so "asset_*" over a large manifest just looks at the 
+    assets. Patterns starting with a wildcard still test every name. 
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def glob(self, pattern):
+        """ Returns the names matching an fnmatch pattern, in sorted order. """
+        match = compile_glob(pattern)
+        prefix = glob_literal_prefix(pattern)
+        if not prefix:
+            return [name for name in self.names if match(name)]
+        lo, hi = self.prefix_range(prefix)
+        if prefix == pattern:
+            return self.names[lo:lo + 1] if lo < hi and self.names[lo] == pattern else []
+        return [name for name in self.names[lo:hi] if match(name)]
+
+    def prefix_range(self, prefix):
+        """ Returns the (start, end) indices of the names starting with prefix. """
+        lo = bisect.bisect_left(self.names, prefix)
+        try:
+            after = prefix[:-1] + type(prefix)(chr(ord(prefix[-1]) + 1))
+        except (ValueError, OverflowError):
+            after = None  # the last character can't be incremented
+        if after is None:
+            hi = lo
+            while hi < len(self.names) and self.names[hi].startswith(prefix):
+                hi += 1
+            return lo, hi
+        return lo, bisect.bisect_left(self.names, after, lo)
+
+
+#############################################
+# Encryptomatte
+#############################################
+
+class ManifestAccumulator(object):
+    """ The manifest of a chain of Encryptomattes: the manifest coming into the chain, 
+    and the (name, hex ID) items added by each Encryptomatte. 
+
+    Appending returns a new accumulator sharing this one, so branching chains share 
+    their common part. The JSON is only built when asked for, and is the same as 
+    adding the items to the JSON text one at a time, as Encryptomattes used to. 
+    """
+
+    def __init__(self, manifest="{}"):
+        self.parent = None
+        self.item = None
+        self.base = manifest
+        self.length = 0
+        self._json = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, name, id_hex):
+        child = ManifestAccumulator(self.base)
+        child.parent = self
+        child.item = (name, id_hex)
+        child.length = self.length + 1
+        return child
+
+    def items(self):
+        """ Returns the appended (name, hex ID) items, in order. """
+        items = []
+        node = self
+        while node.parent is not None:
+            items.append(node.item)
+            node = node.parent
+        items.reverse()
+        return items
+
+    def to_json(self):
+        if self._json is None:
+            items = self.items()
+            if not items:
+                self._json = self.base
+            else:
+                prefix = self.base[:self.base.rfind("}")].rstrip()
+                if not prefix.endswith(",") and not prefix.endswith("{"):
+                    prefix += ","
+                self._json = prefix + ",".join('"%s":"%s"' % x for x in items) + "}"
+        return self._json
+
+    def to_manifest(self, base_manifest=None):
+        """ Returns the manifest as json.loads(to_json()) would, without parsing the 
+        appended items. The incoming manifest is parsed unless given as base_manifest. 
+        """
+        items = self.items()
+        if any(JSON_ESCAPED_RE.search(name + id_hex) for name, id_hex in items):
+            return json.loads(self.to_json())
+        try:
+            manifest = dict(json.loads(self.base) if base_manifest is None else base_manifest)
+        except ValueError:
+            return json.loads(self.to_json())  # eg. trailing commas, fixed up by to_json()
+        manifest.update(items)
+        return manifest
+
+
+#############################################
+# Disk cache
+#############################################
+
+def manifest_cache_dir():
+    """ Directory for cached manifest indexes. Set CRYPTOMATTE_MANIFEST_CACHE to 
+    override it, or to an empty string to disable the disk cache. 
+    """
+    if MANIFEST_CACHE_DIR_ENVIRON in os.environ:
+        return os.environ[MANIFEST_CACHE_DIR_ENVIRON]
+    home = os.environ.get("HOME") or os.environ.get("USERPROFILE") or ""
+    if not home:
+        return ""
+    return os.path.join(home, ".nuke", "cryptomatte_manifest_cache")
+
+
+def sidecar_cache_key(path):
+    """ Cache key for a sidecar manifest file, from its path, mtime and size. """
+    import hashlib
+    stat = os.stat(path)
+    key = "%s|%r|%d" % (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    return "sidecar_" + hashlib.sha1(_encode_utf8(key)).hexdigest()
+
+
+def content_cache_key(manifest_str):
+    """ Cache key for a manifest string, such as one from metadata. """
+    import hashlib
+    return "content_" + hashlib.sha1(_encode_utf8(manifest_str)).hexdigest()
+
+
+def load_cached_index(key, cache_dir=None):
+    """ Returns the cached ManifestIndex for key, or None. """
+    cache_dir = manifest_cache_dir() if cache_dir is None else cache_dir
+    if not cache_dir or not key:
+        return None
+    path = os.path.join(cache_dir, key + ".idx")
+    if not os.path.exists(path):
+        return None
+    try:
+        index = ManifestIndex.load(path)
+        # marks it as recently used, see prune_cache_dir
+        os.utime(path, None)
+        return index
+    except (IOError, OSError, ValueError) as e:
+        print("Cryptomatte: Ignoring unreadable manifest cache %s (%s)" % (path, e))
+        return None
+
+
+def save_cached_index(key, index, cache_dir=None):
+    """ Stores index in the disk cache. Failures are reported, never raised, so the
+    cache can't break parsing. 
+    """
+    cache_dir = manifest_cache_dir() if cache_dir is None else cache_dir
+    if not cache_dir or not key:
+        return
+    try:
+        index.save(os.path.join(cache_dir, key + ".idx"))
+        prune_cache_dir(cache_dir)
+    except (IOError, OSError, ValueError, OverflowError, struct.error) as e:
+        print("Cryptomatte: Unable to write manifest cache in %s (%s)" % (cache_dir, e))
+
+
+def prune_cache_dir(cache_dir, max_files=MANIFEST_CACHE_MAX_FILES, max_bytes=MANIFEST_CACHE_MAX_BYTES):
+    """ Removes the least recently used indexes, by mtime, until at most max_files 
+    are left, taking at most max_bytes. 
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".idx"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if len(entries) <= max_files and total <= max_bytes:
+        return
+    entries.sort()
+    count = len(entries)
+    for _, size, path in entries:
+        if count <= max_files and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        count -= 1
+        total -= size
+
+
+#############################################
+# Helpers
+#############################################
+
+if np is not None:
+    _HEX_NIBBLES = np.full(256, 0xff, dtype=np.uint8)
+    for _i, _c in enumerate("0123456789abcdef"):
+        _HEX_NIBBLES[ord(_c)] = _i
+        _HEX_NIBBLES[ord(_c.upper())] = _i
+    del _i, _c
+    _NIBBLE_SHIFTS = np.arange(28, -1, -4, dtype=np.uint32)
+
+
+def _encode_ascii(string):
+    return string if isinstance(string, bytes) else string.encode("ascii")
+
+
+def _encode_utf8(string):
+    return string if isinstance(string, bytes) else string.encode("utf-8")
+
+
+def _join_utf8(names):
+    """ Returns the names joined as one utf-8 blob, and the byte length of each. """
+    try:
+        joined = "".join(names)
+    except TypeError:
+        joined = None  # a mix of bytes and text
+    if joined is not None:
+        blob = _encode_utf8(joined)
+        if len(blob) == len(joined):
+            # all ascii (or already bytes), so character lengths are byte lengths
+            return blob, map(len, names)
+    blobs = [_encode_utf8(x) for x in names]
+    return b"".join(blobs), map(len, blobs)
+
+
+def _decode_utf8(blob):
+    if sys.version_info > (3, 0):
+        return blob.decode("utf-8")
+    return blob
+
+
+def _array_typecode(typecode):
+    """ The array module typecode to hold typecode's values. Python 2 has no "Q", so
+    uint64 offsets are held as "L", which array range checks when it is 32 bits. 
+    """
+    import array
+    if typecode == "Q" and "Q" not in getattr(array, "typecodes", ""):
+        return "L"
+    return typecode
+
+
+def _uint_array(typecode, values=()):
+    """ An appendable array module array of typecode ("I" or "Q"). """
+    import array
+    return array.array(_array_typecode(typecode), values)
+
+
+def _typed_array(typecode, values):
+    if np is not None:
+        return np.array(values, dtype={"f": np.float32, "Q": np.uint64}[typecode])
+    import array
+    return array.array(_array_typecode(typecode), values)
+
+
+def _to_bytes(typecode, values):
+    if np is not None:
+        return np.asarray(values, dtype={"f": np.float32, "Q": np.uint64}[typecode]).tobytes()
+    import array
+    values = array.array(_array_typecode(typecode), values)
+    if struct.calcsize("=" + typecode) != values.itemsize:
+        return struct.pack("=%d%s" % (len(values), typecode), *values)
+    return values.tobytes() if sys.version_info > (3, 0) else values.tostring()
+
+
+def _from_buffer(typecode, view):
+    """ Zero-copy typed view of a buffer where possible. """
+    if np is not None:
+        return np.frombuffer(view, dtype={"f": np.float32, "Q": np.uint64}[typecode])
+    if sys.version_info > (3, 0):
+        return view.cast(typecode)
+    import array
+    data = view.tobytes() if isinstance(view, memoryview) else bytes(view)
+    values = array.array(_array_typecode(typecode))
+    if struct.calcsize("=" + typecode) != values.itemsize:
+        values.extend(struct.unpack("=%d%s" % (len(data) // struct.calcsize("=" + typecode), typecode), data))
+    else:
+        values.fromstring(data)
+    return values
@@ -11,7 +11,7 @@ import unittest
 
 def get_all_unit_tests():
     """ Returns the list of unit tests (to run in any context)"""
-    return [CSVParsing, CryptoHashing]
+    return [CSVParsing, CryptoHashing, HashCaching, ManifestIndexing, ManifestValidation, CollisionTracking, ExpressionCompiling, MatteExtraction, WildcardMatching, UpdateScheduling, MatteListEditing, EncryptomatteManifests, Benchmarks]
 
 
 def get_all_nuke_tests():
@@ -113,6 +113,1342 @@ class CryptoHashing(unittest.TestCase):
             msg = "%s hash does not line up: %s %s" % (name, hashvalue, cu.mm3hash_float(name))
             self.assertEqual(cu.mm3hash_float(name), cu.single_precision(hashvalue), msg)
 
+    def test_mm3hash_floats(self):
+        import cryptomatte_utilities as cu
+        names = list(self.mm3hash_float_values.keys())
+        expected = [cu.single_precision(self.mm3hash_float_values[x]) for x in names]
+        self.assertEqual(cu.mm3hash_floats(names), expected)
+
+    def test_hash_many(self):
+        import pymmh3
+        keys = ["", "a", "ab", "abc", "abcd", "abcde"] + list(self.mm3hash_float_values.keys())
+        keys += ["/assets/chr/hero_%04d/geo/body_GEOShape" % i for i in range(200)]
+        keys += ["x" * length for length in range(100)]
+        active = pymmh3.get_backend()
+        try:
+            for backend in pymmh3.available_backends():
+                pymmh3.set_backend(backend)
+                for seed in (0, 0x2a):
+                    self.assertEqual(pymmh3.hash_many(keys, seed), [pymmh3.hash(x, seed) for x in keys],
+                                     "hash_many mismatch with %s backend" % backend)
+        finally:
+            pymmh3.set_backend(active)
+
+    def test_backends_agree(self):
+        import pymmh3
+        from pymmh3 import _pure
+        keys = ["", "abc", "/assets/env/tree_0042/leaf_GEOShape"] + list(self.mm3hash_float_values.keys())
+        active = pymmh3.get_backend()
+        try:
+            for backend in pymmh3.available_backends():
+                pymmh3.set_backend(backend)
+                for key in keys:
+                    self.assertEqual(pymmh3.hash(key), _pure.hash(key), backend)
+                    self.assertEqual(pymmh3.hash64(key), _pure.hash64(key), backend)
+                    self.assertEqual(pymmh3.hash128(key), _pure.hash128(key), backend)
+        finally:
+            pymmh3.set_backend(active)
+
+
+class HashCaching(unittest.TestCase):
+    def test_lru_cache_bounded(self):
+        import cryptomatte_utilities as cu
+        cache = cu.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)  # evicts "b", the least recently used
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.info(), {"hits": 2, "misses": 1, "size": 2, "maxsize": 2, 
+                                        "cost": 2, "max_cost": None})
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_lru_cache_cost_budget(self):
+        import cryptomatte_utilities as cu
+        cache = cu.LRUCache(10, max_cost=100)
+        cache.put("a", "a", cost=60)
+        cache.put("b", "b", cost=30)
+        cache.put("b", "b", cost=40)  # replacing an entry replaces its cost
+        self.assertEqual(cache.cost, 100)
+        cache.put("c", "c", cost=50)  # over budget, evicts "a"
+        self.assertEqual(sorted(cache.keys()), ["b", "c"])
+        self.assertEqual(cache.cost, 90)
+        cache.discard("b")
+        self.assertEqual(cache.cost, 50)
+
+    def test_manifest_cache_eviction(self):
+        import cryptomatte_utilities as cu
+        cu.reset_manifest_cache()
+        cu.g_manifest_cache.put(("/a.exr", "ae93ba3", "k1"), ({}, {}))
+        cu.g_manifest_cache.put(("/a.exr", "dd12e3f", "k2"), ({}, {}))
+        cu.g_manifest_cache.put(("/b.exr", "ae93ba3", "k3"), ({}, {}))
+        cu.evict_manifest("/a.exr", "ae93ba3")
+        self.assertEqual(len(cu.g_manifest_cache), 2)
+        cu.evict_manifest("/a.exr")
+        self.assertEqual(cu.g_manifest_cache.keys(), [("/b.exr", "ae93ba3", "k3")])
+        cu.reset_manifest_cache()
+        self.assertEqual(cu.manifest_cache_info()["size"], 0)
+
+    def test_hash_cache_counters(self):
+        import cryptomatte_utilities as cu
+        cu.clear_hash_caches()
+        first = cu.mm3hash_float("cube")
+        self.assertEqual(cu.mm3hash_float("cube"), first)
+        self.assertEqual(cu.mm3hash_floats(["cube", "sphere"])[0], first)
+        info = cu.hash_cache_info()["mm3hash_float"]
+        self.assertEqual((info["hits"], info["misses"]), (2, 2))
+        self.assertEqual(cu.mm3hash_float("sphere"), cu.mm3hash_floats(["sphere"])[0])
+
+        cu.layer_hash("cryptoObject")
+        cu.layer_hash("cryptoObject")
+        info = cu.hash_cache_info()["layer_hash"]
+        self.assertEqual((info["hits"], info["misses"]), (1, 1))
+        cu.clear_hash_caches()
+
+    def test_hash_large_batch(self):
+        import cryptomatte_utilities as cu
+        cu.clear_hash_caches()
+        names = ["name_%s" % i for i in range(cu.HASH_BATCH_CACHE_LIMIT + 1)]
+        IDs = cu.mm3hash_floats(names)
+        info = cu.hash_cache_info()["mm3hash_float"]
+        self.assertEqual((info["hits"], info["misses"], info["size"]), (0, 0, 0))
+        self.assertEqual(IDs[:3], [cu.mm3hash_float(name) for name in names[:3]])
+        self.assertEqual(cu.mm3hash_floats(names[:3]), IDs[:3])
+        info = cu.hash_cache_info()["mm3hash_float"]
+        self.assertEqual((info["hits"], info["misses"], info["size"]), (3, 3, 3))
+        cu.clear_hash_caches()
+
+
+class ManifestIndexing(unittest.TestCase):
+    manifest = {
+        "hello": "26f5ac47",
+        "cube": "d9c2fc22",
+        "sphere": "5d8e6a19",
+        "plane": "2e20f84c",
+        u"m\u00e4dchen": "6a4e9ac4",
+        "collides_with_cube": "d9c2fc22",
+        "short_hex": "3f",
+    }
+
+    def setUp(self):
+        import tempfile
+        self.cache_dir = tempfile.mkdtemp(prefix="cryptomatte_test_")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def legacy_dicts(self, manifest):
+        """ The per entry decode parse_manifest used before the index existed. """
+        import struct
+        from_names, from_ids = {}, {}
+        for name, value in manifest.items():
+            packed = struct.pack("=I", int(value, 16))
+            id_float = struct.unpack("=f", packed)[0]
+            name = name if type(name) is str else name.encode("utf-8")
+            from_names[name] = id_float
+            from_ids[id_float] = name
+        return from_names, from_ids
+
+    def test_index_round_trip(self):
+        import cryptomatte_manifest as cm
+        index = cm.ManifestIndex.from_manifest(self.manifest)
+        legacy_names, legacy_ids = self.legacy_dicts(self.manifest)
+        self.assertEqual(index.to_dicts()[0], legacy_names)
+
+        cm.save_cached_index("content_test", index, cache_dir=self.cache_dir)
+        loaded = cm.load_cached_index("content_test", cache_dir=self.cache_dir)
+        self.assertEqual(len(loaded), len(self.manifest))
+        self.assertEqual(loaded.to_dicts()[0], legacy_names)
+        self.assertEqual(sorted(loaded.to_dicts()[1]), sorted(legacy_ids))
+        for name, id_float in legacy_names.items():
+            self.assertIn(loaded.name_for_id(id_float), [x for x, y in legacy_names.items() if y == id_float])
+        self.assertIsNone(loaded.name_for_id(1.0))
+        self.assertIsNone(cm.load_cached_index("content_missing", cache_dir=self.cache_dir))
+
+    def test_index_without_numpy(self):
+        """ The array module fallback, with offsets in 32 bits as Python 2's "L" may be. """
+        import os
+        import json
+        import cryptomatte_manifest as cm
+        legacy_names, _ = self.legacy_dicts(self.manifest)
+        path = os.path.join(self.cache_dir, "sidecar.json")
+        with open(path, "w") as f:
+            json.dump(self.manifest, f)
+
+        saved = cm.np, cm._array_typecode
+        cm.np = None
+        cm._array_typecode = lambda typecode: "I" if typecode == "Q" else typecode
+        try:
+            index = cm.ManifestIndex.from_manifest(self.manifest)
+            self.assertEqual(index.to_dicts()[0], legacy_names)
+            cm.save_cached_index("content_test", index, cache_dir=self.cache_dir)
+            loaded = cm.load_cached_index("content_test", cache_dir=self.cache_dir)
+            self.assertEqual(loaded.to_dicts()[0], legacy_names)
+            self.assertEqual(cm.stream_manifest_index(path, chunk_size=7).to_dicts()[0], legacy_names)
+        finally:
+            cm.np, cm._array_typecode = saved
+        # the same file format either way
+        loaded = cm.load_cached_index("content_test", cache_dir=self.cache_dir)
+        self.assertEqual(loaded.to_dicts()[0], legacy_names)
+
+    def test_vectorized_hex_decoding(self):
+        import random
+        import struct
+        import cryptomatte_manifest as cm
+        if cm.np is None:
+            self.skipTest("numpy not available")
+        rng = random.Random(0)
+        hex_strs = ["%08x" % rng.getrandbits(32) for _ in range(5000)]
+        hex_strs += ["00000000", "ffffffff", "7f800000", "FFC00001", "3f", "0", "abcdef"]
+        legacy = cm._decode_hex_ids_loop(hex_strs)
+        bits = cm.hex_ids_to_uint32(hex_strs).tolist()
+        self.assertEqual(bits, [int(x, 16) for x in hex_strs])
+        # compare as doubles, bit for bit, so NaNs are compared too
+        legacy_bits = [struct.pack("=d", x) for x in legacy]
+        decoded_bits = [struct.pack("=d", x) for x in cm.decode_hex_ids(hex_strs)]
+        self.assertEqual(decoded_bits, legacy_bits)
+        self.assertRaises(struct.error, cm.hex_ids_to_uint32, ["1ffffffff"])
+
+        # real IDs never have an exponent of 0 or 255, and NaN != NaN in dicts
+        usable = [x for x in hex_strs[:1000] if (int(x, 16) >> 23 & 255) not in (0, 255)]
+        manifest = dict(("name_%s" % i, x) for i, x in enumerate(usable))
+        legacy_names, legacy_ids = self.legacy_dicts(manifest)
+        self.assertEqual(cm.manifest_to_dicts(manifest), (legacy_names, legacy_ids))
+        from_names, from_ids = cm.ManifestIndex.from_manifest(manifest).to_dicts()
+        self.assertEqual(from_names, legacy_names)
+        self.assertEqual(from_ids, legacy_ids)
+
+    def test_cache_pruning(self):
+        import os
+        import cryptomatte_manifest as cm
+        index = cm.ManifestIndex.from_manifest(self.manifest)
+        for i in range(4):
+            cm.save_cached_index("content_%s" % i, index, cache_dir=self.cache_dir)
+            path = os.path.join(self.cache_dir, "content_%s.idx" % i)
+            os.utime(path, (1000 + i, 1000 + i))
+        size = os.path.getsize(path)
+
+        def cached():
+            return sorted(os.listdir(self.cache_dir))
+
+        # loading marks an index as recently used
+        self.assertIsNotNone(cm.load_cached_index("content_0", cache_dir=self.cache_dir))
+        cm.prune_cache_dir(self.cache_dir, max_files=3)
+        self.assertEqual(cached(), ["content_0.idx", "content_2.idx", "content_3.idx"])
+        cm.prune_cache_dir(self.cache_dir, max_bytes=2 * size)
+        self.assertEqual(cached(), ["content_0.idx", "content_3.idx"])
+        cm.prune_cache_dir(self.cache_dir, max_bytes=size - 1)
+        self.assertEqual(cached(), [])
+
+    def test_bad_cache_file_ignored(self):
+        import os
+        import cryptomatte_manifest as cm
+        with open(os.path.join(self.cache_dir, "content_bad.idx"), "wb") as f:
+            f.write(b"not an index at all, just some bytes")
+        self.assertIsNone(cm.load_cached_index("content_bad", cache_dir=self.cache_dir))
+
+    def test_cache_keys(self):
+        import os
+        import json
+        import cryptomatte_manifest as cm
+        path = os.path.join(self.cache_dir, "sidecar.json")
+        with open(path, "w") as f:
+            json.dump(self.manifest, f)
+        key = cm.sidecar_cache_key(path)
+        self.assertEqual(key, cm.sidecar_cache_key(path))
+        with open(path, "w") as f:
+            json.dump({"cube": "d9c2fc22"}, f)
+        self.assertNotEqual(key, cm.sidecar_cache_key(path))
+        self.assertNotEqual(cm.content_cache_key('{"a":"1"}'), cm.content_cache_key('{"b":"1"}'))
+
+    def test_streaming_sidecar(self):
+        import os
+        import json
+        import cryptomatte_manifest as cm
+        manifest = dict(self.manifest)
+        del manifest["collides_with_cube"]  # the dicts only keep one of them
+        manifest['quote"d\\name/'] = "0a1b2c3d"
+        manifest[u"\u4e2d\u6587"] = "4b5c6d7e"
+        legacy_names, legacy_ids = self.legacy_dicts(manifest)
+        path = os.path.join(self.cache_dir, "sidecar.json")
+        for dump_kwargs in ({}, {"indent": 4}, {"ensure_ascii": False}):
+            with open(path, "wb") as f:
+                f.write(json.dumps(manifest, **dump_kwargs).encode("utf-8"))
+            for chunk_size in (1, 7, 1 << 20):
+                progress = []
+                index = cm.stream_manifest_index(
+                    path, chunk_size=chunk_size, progress=lambda done, total: progress.append((done, total)))
+                self.assertEqual(index.to_dicts(), (legacy_names, legacy_ids))
+                self.assertEqual(progress[-1], (os.path.getsize(path), os.path.getsize(path)))
+
+        self.assertRaises(cm.ManifestMemoryError, cm.stream_manifest_index, path, memory_limit=16)
+        for contents in (b"", b"[]", b'{"cube": "d9c2fc22", "sph', b'{"cube": 12}'):
+            with open(path, "wb") as f:
+                f.write(contents)
+            self.assertRaises(ValueError, cm.stream_manifest_index, path)
+        with open(path, "wb") as f:
+            f.write(b" { } ")
+        self.assertEqual(len(cm.stream_manifest_index(path)), 0)
+
+    def test_streaming_fallback(self):
+        """ Sidecars the streaming parser fails on are loaded whole, not dropped. """
+        import os
+        import json
+        import cryptomatte_manifest as cm
+        import cryptomatte_utilities as cu
+        path = os.path.join(self.cache_dir, "sidecar.json")
+        with open(path, "w") as f:
+            json.dump(self.manifest, f)
+        cinfo = cu.CryptomatteInfo.__new__(cu.CryptomatteInfo)
+
+        def failing_stream(*args, **kwargs):
+            raise ValueError("unexpected layout")
+
+        saved = cm.stream_manifest_index
+        cm.stream_manifest_index = failing_stream
+        try:
+            index = cinfo.stream_sidecar_manifest(path)
+        finally:
+            cm.stream_manifest_index = saved
+        self.assertEqual(index.to_dicts()[0], self.legacy_dicts(self.manifest)[0])
+
+        with open(path, "w") as f:
+            f.write("not json")
+        self.assertIsNone(cinfo.stream_sidecar_manifest(path))
+
+    def test_streaming_fallback_memory_limit(self):
+        """ Sidecars over the memory limit are never loaded whole. """
+        import os
+        import cryptomatte_manifest as cm
+        import cryptomatte_utilities as cu
+        path = os.path.join(self.cache_dir, "sidecar.json")
+        with open(path, "w") as f:
+            f.write('{"cube": "d9c2fc22", "sphere": [' + "0, " * 1000 + '0]}')
+        cinfo = cu.CryptomatteInfo.__new__(cu.CryptomatteInfo)
+        loaded = []
+        cinfo.load_sidecar_manifest = loaded.append
+
+        def failing_stream(*args, **kwargs):
+            raise ValueError("malformed")
+
+        saved = cu.SIDECAR_MEMORY_LIMIT, cm.stream_manifest_index
+        cu.SIDECAR_MEMORY_LIMIT = os.path.getsize(path) - 1
+        cm.stream_manifest_index = failing_stream
+        try:
+            self.assertIsNone(cinfo.stream_sidecar_manifest(path))
+            self.assertEqual(loaded, [])
+            cu.SIDECAR_MEMORY_LIMIT = os.path.getsize(path)
+            cinfo.stream_sidecar_manifest(path)
+            self.assertEqual(loaded, [path])
+        finally:
+            cu.SIDECAR_MEMORY_LIMIT, cm.stream_manifest_index = saved
+
+
+def write_exr_header(path, attributes):
+    """ Writes an EXR with just a header, of string attributes and a dummy channel list. """
+    import struct
+
+    def attribute(name, type_name, value):
+        return name + b"\0" + type_name + b"\0" + struct.pack("<i", len(value)) + value
+
+    header = [struct.pack("<ii", 20000630, 2), attribute(b"channels", b"chlist", b"R\0" + b"\0" * 17)]
+    for name, value in sorted(attributes.items()):
+        header.append(attribute(name.encode("utf-8"), b"string", value.encode("utf-8")))
+    with open(path, "wb") as f:
+        f.write(b"".join(header) + b"\0")
+
+
+class ManifestValidation(unittest.TestCase):
+    good_manifest = {"hello": "248bfa47", "cube": "d9682f08", "sphere": "591e9a8d"}
+    bad_manifest = {"hello": "248bfa47", "cube": "00000001"}
+
+    def setUp(self):
+        import os
+        import json
+        import tempfile
+        self.render_dir = tempfile.mkdtemp(prefix="cryptomatte_test_")
+        with open(os.path.join(self.render_dir, "object.json"), "w") as f:
+            json.dump(self.good_manifest, f)
+        for frame in range(1, 4):
+            write_exr_header(os.path.join(self.render_dir, "shot.%04d.exr" % frame), {
+                "cryptomatte/1a4aca8/name": "cryptoObject",
+                "cryptomatte/1a4aca8/hash": "MurmurHash3_32",
+                "cryptomatte/1a4aca8/conversion": "uint32_to_float32",
+                "cryptomatte/1a4aca8/manif_file": "object.json",
+                "cryptomatte/6af633d/name": "cryptoMaterial",
+                "cryptomatte/6af633d/manifest": json.dumps(self.bad_manifest if frame == 3 else self.good_manifest),
+            })
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.render_dir, ignore_errors=True)
+
+    def test_read_exr_header(self):
+        import os
+        import cryptomatte_manifest as cm
+        metadata = cm.read_exr_header(os.path.join(self.render_dir, "shot.0001.exr"))
+        self.assertNotIn("channels", metadata)
+        layers = cm.cryptomatte_layers(metadata)
+        self.assertEqual(sorted(layers), ["1a4aca8", "6af633d"])
+        self.assertEqual(layers["1a4aca8"]["manif_file"], "object.json")
+        self.assertEqual(cm.cryptomatte_layers({"exr/cryptomatte/1a4aca8/name": "x"}), {"1a4aca8": {"name": "x"}})
+        self.assertRaises(ValueError, cm.read_exr_header, os.path.join(self.render_dir, "object.json"))
+
+    def test_read_exr_header_skipping_manifests(self):
+        import os
+        import cryptomatte_manifest as cm
+        path = os.path.join(self.render_dir, "shot.0001.exr")
+        full = cm.read_exr_header(path)
+        skipped = cm.read_exr_header(path, skip_manifests=True)
+        self.assertIsNone(skipped["cryptomatte/6af633d/manifest"])
+        del full["cryptomatte/6af633d/manifest"], skipped["cryptomatte/6af633d/manifest"]
+        self.assertEqual(full, skipped)
+
+        # small chunks, and a truncated header
+        with open(path, "rb") as f:
+            reader = cm._ExrHeaderReader(f, chunk_size=3)
+            reader.read(8)
+            self.assertEqual(reader.cstring(), b"channels")
+            self.assertEqual(reader.cstring(), b"chlist")
+            reader.skip(4 + 19)
+            self.assertEqual(reader.cstring(), b"cryptomatte/1a4aca8/conversion")
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-40])
+        self.assertRaises(ValueError, cm.read_exr_header, path, True)
+
+    def test_read_exr_header_cached(self):
+        import os
+        import cryptomatte_manifest as cm
+        cm.clear_exr_header_cache()
+        path = os.path.join(self.render_dir, "shot.0002.exr")
+        header = cm.read_exr_header_cached(path)
+        self.assertIs(cm.read_exr_header_cached(path), header)
+        self.assertIsNone(header["cryptomatte/6af633d/manifest"])
+        self.assertIsNotNone(cm.read_exr_header_cached(path, skip_manifests=False)["cryptomatte/6af633d/manifest"])
+
+        write_exr_header(path, {"cryptomatte/1a4aca8/name": "cryptoRenamed"})
+        self.assertEqual(cm.read_exr_header_cached(path), {"cryptomatte/1a4aca8/name": "cryptoRenamed"})
+        cm.clear_exr_header_cache()
+
+    def test_validate_manifest(self):
+        import cryptomatte_manifest as cm
+        names = ["hello", "cube", "cube_copy"]
+        mismatches, collisions = cm.validate_manifest(names, [0x248bfa47, 0xd9682f08, 0xd9682f08])
+        self.assertEqual(mismatches, [("cube_copy", "d9682f08", "%08x" % cm.cryptomatte_id_bits(["cube_copy"])[0])])
+        self.assertEqual(collisions, [])
+        mismatches, collisions = cm.validate_manifest(["hello", "hello"], [0x248bfa47, 0x248bfa47])
+        self.assertEqual(collisions, [("248bfa47", ["hello", "hello"])])
+
+    def test_validate_frame_range(self):
+        import os
+        import cryptomatte_validate as cv
+        self.assertEqual(cv.parse_frame_range("1-5x2,8"), [1, 3, 5, 8])
+        self.assertEqual(cv.expand_frames("a.%04d.exr", [7]), ["a.0007.exr"])
+        self.assertRaises(ValueError, cv.parse_frame_range, "5-1")
+
+        pattern = os.path.join(self.render_dir, "shot.####.exr")
+        paths = cv.expand_frames(pattern, cv.parse_frame_range("1-3"))
+        report = cv.validate_files(paths, jobs=1)
+        self.assertEqual(report["cryptoObject"]["files"], 3)
+        self.assertEqual(len(report["cryptoObject"]["manifests"]), 1)
+        self.assertEqual(report["cryptoObject"]["mismatches"], [])
+        self.assertEqual(len(report["cryptoMaterial"]["manifests"]), 2)
+        self.assertEqual(report["cryptoMaterial"]["mismatches"], [("cube", "00000001", "d9682f08")])
+        self.assertTrue(cv.report_failed(report))
+
+        self.assertEqual(cv.main([pattern, "-f", "1-3", "-j", "1", "-l", "cryptoObject", "--json"]), 0)
+        self.assertEqual(cv.main([pattern, "-f", "1-4", "-j", "1", "-l", "cryptoObject", "--json"]), 1)
+
+    def test_validate_source_errors(self):
+        import os
+        import cryptomatte_manifest as cm
+        import cryptomatte_validate as cv
+        broken = os.path.join(self.render_dir, "broken.json")
+        for contents in ('{"hello": "248bfa47", "cube"', '{"hello": 7}', '{"hello": "zzzzzzzz"}', "[]"):
+            with open(broken, "w") as f:
+                f.write(contents)
+            key, result = cv.validate_source(("key", ("sidecar", broken)))
+            self.assertIn("unable to read manifest", result["error"])
+        _, result = cv.validate_source(("key", ("sidecar", os.path.join(self.render_dir, "missing.json"))))
+        self.assertIn("unable to read manifest", result["error"])
+
+        # errors from validating a manifest that was read are not reported as read failures
+        validate_manifest = cm.validate_manifest
+        try:
+            cm.validate_manifest = lambda names, id_bits: [][0]
+            self.assertRaises(IndexError, cv.validate_source, ("key", ("sidecar", broken.replace("broken", "object"))))
+        finally:
+            cm.validate_manifest = validate_manifest
+
+
+class CollisionTracking(unittest.TestCase):
+    shot_a = {"hello": "248bfa47", "cube": "d9682f08"}
+    shot_b = {"sphere": "591e9a8d", "cube": "d9682f08", "hello_copy": "248bfa47"}
+
+    def setUp(self):
+        import os
+        import json
+        import tempfile
+        self.render_dir = tempfile.mkdtemp(prefix="cryptomatte_test_")
+        self.database_path = os.path.join(self.render_dir, "names.db")
+        for shot, manifest in (("a", self.shot_a), ("b", self.shot_b)):
+            for frame in range(1, 3):
+                write_exr_header(os.path.join(self.render_dir, "%s.%04d.exr" % (shot, frame)), {
+                    "cryptomatte/1a4aca8/name": "cryptoObject",
+                    "cryptomatte/1a4aca8/manifest": json.dumps(manifest),
+                })
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.render_dir, ignore_errors=True)
+
+    def shot_paths(self, shot):
+        import os
+        import cryptomatte_validate as cv
+        return cv.expand_frames(os.path.join(self.render_dir, "%s.####.exr" % shot), [1, 2])
+
+    def test_ingest(self):
+        import json
+        import cryptomatte_manifest as cm
+        import cryptomatte_collisions as cc
+        with cc.CollisionDatabase(self.database_path) as database:
+            report = cc.ingest_files(database, self.shot_paths("a"), jobs=1)
+            self.assertEqual((report["files"], report["manifests"], report["names"]), (2, 1, 2))
+            self.assertEqual((report["errors"], report["collisions"]), ([], []))
+
+            report = cc.ingest_files(database, self.shot_paths("a") + self.shot_paths("b"), jobs=1)
+            self.assertEqual((report["manifests"], report["skipped"], report["names"]), (1, 1, 2))
+            self.assertEqual(report["collisions"], [("248bfa47", ["hello", "hello_copy"])])
+            self.assertEqual(len(database), 4)
+
+        with cc.CollisionDatabase(self.database_path) as database:
+            self.assertEqual(database.collisions(), [("248bfa47", ["hello", "hello_copy"])])
+            self.assertEqual(database.collisions([0xd9682f08, 0x591e9a8d]), [])
+            self.assertEqual(database.names_for_id(0xd9682f08), ["cube"])
+            self.assertEqual(database.collides("hello"), ["hello_copy"])
+            self.assertEqual(database.collides("cube"), [])
+            self.assertEqual([x[:2] for x in database.sources(0x248bfa47)],
+                             [("hello", "cryptoObject"), ("hello_copy", "cryptoObject")])
+            key = cm.content_cache_key(json.dumps(self.shot_a))
+            self.assertIsNone(database.add_manifest(key, ["hello"], [0x248bfa47]))
+            self.assertEqual(database.add_manifest("new", ["hello", "world"], [0x248bfa47, 1]), 1)
+
+    def test_ingest_without_numpy(self):
+        """ As in Nuke 11 and 12 on Python 2, without numpy and with 32 bit "L" arrays. """
+        import cryptomatte_manifest as cm
+        import cryptomatte_collisions as cc
+        saved = cm.np, cm._array_typecode
+        cm.np = None
+        cm._array_typecode = lambda typecode: "I" if typecode == "Q" else typecode
+        try:
+            with cc.CollisionDatabase(self.database_path) as database:
+                report = cc.ingest_files(database, self.shot_paths("a") + self.shot_paths("b"), jobs=1)
+                self.assertEqual(report["errors"], [])
+                self.assertEqual((report["manifests"], report["names"]), (2, 4))
+                self.assertEqual(report["collisions"], [("248bfa47", ["hello", "hello_copy"])])
+        finally:
+            cm.np, cm._array_typecode = saved
+
+    def test_ingest_errors(self):
+        import os
+        import cryptomatte_manifest as cm
+        import cryptomatte_collisions as cc
+        broken = os.path.join(self.render_dir, "c.0001.exr")
+        write_exr_header(broken, {
+            "cryptomatte/1a4aca8/name": "cryptoObject",
+            "cryptomatte/1a4aca8/manifest": '{"hello": "nothex"}',
+        })
+        with cc.CollisionDatabase(self.database_path) as database:
+            report = cc.ingest_files(database, [broken] + self.shot_paths("a"), jobs=1)
+            self.assertEqual(report["manifests"], 1)
+            self.assertEqual(len(report["errors"]), 1)
+            self.assertIn("unable to read manifest", report["errors"][0])
+
+            # failures past reading the manifest are bugs, and are raised
+            names = cm.ManifestIndex.names
+            cm.ManifestIndex.names = lambda index: [][0]
+            try:
+                self.assertRaises(IndexError, cc.ingest_files, database, self.shot_paths("b"), jobs=1)
+            finally:
+                cm.ManifestIndex.names = names
+
+    def test_ingest_non_ascii(self):
+        """ Python 2 manifest names are utf-8 bytes, which sqlite3 takes only as text. """
+        import os
+        import sys
+        import json
+        import cryptomatte_manifest as cm
+        import cryptomatte_collisions as cc
+        name = u"m\u00e4dchen"
+        bits = cm.cryptomatte_id_bits([name.encode("utf-8")])[0]
+        path = os.path.join(self.render_dir, "names.0001.exr")
+        write_exr_header(path, {
+            "cryptomatte/1a4aca8/name": "cryptoObject",
+            "cryptomatte/1a4aca8/manifest": json.dumps({name: "%08x" % bits, "abc": "00000000"}),
+        })
+        with cc.CollisionDatabase(self.database_path) as database:
+            report = cc.ingest_files(database, [path], jobs=1)
+            self.assertEqual((report["errors"], report["names"]), ([], 2))
+            self.assertEqual(database.names_for_id(bits), [name])
+            self.assertEqual(database.add_manifest("utf8", [name.encode("utf-8"), b"abc"], [bits, 0]), 0)
+            self.assertEqual(database.add_manifest("other", [u"m\u00e4dchen_copy"], [bits]), 1)
+            self.assertEqual(database.collides(name), [u"m\u00e4dchen_copy"])
+            self.assertEqual(database.collides(name.encode("utf-8")), [u"m\u00e4dchen_copy"])
+            self.assertEqual([x[:3] for x in database.sources(bits)], 
+                             [(name, u"cryptoObject", path), (u"m\u00e4dchen_copy", u"", u"")])
+
+        class Output(object):
+            text = b""
+
+            def write(self, text):
+                Output.text += text if isinstance(text, bytes) else text.encode("utf-8")
+
+        argument = name if sys.version_info > (3, 0) else name.encode("utf-8")
+        saved = sys.stdout
+        sys.stdout = Output()
+        try:
+            self.assertEqual(cc.main(["check", self.database_path, "--name", argument]), 1)
+            self.assertEqual(cc.main(["collisions", self.database_path]), 1)
+        finally:
+            sys.stdout = saved
+        self.assertIn(u"m\u00e4dchen (%08x): m\u00e4dchen, m\u00e4dchen_copy" % bits, 
+                      Output.text.decode("utf-8"))
+
+    def test_command_line(self):
+        import os
+        import cryptomatte_collisions as cc
+        pattern = os.path.join(self.render_dir, "a.####.exr")
+        self.assertEqual(cc.main(["ingest", self.database_path, pattern, "-f", "1-2", "-j", "1"]), 0)
+        self.assertEqual(cc.main(["check", self.database_path, "--name", "cube", "--id", "591e9a8d"]), 0)
+        pattern = os.path.join(self.render_dir, "b.####.exr")
+        self.assertEqual(cc.main(["ingest", self.database_path, pattern, "-f", "1-2", "-j", "1"]), 1)
+        self.assertEqual(cc.main(["check", self.database_path, "--id", "248bfa47"]), 1)
+        self.assertEqual(cc.main(["collisions", self.database_path]), 1)
+
+
+class ExpressionCompiling(unittest.TestCase):
+    channels = ["uCryptoAsset00", "uCryptoAsset01", "uCryptoAsset02"]
+
+    def selection_of(self, tests, values):
+        """ Evaluates ID tests the way Nuke does, comparing single precision floats. """
+        import re
+        import cryptomatte_utilities as cu
+        ranges = []
+        for test in tests:
+            literals = [cu.single_precision(float(x)) for x in re.findall(r"[-+]?\d[^ )]*", test)]
+            ranges.append((literals[0], literals[-1]))
+        return set(x for x in values if any(lo <= x <= hi for lo, hi in ranges))
+
+    def test_small_lists_unchanged(self):
+        import cryptomatte_utilities as cu
+        self.assertEqual(
+            cu._build_extraction_expression(self.channels, [2.07262543558e+26, 2.07262543558e+26]),
+            CryptomatteNukeTests.heroflower_expr)
+        self.assertEqual(cu._compile_extraction_expressions(self.channels, []), [])
+
+    def test_ranges(self):
+        import random
+        import cryptomatte_utilities as cu
+        manifest_IDs = sorted(set(cu.mm3hash_floats(["name_%s" % i for i in range(2000)])))
+        rng = random.Random(0)
+        selections = [
+            rng.sample(manifest_IDs, 500), 
+            manifest_IDs[100:1500], 
+            [x for x in manifest_IDs if x < 0.0 or x > 1e10] + [0.0],
+        ]
+        for IDs in selections:
+            tests = cu._build_ID_tests(sorted(IDs), manifest_IDs)
+            self.assertLess(len(tests), len(IDs))
+            self.assertEqual(self.selection_of(tests, manifest_IDs + [0.0]), set(IDs))
+        # no manifest, or too few IDs to bother
+        self.assertEqual(len(cu._build_ID_tests(manifest_IDs[:1000])), 1000)
+        self.assertEqual(len(cu._build_ID_tests(manifest_IDs[:10], manifest_IDs)), 10)
+
+    def test_split_parts(self):
+        import re
+        import cryptomatte_utilities as cu
+        IDs = cu.mm3hash_floats(["name_%s" % i for i in range(300)])
+        literals = set("{0:.12g}".format(x) for x in IDs)
+        parts = cu._compile_extraction_expressions(self.channels, IDs, max_length=20000)
+        self.assertTrue(1 < len(parts) <= 5)
+        self.assertTrue(all(len(x) <= 20000 for x in parts))
+        found = [set(re.findall(r"uCryptoAsset01\.blue == ([^ )]+)", x)) for x in parts]
+        self.assertEqual(set.union(*found), literals)
+        self.assertEqual(sum(len(x) for x in found), len(literals))
+        # more parts than allowed go over the limit rather than drop IDs
+        parts = cu._compile_extraction_expressions(self.channels, IDs, max_length=1000, max_parts=3)
+        self.assertEqual(len(parts), 3)
+
+    def test_parts_within_max_length(self):
+        import random
+        import cryptomatte_utilities as cu
+        manifest_IDs = sorted(set(cu.mm3hash_floats(["name_%s" % i for i in range(2000)])))
+        rng = random.Random(0)
+        for count in (10, 100, 300, 1000):
+            IDs = rng.sample(manifest_IDs, count)
+            for known_IDs in (None, manifest_IDs):
+                whole = cu._compile_extraction_expressions(self.channels, IDs, max_length=None, 
+                                                           known_IDs=known_IDs)[0]
+                for max_length, max_parts in ((2000, 1000), (20000, 1000), (len(whole) // 5 + 500, 5)):
+                    parts = cu._compile_extraction_expressions(
+                        self.channels, IDs, max_length=max_length, max_parts=max_parts, 
+                        known_IDs=known_IDs)
+                    self.assertTrue(len(parts) <= max_parts)
+                    self.assertTrue(all(len(x) <= max_length for x in parts), (count, max_length))
+                    # every test in exactly one part
+                    self.assertEqual(sum(x.count("uCryptoAsset00.red") for x in parts), 
+                                     whole.count("uCryptoAsset00.red"))
+
+    def test_ranges_knob(self):
+        """ Ranges rely on the manifest listing every ID, so the knob turns them off. """
+        import cryptomatte_utilities as cu
+        names = ["name_%s" % i for i in range(200)]
+        ids_to_names = dict(zip(cu.mm3hash_floats(names), names))
+        selected = [ids_to_names[x] for x in sorted(ids_to_names)[:100]]
+
+        class Knob(object):
+            def __init__(self, value=""):
+                self.value = value
+
+            def getValue(self):
+                return self.value
+
+            def setValue(self, value):
+                self.value = value
+
+        class FakeGizmo(object):
+            def __init__(self, range_tests):
+                ml = cu.MatteList("")
+                for name in selected:
+                    ml.add(name)
+                self.knobs = dict((x, Knob()) for x in cu.EXPRESSION_PART_KNOBS + ["expression"])
+                self.knobs["matteList"] = Knob(ml.to_nukestr)
+                self.knobs["rangeTests"] = Knob(range_tests)
+
+            def knob(self, name):
+                return self.knobs[name]
+
+            def fullName(self):
+                return "CryptomatteRangeTest%s" % self.knobs["rangeTests"].value
+
+        class FakeInfo(object):
+            selection = "0000000"
+            cryptomattes = {selection: {"ids_to_names": ids_to_names}}
+
+            def manifest_key(self):
+                return None
+
+        expressions = []
+        try:
+            for range_tests in [False, True]:
+                gizmo = FakeGizmo(range_tests)
+                cu._set_expression(gizmo, self.channels, FakeInfo())
+                expressions.append(" + ".join(
+                    gizmo.knob(x).getValue() for x in ["expression"] + cu.EXPRESSION_PART_KNOBS))
+        finally:
+            cu.reset_manifest_cache()
+        self.assertNotIn(">=", expressions[0])
+        self.assertIn(">=", expressions[1])
+        self.assertLess(len(expressions[1]), len(expressions[0]) // 10)
+
+
+def fake_exr_reader(path, channel_filter):
+    """ Stands in for an EXR reader, returning MatteExtraction's synthetic channels. """
+    channels = MatteExtraction.synthetic_channels(int(path.split(".")[-2]))
+    return dict((name, values) for name, values in channels.items() if channel_filter(name))
+
+
+class MatteExtraction(unittest.TestCase):
+    names = ["bunny", "heroflower", "set", "sky"]
+
+    def setUp(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy not available")
+
+    @classmethod
+    def synthetic_channels(cls, seed, height=6, width=5, num_ranks=3):
+        """ Random ranks of the names' IDs, with coverage, as EXR channels by name. """
+        import numpy as np
+        import cryptomatte_manifest as cm
+        rng = np.random.RandomState(seed)
+        id_bits = np.array(cm.cryptomatte_id_bits(cls.names) + [0], dtype=np.uint32)
+        channels = {}
+        for rank in range(num_ranks):
+            for id_channel, coverage_channel in (("R", "G"), ("B", "A")):
+                ids = id_bits[rng.randint(0, len(id_bits), (height, width))].view(np.float32)
+                channels["cryptoObject%02d.%s" % (rank, id_channel)] = ids
+                channels["cryptoObject%02d.%s" % (rank, coverage_channel)] = rng.rand(height, width).astype(np.float32)
+        channels["rgba.R"] = np.ones((height, width), dtype=np.float32)
+        return channels
+
+    def reference_matte(self, ranks, id_bits):
+        """ The extraction expression, pixel by pixel. """
+        import numpy as np
+        matte = np.zeros(ranks.shape[1:3], dtype=np.float32)
+        for rank in ranks:
+            for y in range(rank.shape[0]):
+                for x in range(rank.shape[1]):
+                    red, green, blue, alpha = rank[y, x]
+                    if red.view(np.uint32) in id_bits:
+                        matte[y, x] += green
+                    if blue.view(np.uint32) in id_bits:
+                        matte[y, x] += alpha
+        return matte
+
+    def test_extract_matte(self):
+        import numpy as np
+        import cryptomatte_extract as ce
+        ranks = ce.stack_ranks(self.synthetic_channels(0), "cryptoObject")
+        self.assertEqual(ranks.shape, (3, 6, 5, 4))
+        for mattes in (["bunny"], ["bunny", "set"], self.names, []):
+            id_bits = set(ce.matte_id_bits(mattes).tolist())
+            np.testing.assert_allclose(
+                ce.extract_matte(ranks, mattes), self.reference_matte(ranks, id_bits), rtol=1e-6)
+
+        # numbered mattes, floats and names all give the same IDs
+        bunny_id = ce.matte_id_bits(["bunny"]).view(np.float32)[0]
+        for mattes in (["<%.12g>" % bunny_id], [float(bunny_id)], ce.matte_id_bits(["bunny"])):
+            self.assertEqual(ce.matte_id_bits(mattes).tolist(), ce.matte_id_bits(["bunny"]).tolist())
+        self.assertRaises(ValueError, ce.stack_ranks, {"cryptoObject00.R": ranks[0, ..., 0]}, "cryptoObject")
+
+        values = np.random.RandomState(0).randint(0, 50, (4, 7)).astype(np.uint32)
+        for selection in ([], [0], [3, 17, 49], list(range(0, 60, 2))):
+            selection = np.array(selection, dtype=np.uint32)
+            np.testing.assert_array_equal(ce.isin_sorted(values, selection), np.isin(values, selection))
+
+    def test_extract_files(self):
+        import numpy as np
+        import cryptomatte_extract as ce
+        paths = ["shot.%04d.exr" % frame for frame in (1, 2, 3)]
+        mattes = ce.extract_files(paths, "cryptoObject", ["heroflower"], jobs=1, reader=fake_exr_reader)
+        for frame, matte in zip((1, 2, 3), mattes):
+            ranks = ce.stack_ranks(self.synthetic_channels(frame), "cryptoObject")
+            np.testing.assert_array_equal(matte, ce.extract_matte(ranks, ["heroflower"]))
+        ce.register_exr_reader("fake", fake_exr_reader)
+        self.assertIs(ce.get_exr_reader("fake"), fake_exr_reader)
+        self.assertRaises(ValueError, ce.get_exr_reader, "missing")
+
+    def test_id_colors(self):
+        import math
+        import numpy as np
+        import cryptomatte_extract as ce
+        import cryptomatte_utilities as cu
+        IDs = [cu.mm3hash_float(name) for name in self.names] + [0.0]
+        for ID, color in zip(IDs, ce.id_colors(np.array(IDs, dtype=np.float32), "rgb")):
+            np.testing.assert_allclose(color, cu.id_to_rgb(ID), rtol=1e-6)
+        for ID, color in zip(IDs, ce.id_colors(np.array(IDs, dtype=np.float32))):
+            mantissa = math.frexp(abs(ID))[0]
+            np.testing.assert_allclose(color, [mantissa * x % 0.25 for x in (1, 16, 64)], rtol=1e-6)
+        self.assertRaises(ValueError, ce.id_colors, IDs, "sepia")
+
+    def test_preview_files(self):
+        import numpy as np
+        import cryptomatte_extract as ce
+        paths = ["shot.%04d.exr" % frame for frame in (1, 2)]
+        previews = ce.preview_files(paths, "cryptoObject", jobs=1, reader=fake_exr_reader, top=3)
+        for frame, preview in zip((1, 2), previews):
+            ranks = ce.stack_ranks(self.synthetic_channels(frame), "cryptoObject")
+            self.assertEqual(preview.shape, (6, 5, 4))
+            # the top 3 ranks are the red and blue of the first channel, and the red of the second
+            pairs = [(ranks[0, ..., 0], ranks[0, ..., 1]), (ranks[0, ..., 2], ranks[0, ..., 3]), 
+                     (ranks[1, ..., 0], ranks[1, ..., 1])]
+            expected = sum(ce.id_colors(ids) * coverage[..., np.newaxis] for ids, coverage in pairs)
+            np.testing.assert_allclose(preview[..., :3], expected, rtol=1e-5)
+            np.testing.assert_allclose(preview[..., 3], sum(x[1] for x in pairs), rtol=1e-5)
+        self.assertEqual(ce.OpenEXRWriter("{dir}/previews/{name}.exr").output_path("/shots/a.0001.exr"),
+                         "/shots/previews/a.0001.exr")
+
+    def test_ids_by_coverage(self):
+        import numpy as np
+        import cryptomatte_extract as ce
+        ranks = ce.stack_ranks(self.synthetic_channels(3), "cryptoObject")
+        ids, coverage = ce.ids_by_coverage(ranks)
+
+        expected = {}
+        for rank in ranks:
+            for id_values, cov_values in ((rank[..., 0], rank[..., 1]), (rank[..., 2], rank[..., 3])):
+                for ID, cov in zip(id_values.ravel(), cov_values.ravel()):
+                    if ID != 0.0 and cov != 0.0:
+                        bits = int(ID.view(np.uint32))
+                        expected[bits] = expected.get(bits, 0.0) + float(cov)
+        self.assertEqual(sorted(ids.tolist()), sorted(expected))
+        np.testing.assert_allclose(coverage, [expected[x] for x in ids.tolist()], rtol=1e-5)
+        self.assertTrue(np.all(np.diff(coverage) <= 0), "IDs not ordered by coverage")
+
+        # the same as sampling the channels pixel by pixel
+        class Upstream(object):
+            def sample(self, channel, x, y):
+                return float(channels[channel][int(y), int(x)])
+
+        import cryptomatte_utilities as cu
+        channels = dict((k.replace(".R", ".red").replace(".G", ".green").replace(".B", ".blue")
+                         .replace(".A", ".alpha"), v) for k, v in self.synthetic_channels(3).items())
+        layers = ["cryptoObject00", "cryptoObject01", "cryptoObject02"]
+        sampled = cu._sample_region_IDs(Upstream(), layers, [0, 0, 5, 6])
+        self.assertEqual(sampled, ids.view(np.float32).tolist())
+
+        empty = np.zeros((1, 2, 2, 4), dtype=np.float32)
+        self.assertEqual([len(x) for x in ce.ids_by_coverage(empty)], [0, 0])
+
+
+class WildcardMatching(unittest.TestCase):
+    names = [
+        "tree_01", "tree_02", "forest/tree_oak", "forest/tree_pine", "forest/rock", 
+        "trees", "tre", "bush*", "bush_a", "[special]", "special", "Tree_upper", 
+        u"m\u00e4dchen", u"\u00ff", "",
+    ]
+    patterns = [
+        "tree_*", "*/tree_*", "forest/*", "tre?", "tre", "bush[*]", "[[]special]", 
+        "Tree*", "*", "m*", u"\u00ff*", "nothing*", "tree_0[12]", "trees",
+    ]
+
+    def test_name_index_matches_fnmatch(self):
+        import fnmatch
+        import cryptomatte_manifest as cm
+        index = cm.NameIndex(self.names)
+        for pattern in self.patterns:
+            expected = sorted(x for x in self.names if fnmatch.fnmatchcase(x, pattern))
+            self.assertEqual(index.glob(pattern), expected, pattern)
+        self.assertEqual(cm.glob_literal_prefix("forest/tree_*"), "forest/tree_")
+        self.assertEqual(cm.glob_literal_prefix("[a]bc"), "")
+
+    def test_wildcard_cache(self):
+        import cryptomatte_utilities as cu
+        cu.reset_manifest_cache()
+        manifest = dict((name, 0.0) for name in self.names)
+        key = ("/a.exr", "ae93ba3", "k1")
+        uncached = sorted(cu.glob_manifest_names(manifest, "*/tree_*"))
+        self.assertEqual(uncached, ["forest/tree_oak", "forest/tree_pine"])
+        self.assertEqual(cu.glob_manifest_names(manifest, "*/tree_*", key), uncached)
+        self.assertEqual(cu.glob_manifest_names(manifest, "*/tree_*", key), uncached)
+        self.assertEqual(cu.g_wildcard_cache.info()["hits"], 1)
+        self.assertEqual(len(cu.g_wildcard_indexes), 1)
+        cu.evict_manifest("/a.exr")
+        self.assertEqual((len(cu.g_wildcard_indexes), len(cu.g_wildcard_cache)), (0, 0))
+        cu.reset_manifest_cache()
+
+
+class UpdateScheduling(unittest.TestCase):
+
+    class FakeGizmo(object):
+        def __init__(self, name):
+            self.name = name
+
+        def fullName(self):
+            return self.name
+
+        def Class(self):
+            return "Cryptomatte"
+
+    def setUp(self):
+        import cryptomatte_utilities as cu
+        self.now = 0.0
+        self.applied = []
+        # timers are left to run out after the tests, flush() is called instead
+        self.scheduler = cu.GizmoUpdateScheduler(
+            lambda node, force: self.applied.append((node.name, force)),
+            settle_delay=10.0, max_rate=0.05, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.scheduler.cancel()
+
+    def test_coalesced(self):
+        gizmo, other = self.FakeGizmo("Cryptomatte1"), self.FakeGizmo("Cryptomatte2")
+        for i in range(20):
+            self.scheduler.schedule(gizmo)
+        self.scheduler.schedule(other, force=True)
+        self.scheduler.schedule(gizmo)
+        self.assertEqual((self.applied, len(self.scheduler)), ([], 2))
+        self.assertEqual(self.scheduler.flush(gizmo), 1)
+        self.assertEqual(self.scheduler.flush(), 1)
+        self.assertEqual(self.applied, [("Cryptomatte1", False), ("Cryptomatte2", True)])
+        self.assertEqual(self.scheduler.flush(), 0)
+
+    def test_settle_and_rate_cap(self):
+        gizmo = self.FakeGizmo("Cryptomatte1")
+        self.scheduler.schedule(gizmo)
+        self.now = 9.0
+        self.scheduler.schedule(gizmo)
+        self.now = 18.0
+        self.assertEqual(self.scheduler.flush_due(), 0, "applied before settling")
+        self.now = 19.0
+        self.assertEqual(self.scheduler.flush_due(), 1)
+
+        # changes coming faster than the settle delay are still applied at max_rate
+        for step in range(0, 21):
+            self.now = 100.0 + step
+            self.scheduler.schedule(gizmo)
+            self.scheduler.flush_due()
+        self.assertEqual(len(self.applied), 2)
+
+    def test_disabled(self):
+        self.scheduler.enabled = False
+        self.scheduler.schedule(self.FakeGizmo("Cryptomatte1"))
+        self.assertEqual((self.applied, len(self.scheduler)), ([("Cryptomatte1", False)], 0))
+
+    def test_shared_info_copies(self):
+        """ Gizmos updated in bulk share parsed manifests, but not their layers. """
+        import cryptomatte_utilities as cu
+
+        class FakeRead(object):
+            def Class(self):
+                return "Read"
+
+        cinfo = cu.CryptomatteInfo.__new__(cu.CryptomatteInfo)
+        cinfo.nuke_node = FakeRead()
+        names_to_IDs = {"bunny": 1.0}
+        cinfo.cryptomattes = {"0000000": {"name": "cryptoObject", "channels": ["cryptoObject00"],
+                                          "names_to_IDs": names_to_IDs}}
+        cinfo.default_selection = "0000000"
+        copied = cinfo.for_node(FakeRead())
+        copied.cryptomattes["0000000"]["manifest_key"] = ("/a.exr", "0000000", None)
+        copied.cryptomattes["0000000"]["channels"].append("cryptoObject01")
+        self.assertEqual(cinfo.cryptomattes["0000000"]["channels"], ["cryptoObject00"])
+        self.assertNotIn("manifest_key", cinfo.cryptomattes["0000000"])
+        self.assertIs(copied.cryptomattes["0000000"]["names_to_IDs"], names_to_IDs)
+        self.assertEqual(copied.selection, "0000000")
+
+    def test_cryptomatte_info_cache(self):
+        """ Infos are cached by node and metadata, holding only the keys of parsed manifests. """
+        import os
+        import json
+        import shutil
+        import tempfile
+        import cryptomatte_manifest as cm
+        import cryptomatte_utilities as cu
+        manifest = {"bunny": "%08x" % cm.cryptomatte_id_bits(["bunny"])[0]}
+
+        class FakeRead(object):
+            def __init__(self, name):
+                self.name = name
+                self.metadata_dict = {
+                    "input/filename": "/renders/bunny.1001.tif",
+                    "exr/cryptomatte/0000000/name": "cryptoObject",
+                    "exr/cryptomatte/0000000/manifest": json.dumps(manifest),
+                }
+
+            def fullName(self):
+                return self.name
+
+            def Class(self):
+                return "Read"
+
+            def knobs(self):
+                return {}
+
+            def channels(self):
+                return ["cryptoObject00.red", "cryptoObject00.green"]
+
+            def metadata(self, key=None, view=None):
+                return self.metadata_dict if key is None else self.metadata_dict.get(key)
+
+        read = FakeRead("Read1")
+        cache_dir = tempfile.mkdtemp(prefix="cryptomatte_test_")
+        saved_environ = os.environ.get(cm.MANIFEST_CACHE_DIR_ENVIRON)
+        os.environ[cm.MANIFEST_CACHE_DIR_ENVIRON] = cache_dir
+        try:
+            cinfo = cu.get_cryptomatte_info(read)
+            self.assertEqual(cinfo.id_to_name(cu.mm3hash_float("bunny")), "bunny")
+            cached = cu.g_cryptomatte_infos.get(read)[1]
+            self.assertNotIn("ids_to_names", cached.cryptomattes["0000000"])
+            self.assertIsNotNone(cached.cryptomattes["0000000"]["manifest_key"])
+
+            # renamed, and found by node with the manifest restored
+            read.name = "Read2"
+            reused = cu.get_cryptomatte_info(read)
+            self.assertIs(reused.cachable_metadata, cinfo.cachable_metadata)
+            self.assertIs(reused.cryptomattes["0000000"]["ids_to_names"], 
+                          cinfo.cryptomattes["0000000"]["ids_to_names"])
+
+            # a change of metadata rebuilds it, evicted manifests are parsed again
+            read.metadata_dict["input/mtime"] = "2017-01-02 00:00:00"
+            self.assertIsNot(cu.get_cryptomatte_info(read).cachable_metadata, cinfo.cachable_metadata)
+            read.metadata_dict["exr/cryptomatte/0000000/name"] = "cryptoAsset"
+            self.assertEqual(cu.get_cryptomatte_info(read).get_selection_name(), "cryptoAsset")
+            cu.g_manifest_cache.clear()
+            reparsed = cu.get_cryptomatte_info(read)
+            self.assertNotIn("ids_to_names", reparsed.cryptomattes["0000000"])
+            self.assertEqual(reparsed.id_to_name(cu.mm3hash_float("bunny")), "bunny")
+        finally:
+            cu.reset_manifest_cache()
+            if saved_environ is None:
+                del os.environ[cm.MANIFEST_CACHE_DIR_ENVIRON]
+            else:
+                os.environ[cm.MANIFEST_CACHE_DIR_ENVIRON] = saved_environ
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_cryptomatte_info_state(self):
+        """ Checking a cached info reads single keys, never the (large) manifests. """
+        import cryptomatte_utilities as cu
+        hashed = []
+
+        class Manifest(str):
+            def __hash__(self):
+                hashed.append(self)
+                return str.__hash__(self)
+
+        class FakeRead(object):
+            full_reads = 0
+            metadata_dict = {
+                "input/filename": "/renders/bunny.1001.exr",
+                "input/mtime": "2017-01-01 00:00:00",
+                "exr/cryptomatte/0000000/name": "cryptoObject",
+                "exr/cryptomatte/0000000/hash": "MurmurHash3_32",
+                "exr/cryptomatte/0000000/manifest": Manifest('{"bunny": "13851a76", ' + 
+                                                             '"x": "00000000", ' * 100000 + '}'),
+            }
+
+            def Class(self):
+                return "Read"
+
+            def knobs(self):
+                return {}
+
+            def channels(self):
+                return ["cryptoObject00.red", "cryptoObject00.green"]
+
+            def metadata(self, key=None, view=None):
+                if key is None:
+                    FakeRead.full_reads += 1
+                    return self.metadata_dict
+                return self.metadata_dict.get(key)
+
+        read = FakeRead()
+        try:
+            cinfo = cu.get_cryptomatte_info(read)
+            full_reads = FakeRead.full_reads
+            for _ in range(3):
+                self.assertIs(cu.get_cryptomatte_info(read).cachable_metadata, cinfo.cachable_metadata)
+            self.assertEqual(FakeRead.full_reads, full_reads)
+            self.assertEqual(hashed, [])
+            read.metadata_dict["exr/cryptomatte/0000000/hash"] = "other"
+            self.assertIsNot(cu.get_cryptomatte_info(read).cachable_metadata, cinfo.cachable_metadata)
+        finally:
+            cu.forget_cryptomatte_info(read)
+
+
+class MatteListEditing(unittest.TestCase):
+
+    def assertConsistent(self, ml):
+        import cryptomatte_utilities as cu
+        fresh = cu.MatteList(ml.to_nukestr)
+        self.assertEqual(ml.raw_mattes, fresh.raw_mattes)
+        self.assertEqual(sorted(ml.IDs), sorted(fresh.IDs))
+
+    def test_edits(self):
+        import cryptomatte_utilities as cu
+        ml = cu.MatteList("bunny, heroflower, <1.5>")
+        nukestr = ml.to_nukestr
+        self.assertIs(ml.to_nukestr, nukestr, "nuke string not cached")
+        self.assertEqual(ml.ID_of("bunny"), cu.mm3hash_float("bunny"))
+        ml.add("set")
+        ml.add("has_*_asterisk")
+        self.assertEqual(ml.to_nukestr, r'<1.5>, bunny, "has_\\*_asterisk", heroflower, set')
+        self.assertConsistent(ml)
+
+        # by number, for a name in the list, and by name, for a number in the list
+        ml.remove("<{0:.12g}>".format(cu.mm3hash_float("bunny")))
+        ml.add("<{0:.12g}>".format(cu.mm3hash_float("cube")))
+        ml.remove("cube")
+        ml.remove("<1.5>")
+        self.assertEqual(ml.raw_mattes, set(["has_*_asterisk", "heroflower", "set"]))
+        self.assertIsNone(ml.ID_of("bunny"))
+        self.assertConsistent(ml)
+
+    def test_many_edits(self):
+        import cryptomatte_utilities as cu
+        ml = cu.MatteList("")
+        names = ["name_%s" % i for i in range(2000)]
+        for name in names:
+            ml.add(name)
+        for name in names[::2]:
+            ml.remove(name)
+        self.assertEqual(ml.raw_mattes, set(names[1::2]))
+        self.assertConsistent(ml)
+
+    def test_copies(self):
+        import cryptomatte_utilities as cu
+        ml = cu.MatteList("bunny, heroflower, <1.5>")
+        ml.ID_of("bunny")
+        ml.add("set")
+        copied = ml.copy()
+        copied.remove("bunny")
+        copied.add("cube")
+        self.assertEqual(ml.raw_mattes, set(["bunny", "heroflower", "<1.5>", "set"]))
+        self.assertEqual(ml.ID_of("bunny"), cu.mm3hash_float("bunny"))
+        self.assertIsNone(ml.ID_of("cube"))
+        self.assertEqual(ml.to_nukestr, "<1.5>, bunny, heroflower, set")
+        self.assertEqual(copied.to_nukestr, "<1.5>, cube, heroflower, set")
+        self.assertConsistent(ml)
+        self.assertConsistent(copied)
+
+    def test_gizmo_matte_lists_unshared(self):
+        """ Editing a gizmo's MatteList without setting it leaves the cached one as it was. """
+        import cryptomatte_utilities as cu
+
+        class Knob(object):
+            def __init__(self, value):
+                self.value = value
+
+            def getValue(self):
+                return self.value
+
+            def setValue(self, value):
+                self.value = value
+
+        class FakeGizmo(object):
+            knobs = {"matteList": Knob("bunny, heroflower")}
+
+            def knob(self, name):
+                return self.knobs[name]
+
+            def fullName(self):
+                return "CryptomatteCacheTest"
+
+        gizmo = FakeGizmo()
+        try:
+            ml = cu._gizmo_matte_list(gizmo)
+            ml.add("set")
+            self.assertEqual(cu._gizmo_matte_list(gizmo).raw_mattes, set(["bunny", "heroflower"]))
+
+            cu._set_gizmo_matte_list(gizmo, ml)
+            ml.remove("bunny")
+            self.assertEqual(gizmo.knob("matteList").getValue(), "bunny, heroflower, set")
+            self.assertEqual(cu._gizmo_matte_list(gizmo).raw_mattes, set(["bunny", "heroflower", "set"]))
+        finally:
+            cu.reset_manifest_cache()
+
+    def test_sample_region(self):
+        """ A picked region finds a one pixel object in it, or warns when it may not. """
+        import sys
+        import cryptomatte_utilities as cu
+        background, pebble = cu.mm3hash_float("background"), cu.mm3hash_float("pebble")
+
+        class Upstream(object):
+            samples = 0
+
+            def sample(self, channel, x, y):
+                Upstream.samples += 1
+                pebbles = int(x) == 37 and int(y) == 41
+                return {
+                    "cryptoObject00.red": pebble if pebbles else background,
+                    "cryptoObject00.green": 1.0,
+                }.get(channel, 0.0)
+
+        class Output(object):
+            text = ""
+
+            def write(self, text):
+                Output.text += text
+
+        saved = sys.stdout
+        sys.stdout = Output()
+        try:
+            # 60x60, every pixel sampled, up to its first empty rank
+            layers = ["cryptoObject00", "cryptoObject01", "cryptoObject02"]
+            IDs = cu._sample_region_IDs(Upstream(), layers, [0, 0, 60, 60])
+            self.assertEqual(IDs, [background, pebble])
+            self.assertEqual(Upstream.samples, 60 * 60 * 3)
+            self.assertEqual(Output.text, "")
+            # too big to sample each pixel
+            IDs = cu._sample_region_IDs(Upstream(), ["cryptoObject00"], [0, 0, 500, 500])
+            self.assertEqual(IDs, [background])
+        finally:
+            sys.stdout = saved
+        self.assertIn("500x500", Output.text)
+
+
+class EncryptomatteManifests(unittest.TestCase):
+    bases = ["{}", '{"sky":"0d1c5f5e"}', '{ "sky":"0d1c5f5e" , }', "{\n}", ""]
+
+    def legacy_append(self, manifest, name, id_hex):
+        """ What encryptomatte_add_manifest_id did to the manifest string. """
+        last_item = '"%s":"%s"}' % (name, id_hex)
+        existing_items = manifest[:manifest.rfind('}')].rstrip()
+        if not existing_items.endswith(',') and not existing_items.endswith('{'):
+            existing_items += ','
+        return existing_items + last_item
+
+    def test_same_as_legacy(self):
+        import json
+        import cryptomatte_manifest as cm
+        names = ["bunny", "hero flower", 'quote"d', "back\\slash", "set"]
+        for base in self.bases:
+            accumulator = cm.ManifestAccumulator(base)
+            expected = base
+            self.assertEqual(accumulator.to_json(), expected)
+            for i, name in enumerate(names):
+                accumulator = accumulator.append(name, "%08x" % i)
+                expected = self.legacy_append(expected, name, "%08x" % i)
+                self.assertEqual(accumulator.to_json(), expected)
+            self.assertEqual(len(accumulator), len(names))
+            # same manifest, or same error
+            for end in (1, 2, len(names)):
+                partial = accumulator
+                for _ in range(len(names) - end):
+                    partial = partial.parent
+                try:
+                    expected_manifest = json.loads(partial.to_json())
+                except ValueError:
+                    self.assertRaises(ValueError, partial.to_manifest)
+                else:
+                    self.assertEqual(partial.to_manifest(), expected_manifest)
+
+    def test_chain_reused(self):
+        import cryptomatte_utilities as cu
+        cu.reset_manifest_cache()
+        manifest = "{}"
+        chain = []
+        for i in range(50):
+            chain.append(cu._accumulate_manifest(manifest, "matte%s" % i, "%08x" % i))
+            manifest = chain[-1].to_json()
+        self.assertIs(chain[-1].parent, chain[-2], "upstream accumulator not extended")
+        self.assertIs(cu._accumulate_manifest("{}", "matte0", "%08x" % 0), chain[0])
+        self.assertEqual(chain[-1].to_manifest(), dict(("matte%s" % i, "%08x" % i) for i in range(50)))
+
+        # a branch off the middle of the chain
+        branch = cu._accumulate_manifest(chain[9].to_json(), "branch", "ffffffff")
+        self.assertEqual(branch.items()[-2:], [("matte9", "00000009"), ("branch", "ffffffff")])
+        cu.reset_manifest_cache()
+
+
+class Benchmarks(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        import cryptomatte_benchmarks as cb
+        results = cb.run_benchmarks(sizes=[10], repeat=1)
+        self.assertEqual(sorted(results["results"]), sorted(x[0] for x in cb.BENCHMARKS))
+        self.assertTrue(all(list(x) == ["10"] for x in results["results"].values()))
+
+        slower = {"results": {"hash_names": {"10": 1.0}, "csv_encode": {"10": 1.0}}}
+        baseline = {"results": {"hash_names": {"10": 0.5}, "csv_encode": {"10": 0.9}}}
+        self.assertEqual(cb.compare_results(slower, baseline), [("hash_names", 10, 1.0, 0.5)])
+        self.assertEqual(cb.compare_results(baseline, {}), [])
+
+    def test_extraction_expressions(self):
+        import sys
+        import cryptomatte_benchmarks as cb
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            results = cb.benchmark_extraction_expressions(matte_counts=(10, 100))
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([x["mattes"] for x in results], [10, 100])
+        self.assertLess(results[1]["compiled_length"], results[1]["single_length"])
+
 
 #############################################
 # Nuke tests
@@ -575,6 +1911,8 @@ class CryptomatteNukeTests(unittest.TestCase):
             # They'll just scatter some nodes about.
             self.setUpClass()
         cu.reset_manifest_cache()
+        self._update_scheduling = cu.g_gizmo_updates.enabled
+        cu.set_update_scheduling(False)
         self._remove_later = []
         self.gizmo = self.tempNode("Cryptomatte", inputs=[self.read_asset])
         self.merge = self.tempNode(
@@ -594,6 +1932,7 @@ class CryptomatteNukeTests(unittest.TestCase):
             for node in self._remove_later:
                 nuke.delete(node)
 
+        cu.set_update_scheduling(self._update_scheduling)
         cu.reset_manifest_cache()
 
 
@@ -748,6 +2087,20 @@ class CryptomatteNukeTests(unittest.TestCase):
         cinfo = cu.CryptomatteInfo(gizmo, True)
         self.assertIn("manifest", cinfo.cryptomattes[cinfo.selection])
 
+    def test_header_metadata_behind_other_nodes(self):
+        """ Only nodes reading a file directly take its header metadata as is. """
+        import cryptomatte_utilities as cu
+        name_key = "exr/cryptomatte/d593dd7/name"
+        renamed = self.tempNode(
+            "ModifyMetaData", inputs=[self.read_asset], metadata='{set %s renamedAsset}' % name_key)
+        dot = self.tempNode("Dot", inputs=[self.read_asset])
+        for node, name in [(self.read_asset, "uCryptoAsset"),
+                           (self.tempNode("Cryptomatte", inputs=[dot]), "uCryptoAsset"),
+                           (renamed, "renamedAsset"),
+                           (self.tempNode("Cryptomatte", inputs=[renamed]), "renamedAsset")]:
+            metadata = cu.CryptomatteInfo(node)._load_exr_header_metadata()
+            self.assertEqual(metadata[name_key], name, "Wrong metadata for %s" % node.name())
+
     def test_layer_bogus_manifest(self):
         import cryptomatte_utilities as cu
 
@@ -864,6 +2217,57 @@ class CryptomatteNukeTests(unittest.TestCase):
             "Update function should have updated from upstream changes. %s" %
             (gizmo.knob("cryptoLayer").value()))
 
+    def test_scheduled_updates(self):
+        import cryptomatte_utilities as cu
+        cu.set_update_scheduling(True)
+        try:
+            self.key_on_image(self.set_pkr, self.rm_set_pkr, self.bunny_pkr)
+            self.assertMatteList("bunny", "Matte list not updated right away")
+            self.assertEqual(len(cu.g_gizmo_updates), 1)
+            cu.flush_gizmo_updates(self.gizmo)
+            self.assertEqual(len(cu.g_gizmo_updates), 0)
+            self.assertSampleEqual(self.bunny_pkr, "Rebuild not applied on flush", alpha=1.0)
+            self.assertSampleEqual(self.set_pkr, "Set pixels should be unselected.", alpha=0.0)
+        finally:
+            cu.set_update_scheduling(False)
+
+    def test_bulk_update(self):
+        import cryptomatte_utilities as cu
+        gizmos = [self.gizmo]
+        for layer in ["uCryptoAsset", "uCryptoAsset", "uCryptoObject"]:
+            gizmos.append(self.tempNode(
+                "Cryptomatte", inputs=[self.read_obj_dot], cryptoLayer=layer, 
+                stopAutoUpdate=True, matteList="bunny"))
+        report = cu.bulk_update_cryptomatte_gizmos(gizmos)
+        self.assertEqual(
+            [(x["source"], x["layer"], x["gizmos"]) for x in report],
+            [(self.read_asset.fullName(), "uCryptoAsset", 1),
+             (self.read_obj.fullName(), "uCryptoAsset", 2),
+             (self.read_obj.fullName(), "uCryptoObject", 1)])
+
+        expected = gizmos[-1].knob("expression").getValue()
+        self.assertTrue(expected, "Bulk update did not set the expression.")
+        cu.update_cryptomatte_gizmo(gizmos[-1], force=True)
+        self.assertEqual(gizmos[-1].knob("expression").getValue(), expected)
+
+    def test_cryptomatte_info_reused(self):
+        import cryptomatte_utilities as cu
+        # copies of the cached one share its metadata
+        first = cu.get_cryptomatte_info(self.gizmo)
+        self.gizmo.knob("matteList").setValue("heroflower")
+        self.assertIs(cu.get_cryptomatte_info(self.gizmo).cachable_metadata, first.cachable_metadata,
+                      "CryptomatteInfo rebuilt for a knob change.")
+
+        self.gizmo.knob("forceUpdate").execute()
+        reloaded = cu.get_cryptomatte_info(self.gizmo)
+        self.assertIsNot(reloaded.cachable_metadata, first.cachable_metadata,
+                         "forceUpdate did not rebuild CryptomatteInfo.")
+
+        self.gizmo.setInput(0, self.read_obj)
+        self.assertIsNot(cu.get_cryptomatte_info(self.gizmo).cachable_metadata, reloaded.cachable_metadata,
+                         "CryptomatteInfo reused for a different input.")
+        self.assertEqual(self.gizmo.knob("cryptoLayer").value(), "uCryptoObject")
+
     #############################################
     # Keying
     #############################################
@@ -941,6 +2345,31 @@ class CryptomatteNukeTests(unittest.TestCase):
         self.assertMatteList(
             "set", "Bunny and flower not removed: (%s)" % self.gizmo.knob("matteList").getValue())
 
+    def test_keying_region(self):
+        """ A picked rectangle keys every matte in it, highest coverage first when single. """
+        import cryptomatte_utilities as cu
+
+        def pick_region(knob_name, pkr, size):
+            x, y = pkr[1]
+            self.gizmo.knob(knob_name).setValue(
+                [0.0, 0.0, 0.0, 0.0, x - size, y - size, x + size, y + size])
+
+        for render in [False, True]:
+            self.gizmo.knob("renderPickedRegions").setValue(render)
+            pick_region("pickerAdd", self.bunnyflower_pkr, 8)
+            self.assertMatteList("bunny, heroflower", "Region didn't select bunny and heroflower: (%s)" %
+                                 self.gizmo.knob("matteList").getValue())
+            self.assertSampleEqual(self.bunny_pkr, "Region keying didn't update the gizmo", alpha=1.0)
+
+            pick_region("pickerRemove", self.bunnyflower_pkr, 8)
+            self.assertMatteList("", "Region didn't remove bunny and heroflower: (%s)" %
+                                 self.gizmo.knob("matteList").getValue())
+
+        self.gizmo.knob("singleSelection").setValue(True)
+        pick_region("pickerAdd", self.bunny_pkr, 2)
+        self.assertMatteList("bunny", "Single selection region didn't select bunny: (%s)" %
+                             self.gizmo.knob("matteList").getValue())
+
     def test_keying_single_selection(self):
         # Single selection
         self.gizmo.knob("matteList").setValue("bunny, heroflower, set")
@@ -1037,8 +2466,7 @@ class CryptomatteNukeTests(unittest.TestCase):
 
     def _clear_manifest_cache(self):
         import cryptomatte_utilities as cu
-        cu.g_cryptomatte_manf_from_names = {}
-        cu.g_cryptomatte_manf_from_IDs = {}
+        cu.reset_manifest_cache()
 
     def test_matte_list_numeric(self):
         """
@@ -1212,6 +2640,28 @@ class CryptomatteNukeTests(unittest.TestCase):
         grouped_gizmo.knob("decryptomatte").execute()
         self.assertTrue(grouped_gizmo.knob("disable").value())
 
+    def test_decrypto_bulk(self):
+        """ Tests decryptomatting chained gizmos at once, with their outputs reconnected. """
+        import nuke
+        import cryptomatte_utilities as cu
+        self.key_on_image(self.bunny_pkr)
+        chained = self.tempNode("Cryptomatte", inputs=[self.gizmo], matteList="set", matteOnly=True)
+        output = self.tempNode("Dot", inputs=[chained])
+        correct_hash = self.hash_channel(chained, self.set_pkr, "alpha")
+
+        existing = set(x.fullName() for x in nuke.allNodes())
+        report = cu.bulk_decryptomatte([self.gizmo, chained])
+        self.delete_nodes_after_test(
+            [x for x in nuke.allNodes() if x.fullName() not in existing])
+        self.assertEqual((report["gizmos"], report["connections"]), (2, 2))
+
+        self.assertTrue(self.gizmo.knob("disable").value())
+        self.assertTrue(chained.knob("disable").value())
+        self.assertEqual(chained.input(0).name(), "%sExtract" % self.gizmo.name())
+        self.assertEqual(output.input(0).name(), "%sMatteOnly" % chained.name())
+        self.assertEqual(self.hash_channel(output, self.set_pkr, "alpha"), correct_hash,
+                         "Bulk decryptomatte caused a different alpha from Cryptomatte.")
+
     def test_decrypto_custom_channel(self):
         import cryptomatte_utilities as cu
         custom_layer = "uCryptoAsset"  # guaranteed to already exist.
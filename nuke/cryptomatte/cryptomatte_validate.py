@@ -0,0 +1,311 @@
+#
+#
+#  Copyright (c) 2014, 2015, 2016, 2017 Psyop Media Company, LLC
+#  See license.txt
+#
+#
+
+""" Validates the Cryptomatte manifests of rendered EXRs, without Nuke.
+
+For a post-render farm task, eg.
+
+    python cryptomatte_validate.py /renders/shot.####.exr --frames 1001-1100 --jobs 8
+
+Manifests are read from the EXR headers, or from their sidecar files. Frames
+sharing a manifest (the same sidecar, or the same manifest in the header) are
+only checked once. Every name is rehashed and compared to its ID, as
+CryptomatteInfo.test_manifest does in Nuke, and collisions are reported per layer.
+
+Exits with 1 if any file or manifest can't be read, or any ID doesn't match
+its name. Collisions are only reported, unless --strict is given.
+"""
+
+import os
+import re
+import sys
+import json
+import struct
+import argparse
+import multiprocessing
+
+import cryptomatte_manifest
+
+FRAME_PLACEHOLDER_RE = re.compile(r"#+|%0?(\d*)d")
+FRAME_RANGE_RE = re.compile(r"^(-?\d+)(?:-(-?\d+)(?:x(\d+))?)?$")
+MAX_LISTED_PROBLEMS = 10
+
+# Errors expected from reading a manifest source; anything else is a bug and is raised.
+READ_ERRORS = (IOError, OSError, KeyError, MemoryError, cryptomatte_manifest.ManifestFormatError)
+
+
+#############################################
+# Frame ranges
+#############################################
+
+def parse_frame_range(frames):
+    """ Parses frame ranges like "1001-1100", "1-99x2" or "1,5,10-20" into a list of frames. """
+    result = []
+    for part in frames.split(","):
+        match = FRAME_RANGE_RE.match(part.strip())
+        if not match:
+            raise ValueError("Invalid frame range: %s" % part)
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) is not None else first
+        step = int(match.group(3) or 1)
+        if last < first or step < 1:
+            raise ValueError("Invalid frame range: %s" % part)
+        result.extend(range(first, last + 1, step))
+    return result
+
+
+def expand_frames(path, frames):
+    """ Replaces the frame placeholder in path (#### or %04d) with each frame.
+    Paths without a placeholder are returned as they are.
+    """
+    match = FRAME_PLACEHOLDER_RE.search(path)
+    if not match:
+        return [path]
+    if frames is None:
+        raise ValueError("A frame range is needed for %s" % path)
+    if match.group(0).startswith("#"):
+        padding = len(match.group(0))
+    else:
+        padding = int(match.group(1) or 0)
+    return [
+        path[:match.start()] + str(frame).zfill(padding) + path[match.end():]
+        for frame in frames
+    ]
+
+
+#############################################
+# Workers
+#############################################
+
+def scan_file(path):
+    """ Reads the cryptomatte layers of an EXR header. Returns (path, layers, error),
+    with the layers as dicts of name, metadata_id, problems and manifest source and key.
+    Runs in the pool, so only small things are returned, and manifests are left for
+    validate_source().
+    """
+    try:
+        metadata = cryptomatte_manifest.read_exr_header(path)
+    except (IOError, OSError, ValueError) as e:
+        return path, [], str(e)
+
+    layers = []
+    for metadata_id, layer in sorted(cryptomatte_manifest.cryptomatte_layers(metadata).items()):
+        name = layer.get("name", "")
+        info = {
+            "name": name,
+            "metadata_id": metadata_id,
+            "errors": [],
+            "warnings": [],
+            "source": None,
+            "key": None,
+        }
+        if layer.get("hash", cryptomatte_manifest.CRYPTOMATTE_HASH) != cryptomatte_manifest.CRYPTOMATTE_HASH:
+            info["errors"].append("unsupported hash: %s" % layer["hash"])
+        if layer.get("conversion", cryptomatte_manifest.CRYPTOMATTE_CONVERSION) != \
+                cryptomatte_manifest.CRYPTOMATTE_CONVERSION:
+            info["errors"].append("unsupported conversion: %s" % layer["conversion"])
+        if name and ("%08x" % cryptomatte_manifest.cryptomatte_id_bits([name])[0])[:7] != metadata_id:
+            info["warnings"].append("metadata ID %s isn't the hash of the layer name" % metadata_id)
+
+        if "manif_file" in layer:
+            sidecar = layer["manif_file"]
+            sidecar_path = os.path.normpath(os.path.join(os.path.dirname(path), sidecar))
+            if "\\" in sidecar:
+                info["errors"].append("invalid sidecar path (back-slashes not allowed): %s" % sidecar)
+            elif not os.path.isfile(sidecar_path):
+                info["errors"].append("missing manifest file: %s" % sidecar_path)
+            else:
+                info["source"] = ("sidecar", sidecar_path)
+                info["key"] = cryptomatte_manifest.sidecar_cache_key(sidecar_path)
+        elif "manifest" in layer:
+            info["source"] = ("header", path, metadata_id)
+            info["key"] = cryptomatte_manifest.content_cache_key(layer["manifest"])
+        else:
+            info["errors"].append("no manifest")
+        layers.append(info)
+    return path, layers, None
+
+
+def validate_source(job):
+    """ Loads and validates one manifest. Returns (key, result), the result being a
+    dict of names (count), mismatches, collisions and error.
+    """
+    key, source = job
+    result = {"names": 0, "mismatches": [], "collisions": [], "error": None}
+    try:
+        index = load_source(source)
+    except READ_ERRORS as e:
+        result["error"] = "unable to read manifest from %s: %s" % (source[1], e)
+        return key, result
+    names = index.names()
+    result["names"] = len(names)
+    result["mismatches"], result["collisions"] = cryptomatte_manifest.validate_manifest(
+        names, index.id_bits())
+    return key, result
+
+
+def load_source(source):
+    """ Returns the ManifestIndex of a manifest source, as found by scan_file().
+    Raises one of READ_ERRORS if the file can't be read or isn't a valid manifest. 
+    """
+    if source[0] == "sidecar":
+        return cryptomatte_manifest.stream_manifest_index(source[1])
+    exr_path, metadata_id = source[1:]
+    layer = cryptomatte_manifest.cryptomatte_layers(
+        cryptomatte_manifest.read_exr_header(exr_path))[metadata_id]
+    try:
+        manifest = json.loads(layer["manifest"])
+    except ValueError as e:
+        raise cryptomatte_manifest.ManifestFormatError("Manifest is not valid JSON (%s)" % e)
+    if not isinstance(manifest, dict) or not all(
+            isinstance(x, cryptomatte_manifest.STRING_TYPES) for x in manifest.values()):
+        raise cryptomatte_manifest.ManifestFormatError("Manifest is not a JSON object of hex strings")
+    try:
+        return cryptomatte_manifest.ManifestIndex.from_manifest(manifest)
+    except (ValueError, struct.error) as e:
+        raise cryptomatte_manifest.ManifestFormatError("Manifest IDs must be 32 bit hex strings (%s)" % e)
+
+
+def _map(function, jobs, pool):
+    if pool is None:
+        return [function(job) for job in jobs]
+    return pool.map(function, jobs)
+
+
+#############################################
+# Validation
+#############################################
+
+def validate_files(paths, jobs=None, layer_names=None):
+    """ Validates the manifests of EXR files. Returns a report: {layer name: {"files",
+    "manifests", "names", "errors", "warnings", "mismatches", "collisions"}}, plus
+    unreadable files and files without cryptomattes under None.
+
+    jobs -- number of processes, defaulting to the number of CPUs. 1 runs in process.
+    layer_names -- only validate these layers, if given.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and len(paths) > 1 else None
+    try:
+        scanned = _map(scan_file, paths, pool)
+        if layer_names:
+            scanned = [
+                (path, [x for x in layers if x["name"] in layer_names], error)
+                for path, layers, error in scanned
+            ]
+
+        sources = {}
+        for path, layers, error in scanned:
+            for layer in layers:
+                if layer["key"] and layer["key"] not in sources:
+                    sources[layer["key"]] = layer["source"]
+        results = dict(_map(validate_source, sorted(sources.items()), pool if len(sources) > 1 else None))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    report = {}
+    unreadable = []
+    for path, layers, error in scanned:
+        if error:
+            unreadable.append(error)
+        elif not layers:
+            unreadable.append("%s: no cryptomatte layers" % path)
+        for layer in layers:
+            entry = report.setdefault(layer["name"], {
+                "files": 0, "manifests": [], "names": 0, "errors": [], "warnings": [],
+                "mismatches": [], "collisions": [],
+            })
+            entry["files"] += 1
+            for kind in ("errors", "warnings"):
+                entry[kind].extend("%s: %s" % (path, problem) for problem in layer[kind])
+            key = layer["key"]
+            if key and key not in entry["manifests"]:
+                result = results[key]
+                entry["manifests"].append(key)
+                entry["names"] = max(entry["names"], result["names"])
+                entry["mismatches"].extend(result["mismatches"])
+                entry["collisions"].extend(result["collisions"])
+                if result["error"]:
+                    entry["errors"].append(result["error"])
+    if unreadable:
+        report[None] = {"errors": unreadable}
+    return report
+
+
+def report_failed(report, strict=False):
+    """ Returns True if the report has errors or mismatches (or collisions, if strict). """
+    for entry in report.values():
+        if entry.get("errors") or entry.get("mismatches"):
+            return True
+        if strict and entry.get("collisions"):
+            return True
+    return False
+
+
+def print_report(report, out=None, verbose=False):
+    out = out or sys.stdout
+    limit = None if verbose else MAX_LISTED_PROBLEMS
+
+    def write_list(label, items, format_item):
+        for item in items[:limit]:
+            out.write("    %s %s\n" % (label, format_item(item)))
+        if limit is not None and len(items) > limit:
+            out.write("    ... and %d more\n" % (len(items) - limit))
+
+    for error in report.get(None, {}).get("errors", []):
+        out.write("Unreadable: %s\n" % error)
+    for layer_name in sorted(x for x in report if x is not None):
+        entry = report[layer_name]
+        out.write("%s: %d files, %d unique manifests, %d names, %d mismatches, %d collisions\n" % (
+            layer_name or "<unnamed>", entry["files"], len(entry["manifests"]), entry["names"],
+            len(entry["mismatches"]), len(entry["collisions"])))
+        write_list("error:", entry["errors"], str)
+        write_list("warning:", entry["warnings"], str)
+        write_list("mismatch:", entry["mismatches"],
+            lambda x: "%s has ID %s, should be %s" % x)
+        write_list("collision:", entry["collisions"],
+            lambda x: "%s shared by %s" % (x[0], ", ".join(x[1])))
+
+
+#############################################
+# Command line
+#############################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Validates Cryptomatte manifests of EXR files, from their headers or sidecars.")
+    parser.add_argument("paths", nargs="+",
+        help="EXR files, with #### or %%04d standing for the frame number")
+    parser.add_argument("-f", "--frames", help="frame range, eg. 1001-1100, 1-99x2 or 1,5,10-20")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of processes (default: number of CPUs)")
+    parser.add_argument("-l", "--layer", action="append", dest="layers",
+        help="only validate this layer, may be repeated")
+    parser.add_argument("--strict", action="store_true", help="fail on hash collisions too")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every problem")
+    args = parser.parse_args(argv)
+
+    try:
+        frames = parse_frame_range(args.frames) if args.frames else None
+        paths = [x for path in args.paths for x in expand_frames(path, frames)]
+    except ValueError as e:
+        parser.error(str(e))
+
+    report = validate_files(paths, jobs=args.jobs, layer_names=args.layers)
+    if args.json:
+        printable = dict((key or "", value) for key, value in report.items())
+        sys.stdout.write(json.dumps(printable, indent=2, sort_keys=True) + "\n")
+    else:
+        print_report(report, verbose=args.verbose)
+    return 1 if report_failed(report, strict=args.strict) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+'''
+pymmh3 - murmur3 hashing with the same interface as the mmh3 python package:
+
+https://pypi.python.org/pypi/mmh3/2.3.1
+
+On import the fastest available backend is chosen:
+
+    mmh3    -- the compiled mmh3 module, if installed
+    numpy   -- pure python single key hashing, numpy vectorized hash_many()
+    python  -- pure python only (see _pure.py)
+
+All backends give identical results. The PYMMH3_BACKEND environment variable
+forces a backend by name, and set_backend() switches it at runtime. Use
+get_backend() to report which one is active.
+
+Functions: hash, hash64, hash128, hash_bytes and hash_many, which hashes a
+sequence of keys with 32bit murmur3 and returns a list of signed ints.
+'''
+
+import os as _os
+
+from . import _pure
+
+BACKENDS = ( "mmh3", "numpy", "python" )
+
+_backend = None
+
+
+def _load_backend( name ):
+    ''' Returns a dict of the hash functions for a backend. Raises ImportError if unavailable. '''
+    functions = {
+        "hash": _pure.hash,
+        "hash64": _pure.hash64,
+        "hash128": _pure.hash128,
+        "hash_bytes": _pure.hash_bytes,
+        "hash_many": _pure.hash_many,
+    }
+    if name == "mmh3":
+        import mmh3 as _mmh3
+
+        def hash_many( keys, seed = 0x0 ):
+            ''' Implements 32bit murmur3 hash for a sequence of keys. Returns a list. '''
+            return [ _mmh3.hash( key, seed ) for key in keys ]
+
+        functions.update( {
+            "hash": _mmh3.hash,
+            "hash64": _mmh3.hash64,
+            "hash128": _mmh3.hash128,
+            "hash_bytes": _mmh3.hash_bytes,
+            "hash_many": hash_many,
+        } )
+    elif name == "numpy":
+        from . import _vectorized
+        functions[ "hash_many" ] = _vectorized.hash_many
+    elif name != "python":
+        raise ValueError( "Unknown pymmh3 backend: %s (expected one of %s)" % ( name, ", ".join( BACKENDS ) ) )
+    return functions
+
+
+def available_backends():
+    ''' Returns the names of the backends that can be loaded here, fastest first. '''
+    available = []
+    for name in BACKENDS:
+        try:
+            _load_backend( name )
+        except ImportError:
+            continue
+        available.append( name )
+    return available
+
+
+def get_backend():
+    ''' Returns the name of the active backend. '''
+    return _backend
+
+
+def set_backend( name = None ):
+    ''' Activates a backend by name, or the fastest available one if name is None.
+    Raises ImportError if the named backend is not available. Returns the name.
+    '''
+    global _backend
+    if name is None:
+        name = available_backends()[ 0 ]
+    globals().update( _load_backend( name ) )
+    _backend = name
+    return name
+
+
+try:
+    set_backend( _os.environ.get( "PYMMH3_BACKEND" ) or None )
+except ( ImportError, ValueError ):
+    set_backend()
@@ -0,0 +1,20 @@
+'''
+Hashes strings from the command line, eg.
+
+    python -m pymmh3 "string to hash"
+'''
+
+import sys
+import argparse
+
+import pymmh3
+
+parser = argparse.ArgumentParser( 'pymurmur3', 'pymurmur [options] "string to hash"' )
+parser.add_argument( '--seed', type = int, default = 0 )
+parser.add_argument( 'strings', default = [], nargs='+')
+
+opts = parser.parse_args()
+
+sys.stdout.write( 'backend: %s\n' % pymmh3.get_backend() )
+for str_to_hash in opts.strings:
+    sys.stdout.write( '"%s" = 0x%08X\n' % ( str_to_hash, pymmh3.hash( str_to_hash, opts.seed ) & 0xFFFFFFFF ) )
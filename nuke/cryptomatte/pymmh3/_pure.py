@@ -94,6 +94,11 @@ def hash( key, seed = 0x0 ):
         return -( (unsigned_val ^ 0xFFFFFFFF) + 1 )
 
 
+def hash_many( keys, seed = 0x0 ):
+    ''' Implements 32bit murmur3 hash for a sequence of keys. Returns a list. '''
+    return [ hash( key, seed ) for key in keys ]
+
+
 def hash128( key, seed = 0x0, x64arch = True ):
     ''' Implements 128bit murmur3 hash. '''
     def hash128_x64( key, seed ):
@@ -437,15 +442,3 @@ def hash_bytes( key, seed = 0x0, x64arch = True ):
 
     return bytestring
 
-
-if __name__ == "__main__":
-    import argparse
-    
-    parser = argparse.ArgumentParser( 'pymurmur3', 'pymurmur [options] "string to hash"' )
-    parser.add_argument( '--seed', type = int, default = 0 )
-    parser.add_argument( 'strings', default = [], nargs='+')
-    
-    opts = parser.parse_args()
-    
-    for str_to_hash in opts.strings:
-        sys.stdout.write( '"%s" = 0x%08X\n' % ( str_to_hash, hash( str_to_hash ) ) )
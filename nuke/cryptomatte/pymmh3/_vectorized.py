@@ -0,0 +1,87 @@
+'''
+numpy implementation of the murmur3 hash algorithm, for hashing many keys at once.
+
+Keys are packed into zero padded uint32 block matrices, one row per key, and the
+mix rounds run as array operations over every row. Results are bit-identical to
+the pure python version. Importing this module raises ImportError without numpy.
+'''
+
+import numpy as np
+
+from ._pure import hash, xencode
+
+# below this many keys hash_many() just loops, numpy setup costs more than it saves
+HASH_MANY_MIN_KEYS = 64
+# keys are hashed in chunks of this size to bound the padded block matrix
+HASH_MANY_CHUNK_SIZE = 65536
+
+
+def hash_many( keys, seed = 0x0 ):
+    ''' Implements 32bit murmur3 hash for a sequence of keys. Returns a list. '''
+    return hash_many_array( keys, seed ).view( np.int32 ).tolist()
+
+
+def hash_many_array( keys, seed = 0x0 ):
+    ''' Implements 32bit murmur3 hash for a sequence of keys. Returns a uint32 array. '''
+    keys = [ bytes( xencode( key ) ) for key in keys ]
+    if len( keys ) < HASH_MANY_MIN_KEYS:
+        hashes = [ hash( key, seed ) & 0xFFFFFFFF for key in keys ]
+        return np.array( hashes, dtype = np.uint32 )
+
+    result = np.empty( len( keys ), dtype = np.uint32 )
+
+    # sort by length, so every chunk is padded only up to a similar length
+    order = sorted( range( len( keys ) ), key = lambda i: len( keys[ i ] ) )
+    for chunk_start in range( 0, len( order ), HASH_MANY_CHUNK_SIZE ):
+        chunk = order[ chunk_start : chunk_start + HASH_MANY_CHUNK_SIZE ]
+        result[ chunk ] = _hash32_blocks( [ keys[ i ] for i in chunk ], seed )
+
+    return result
+
+
+def _hash32_blocks( keys, seed ):
+    ''' Vectorized 32bit murmur3 of a list of byte strings. Returns a uint32 array. '''
+    lengths = np.fromiter( ( len( key ) for key in keys ), dtype = np.int64, count = len( keys ) )
+    nblocks = lengths >> 2
+    ncols = int( nblocks.max() ) + 1 if len( keys ) else 1
+
+    # scatter all the bytes into a zero padded matrix, one row per key. The
+    # extra column guarantees the tail word of every row exists.
+    data = np.zeros( ( len( keys ), ncols * 4 ), dtype = np.uint8 )
+    flat = np.frombuffer( b''.join( keys ), dtype = np.uint8 )
+    if len( flat ):
+        starts = np.cumsum( lengths ) - lengths
+        rows = np.repeat( np.arange( len( keys ) ), lengths )
+        cols = np.arange( len( flat ) ) - np.repeat( starts, lengths )
+        data[ rows, cols ] = flat
+    blocks = data.view( '<u4' ).astype( np.uint32 )
+
+    c1 = np.uint32( 0xcc9e2d51 )
+    c2 = np.uint32( 0x1b873593 )
+
+    def rotl( x, r ):
+        return ( x << np.uint32( r ) ) | ( x >> np.uint32( 32 - r ) )
+
+    h1 = np.full( len( keys ), seed & 0xFFFFFFFF, dtype = np.uint32 )
+
+    # body
+    for block in range( ncols - 1 ):
+        active = nblocks > block
+        k1 = blocks[ :, block ] * c1
+        k1 = rotl( k1, 15 ) * c2
+        mixed = rotl( h1 ^ k1, 13 ) * np.uint32( 5 ) + np.uint32( 0xe6546b64 )
+        h1 = np.where( active, mixed, h1 )
+
+    # tail, the padding bytes are zero so the whole word can be used
+    k1 = blocks[ np.arange( len( keys ) ), nblocks ]
+    k1 = rotl( k1 * c1, 15 ) * c2
+    h1 = np.where( ( lengths & 3 ) > 0, h1 ^ k1, h1 )
+
+    # finalization
+    h1 ^= lengths.astype( np.uint32 )
+    h1 ^= h1 >> np.uint32( 16 )
+    h1 *= np.uint32( 0x85ebca6b )
+    h1 ^= h1 >> np.uint32( 13 )
+    h1 *= np.uint32( 0xc2b2ae35 )
+    h1 ^= h1 >> np.uint32( 16 )
+    return h1
@@ -0,0 +1,77 @@
+'''
+Measures hashes/sec of every available pymmh3 backend, for the 32bit, 64bit and
+128bit variants and for batched 32bit hashing with hash_many(). Keys look like
+asset paths, 20 to 200 bytes long by default.
+
+    python -m pymmh3.benchmark [--keys 20000] [--lengths 20 60 200] [--backend numpy]
+'''
+
+import sys
+import random
+import argparse
+import timeit
+
+import pymmh3
+
+PATH_PARTS = [ "assets", "chr", "env", "prop", "hero", "crowd", "tree", "rock", "geo",
+               "render", "body", "head", "leaf", "branch", "GEO", "Shape", "lod0" ]
+
+
+def make_keys( count, length, rng ):
+    ''' Returns count asset-path-like keys of exactly length bytes. '''
+    keys = []
+    for i in range( count ):
+        key = "/%06d" % i
+        while len( key ) < length:
+            key += "/" + rng.choice( PATH_PARTS ) + "_%d" % rng.randint( 0, 999 )
+        keys.append( key[ -length: ] )
+    return keys
+
+
+def time_rate( func, count, repeat ):
+    ''' Runs func repeat times, returns the best rate in items/sec. '''
+    best = min( timeit.repeat( func, number = 1, repeat = repeat ) )
+    return count / best if best > 0 else float( "inf" )
+
+
+def benchmark_backend( backend, keys, repeat ):
+    ''' Returns a dict of variant name to hashes/sec for the given backend and keys. '''
+    pymmh3.set_backend( backend )
+    hash32, hash64, hash128, hash_many = pymmh3.hash, pymmh3.hash64, pymmh3.hash128, pymmh3.hash_many
+    return {
+        "hash": time_rate( lambda: [ hash32( key ) for key in keys ], len( keys ), repeat ),
+        "hash64": time_rate( lambda: [ hash64( key ) for key in keys ], len( keys ), repeat ),
+        "hash128": time_rate( lambda: [ hash128( key ) for key in keys ], len( keys ), repeat ),
+        "hash_many": time_rate( lambda: hash_many( keys ), len( keys ), repeat ),
+    }
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( "python -m pymmh3.benchmark", description = __doc__.strip().split( "\n\n" )[ 0 ] )
+    parser.add_argument( "--keys", type = int, default = 20000, help = "number of keys per length" )
+    parser.add_argument( "--lengths", type = int, nargs = "+", default = [ 20, 60, 120, 200 ], help = "key lengths in bytes" )
+    parser.add_argument( "--backend", action = "append", dest = "backends", help = "backend(s) to time, default all available" )
+    parser.add_argument( "--repeat", type = int, default = 3 )
+    parser.add_argument( "--seed", type = int, default = 0, help = "random seed for the generated keys" )
+    opts = parser.parse_args( argv )
+
+    active = pymmh3.get_backend()
+    backends = opts.backends or pymmh3.available_backends()
+    rng = random.Random( opts.seed )
+    variants = [ "hash", "hash64", "hash128", "hash_many" ]
+
+    sys.stdout.write( "active backend: %s, available: %s\n" % ( active, ", ".join( pymmh3.available_backends() ) ) )
+    sys.stdout.write( "%-8s %6s" % ( "backend", "bytes" ) + "".join( "%14s" % v for v in variants ) + "   (hashes/sec)\n" )
+    try:
+        for length in opts.lengths:
+            keys = make_keys( opts.keys, length, rng )
+            for backend in backends:
+                rates = benchmark_backend( backend, keys, opts.repeat )
+                sys.stdout.write( "%-8s %6d" % ( backend, length ) + "".join( "%14.0f" % rates[ v ] for v in variants ) + "\n" )
+    finally:
+        pymmh3.set_backend( active )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
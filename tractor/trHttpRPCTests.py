@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+##-------------------------------------------------------------- ##
+##
+## trHttpRPCTests.py - tests and benchmarks of the tractor engine
+## client (TrHttpRPC and friends) shared by the Nuke and Maya
+## spoolers, run against a local stand-in engine:
+##
+##    python trHttpRPCTests.py                 # run the tests
+##    python trHttpRPCTests.py --benchmark 200 # time transactions
+##    python trHttpRPCTests.py --benchmark 200 --engine host:port
+##
+## Both copies, tractorNukeLib.py and tractorSpoolForMaya.py, are
+## loaded outside of Nuke and Maya, with stand-in host modules if
+## the real ones can't be imported (see trStubHostModules).
+##
+##-------------------------------------------------------------- ##
+
+import os
+import sys
+import imp
+import json
+import time
+import random
+import types
+import socket
+import struct
+import shutil
+import optparse
+import tempfile
+import threading
+import unittest
+
+TrRoot = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+
+TrCopies = [
+    ("nuke", os.path.join(TrRoot, "nuke", "tractorNuke", "tractorNukeLib.py")),
+    ("maya", os.path.join(TrRoot, "maya", "dab_modules", "DABMOD", "python",
+                          "tractorspoolformaya", "tractorSpoolForMaya.py")),
+]
+
+TrLoaded = {}
+
+## ------------------------------------------------------------- ##
+
+def trStubHostModules ():
+    '''
+    Install stand-in nuke and maya_tools modules, for the ones that
+    can't be imported, with nothing in them: the client code doesn't
+    use them, only the spooling panels do.
+    '''
+    try:
+        import nuke
+    except ImportError:
+        sys.modules["nuke"] = types.ModuleType("nuke")
+
+    try:
+        import maya_tools.cmds
+        import maya_tools.utils
+        import maya_tools.mel
+    except ImportError:
+        maya_tools = types.ModuleType("maya_tools")
+        maya_tools.__path__ = []
+        sys.modules["maya_tools"] = maya_tools
+        for name in ("cmds", "utils", "mel"):
+            m = types.ModuleType("maya_tools." + name)
+            setattr(maya_tools, name, m)
+            sys.modules["maya_tools." + name] = m
+
+
+def trLoadCopy (name):
+    '''
+    Return the module of one copy of the client, "nuke" or "maya".
+    '''
+    if name not in TrLoaded:
+        trStubHostModules()
+        path = dict(TrCopies)[name]
+        TrLoaded[name] = imp.load_source("trHttpRPCTests_" + name, path)
+    return TrLoaded[name]
+
+## ------------------------------------------------------------- ##
+
+class TrStandInEngine (object):
+    '''
+    A local stand-in for a tractor engine, answering every request
+    with the same small JSON reply, to test and benchmark transactions
+    without loading a real engine.  It speaks HTTP/1.1 keep-alive, and
+    closes HTTP/1.0 connections after each reply, as the engine does.
+    Each reply may be delayed, to stand in for a busy engine's latency.
+
+    answer, if given, is called with the request path, the number of
+    requests made so far on its connection (0 for the first), and the
+    request headers, and returns a (status, reply, delay) to answer with, None for the
+    usual reply, or "close" or "reset" to drop the connection without
+    replying, with a FIN or a RST.
+    '''
+
+    def __init__(self, reply='{"rc": 0, "msg": "ok"}', delay=0.0,
+                    answer=None):
+        import BaseHTTPServer
+        import SocketServer
+
+        engine = self
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+
+        class Handler (BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = -1  # one send per reply, as the engine does
+
+            def setup (self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                self.served = 0
+                with engine.lock:
+                    engine.connections += 1
+
+            def do_POST (self):
+                n = int( self.headers.getheader("Content-Length") or 0 )
+                if n:
+                    self.rfile.read(n)
+                with engine.lock:
+                    engine.requests.append(self.path)
+
+                how = answer and answer(self.path, self.served, self.headers)
+                self.served += 1
+                if how in ("close", "reset"):
+                    if how == "reset":
+                        self.connection.setsockopt(socket.SOL_SOCKET,
+                            socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    self.close_connection = 1
+                    return
+
+                status, body, wait = how or (200, reply, delay)
+                if wait:
+                    time.sleep(wait)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message (self, *args):
+                pass
+
+        class Server (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server( ("127.0.0.1", 0), Handler )
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Engine (self):
+        return "%s:%d" % (self.host, self.port)
+
+    def Shutdown (self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def trClosedPort ():
+    '''
+    Return a local port that nothing listens on, so connecting to it
+    is refused.
+    '''
+    s = socket.socket()
+    s.bind( ("127.0.0.1", 0) )
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+## ------------------------------------------------------------- ##
+
+def benchmarkTransactions (lib, count=200, engine=None,
+                            verb="queue?q=status"):
+    '''
+    Time count transactions made with a new connection each, then over
+    keep-alive connections, with one copy of the client (see
+    trLoadCopy), against an engine ("host:port"), or a local stand-in
+    engine by default.  Returns the seconds taken and the failed
+    transactions of each mode.
+    '''
+    standin = None
+    if not engine:
+        standin = TrStandInEngine()
+        engine = standin.Engine()
+
+    results = {}
+    try:
+        for mode, keepalive in (("connect", False), ("keepalive", True)):
+            rpc = lib.TrHttpRPC(engine, 0, keepalive=keepalive)
+            failed = 0
+            start = time.time()
+            for i in range(count):
+                rc, msg = rpc.Transaction(verb, None)
+                if rc:
+                    failed += 1
+            elapsed = time.time() - start
+            results[mode] = {"seconds": elapsed, "failed": failed}
+            print "%-10s %d transactions in %.3fs (%.2fms each), %d failed" % \
+                    (mode, count, elapsed, 1000.0 * elapsed / max(count, 1), failed)
+    finally:
+        lib.TrKeepAlivePool.Clear()
+        if standin:
+            standin.Shutdown()
+
+    return results
+
+## ------------------------------------------------------------- ##
+
+class TrCopyTestCase (unittest.TestCase):
+    '''
+    Tests run once for each copy of the client, by subclasses naming
+    the copy (see trCopyTests).
+    '''
+    copy = None
+
+    def setUp (self):
+        self.lib = trLoadCopy(self.copy)
+        self.engines = []
+
+    def tearDown (self):
+        self.lib.TrKeepAlivePool.Clear()
+        for engine in self.engines:
+            engine.Shutdown()
+
+    def standIn (self, **kwargs):
+        engine = TrStandInEngine(**kwargs)
+        self.engines.append(engine)
+        return engine
+
+    def rpc (self, engine, **kwargs):
+        kwargs.setdefault("keepalive", True)
+        return self.lib.TrHttpRPC(engine.Engine(), 0, **kwargs)
+
+
+class KeepAliveTests (object):
+
+    def testReused (self):
+        engine = self.standIn()
+        rpc = self.rpc(engine)
+        for i in range(5):
+            self.assertEqual(rpc.Transaction("queue?q=status", None, "status"),
+                             (0, {"rc": 0, "msg": "ok"}))
+        self.assertEqual(engine.connections, 1)
+
+    def testStaleSocketRetried (self):
+        # the engine drops each connection when it is reused, before
+        # replying, as one that timed out an idle connection would
+        for how in ("close", "reset"):
+            engine = self.standIn(answer=lambda path, served, headers:
+                                    how if served else None)
+            rpc = self.rpc(engine)
+            for i in range(3):
+                self.assertEqual(rpc.Transaction("queue?q=status", None),
+                                 (0, '{"rc": 0, "msg": "ok"}'), how)
+            # each reuse dropped, and retried on a new connection
+            self.assertEqual(engine.connections, 3, how)
+            self.assertEqual(len(engine.requests), 5, how)
+
+    def testNewSocketNotRetried (self):
+        engine = self.standIn(answer=lambda path, served, headers: "close")
+        rc, msg = self.rpc(engine).Transaction("queue?q=status", None)
+        self.assertEqual((rc, msg), (-1, "no data received"))
+        self.assertEqual((engine.connections, len(engine.requests)), (1, 1))
+
+        engine = self.standIn(answer=lambda path, served, headers: "reset")
+        rc, msg = self.rpc(engine).Transaction("queue?q=status", None)
+        self.assertNotEqual(rc, 0)
+        self.assertEqual((engine.connections, len(engine.requests)), (1, 1))
+
+    def testReusedAfterErrorReply (self):
+        def answer (path, served, headers):
+            if "fail" in path:
+                return (500, "engine error", 0)
+        engine = self.standIn(answer=answer)
+        rpc = self.rpc(engine)
+        self.assertEqual(rpc.Transaction("fail", None), (500, "engine error"))
+        self.assertEqual(rpc.Transaction("queue?q=status", None)[0], 0)
+        self.assertEqual(engine.connections, 1)
+
+    def testReusedAfterDroppedTransaction (self):
+        # a failed transaction leaves nothing in the pool, and the next
+        # transactions share a new connection
+        def answer (path, served, headers):
+            if "drop" in path:
+                return "reset"
+        engine = self.standIn(answer=answer)
+        rpc = self.rpc(engine)
+        self.assertNotEqual(rpc.Transaction("drop", None)[0], 0)
+        for i in range(3):
+            self.assertEqual(rpc.Transaction("queue?q=status", None)[0], 0)
+        self.assertEqual(engine.connections, 2)
+
+    def testTimedOutNotPooled (self):
+        engine = self.standIn(answer=lambda path, served, headers:
+                                (200, "{}", 0.5) if "slow" in path else None)
+        rpc = self.rpc(engine, timeout=0.1)
+        self.assertNotEqual(rpc.Transaction("slow", None)[0], 0)
+        self.assertEqual(self.lib.TrKeepAlivePool.idle.get( (engine.host, engine.port), [] ), [])
+        self.assertEqual(self.rpc(engine).Transaction("queue?q=status", None)[0], 0)
+        self.assertEqual(engine.connections, 2)
+
+    def testPoolLimits (self):
+        pool = self.lib.TrConnectionPool(maxidle=2, idletimeout=0.2)
+        engine = self.standIn()
+        conns = [socket.create_connection( (engine.host, engine.port) )
+                    for i in range(3)]
+        for s in conns:
+            pool.Put(engine.host, engine.port, s)
+        self.assertEqual(len(pool.idle[ (engine.host, engine.port) ]), 2)
+        self.assertTrue(pool.Get(engine.host, engine.port) in conns[:2])
+        time.sleep(0.3)
+        self.assertEqual(pool.Get(engine.host, engine.port), None)
+        pool.Clear()
+
+
+class StreamTests (object):
+    '''
+    TrJSONArrayStream fed replies in pieces of every size, checked
+    against the reply decoded whole.
+    '''
+
+    Replies = [
+        ('[]', None),
+        (' [ 1 , -2.5e3,true,false ,null, "" ] ', None),
+        ('[0, 12345678901234567890, 1.5E-7, -0.0, 7]', None),
+        ('[{"a": [1, {"b": "]}[{\\"\\\\"}]}, "x\\u00e9\\n\\"y", [[]], {}]', None),
+        ('{"rc": 0, "users": [{"name": "ada", "jobs": [1, 2]}, "b"]}', "users"),
+        ('{"pre": {"nested": ["[", "{", "\\"]", [1, [2, [3]]]]}, "n": 12,'
+         ' "t": true, "s": "s\\\\", "users": ["a", 1, null], "post": [1, 2]}',
+         "users"),
+        ('{"users": []}', "users"),
+    ]
+
+    def feed (self, text, key, sizes):
+        # feed text to a stream in pieces of the given sizes, in turn
+        stream = self.lib.TrJSONArrayStream(key)
+        items = []
+        pos = 0
+        i = 0
+        while pos < len(text):
+            n = sizes[i % len(sizes)]
+            items.extend( stream.Feed(text[pos:pos+n]) )
+            pos += n
+            i += 1
+        stream.Close()
+        return items
+
+    def expected (self, text, key):
+        value = json.loads(text)
+        return value if key is None else value[key]
+
+    def testPieces (self):
+        rand = random.Random(17)
+        for text, key in self.Replies:
+            want = self.expected(text, key)
+            self.assertEqual(self.feed(text, key, [len(text)]), want, text)
+            self.assertEqual(self.feed(text, key, [1]), want, text)
+            for i in range(20):
+                sizes = [rand.randint(1, 12) for j in range(10)]
+                self.assertEqual(self.feed(text, key, sizes), want,
+                                 "%s %r" % (text, sizes))
+
+    def testLargeSkippedMembers (self):
+        rand = random.Random(23)
+        big = {"s": "x\\\"[{" * 2000,
+               "a": [{"n": i, "s": "]" * (i % 7)} for i in range(300)]}
+        text = json.dumps({"before": big, "n": 1, "users": [big, "u"],
+                           "after": big})
+        want = self.expected(text, "users")
+        for sizes in ([1], [rand.randint(1, 4096) for i in range(50)]):
+            self.assertEqual(self.feed(text, "users", sizes), want)
+
+    def testLinear (self):
+        # a member far larger than the pieces it arrives in is read in
+        # one pass, rather than rescanned from its start on each piece
+        text = json.dumps({"skip": ["x" * 100] * 20000, "users": ["a"]})
+        start = time.time()
+        self.assertEqual(self.feed(text, "users", [64]), ["a"])
+        self.assertTrue(time.time() - start < 2.0, time.time() - start)
+
+    def testInvalid (self):
+        for text, key in (('[1, @]', None), ('[1 2]', None), ('{"users": 1}', "users"),
+                          ('{"a": , "users": []}', "users"), ('[1, "a', None),
+                          ('{"a": [1]}', "users"), ('[tru]', None)):
+            for sizes in ([len(text)], [1]):
+                self.assertRaises(ValueError, self.feed, text, key, sizes)
+
+
+class TransactAllTests (object):
+    '''
+    Batches of requests made at once, with timed-out and refused
+    requests among the successful ones.
+    '''
+
+    def slowOrRefused (self, which):
+        # an answer, with which(path, headers) picking out the request
+        # answered too late for the time-out, or refused by the engine
+        def answer (path, served, headers):
+            how = which(path, headers)
+            if how == "slow":
+                return (200, '{"rc": 0, "msg": "late"}', 1.0)
+            elif how == "refuse":
+                return (400, '{"rc": 1, "msg": "refused"}', 0)
+            elif how:
+                # the others answered in reverse order of their calls
+                return (200, '{"rc": 0, "msg": "%s"}' % how, 0.05 * (5 - int(how)))
+        return answer
+
+    def options (self, engine, **kwargs):
+        values = {"mtdhost": engine.Engine(), "uname": "tester",
+                  "hname": "testhost", "jobcwd": "/tmp", "priority": 1.0,
+                  "ribspool": None, "timeout": 0.3}
+        values.update(kwargs)
+        return optparse.Values(values)
+
+    def testOrder (self):
+        def which (path, headers):
+            n = path.split("n=")[-1]
+            return {"2": "slow", "4": "refuse"}.get(n, n)
+        engine = self.standIn(answer=self.slowOrRefused(which))
+
+        def fails ():
+            raise RuntimeError("no transaction")
+
+        calls = [("c%d" % i, self.rpc(engine, timeout=0.3).Transaction,
+                    ("call?n=%d" % i, None)) for i in range(6)]
+        refused = self.lib.TrHttpRPC("127.0.0.1:%d" % trClosedPort(), 0)
+        calls.insert(3, ("closed", refused.Transaction, ("call?n=9", None)))
+        calls.append( ("raised", fails, ()) )
+
+        start = time.time()
+        results = self.lib.trTransactAll(calls)
+        # bounded by the time-out, not the slow reply
+        self.assertTrue(time.time() - start < 0.9, time.time() - start)
+
+        self.assertEqual([r[0] for r in results], [c[0] for c in calls])
+        byLabel = dict( (label, (rc, msg)) for label, rc, msg in results )
+        for i in (0, 1, 3, 5):
+            self.assertEqual(byLabel["c%d" % i],
+                             (0, '{"rc": 0, "msg": "%d"}' % i))
+        self.assertNotEqual(byLabel["c2"][0], 0)
+        self.assertEqual(byLabel["c4"], (400, '{"rc": 1, "msg": "refused"}'))
+        self.assertEqual(byLabel["closed"][1], "connection refused")
+        self.assertEqual(byLabel["raised"],
+                         (-1, "RuntimeError - no transaction"))
+        self.assertEqual(len(engine.requests), 6)
+
+    def testConcurrency (self):
+        engine = self.standIn(delay=0.2)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def call (n):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            try:
+                return self.rpc(engine).Transaction("call?n=%d" % n, None)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        start = time.time()
+        results = self.lib.trTransactAll([(n, call, (n,)) for n in range(8)],
+                                         maxconcurrent=4)
+        elapsed = time.time() - start
+        self.assertEqual([(n, rc) for n, rc, msg in results],
+                         [(n, 0) for n in range(8)])
+        self.assertEqual(running[1], 4)
+        self.assertTrue(0.4 <= elapsed < 0.8, elapsed)
+        self.assertEqual(self.lib.trTransactAll([]), [])
+
+    def testJobSpoolAll (self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        jobfiles = []
+        for name in ("0", "slow", "1", "refuse", "3"):
+            path = os.path.join(tmp, name + ".alf")
+            with open(path, "w") as f:
+                f.write("Job -title {%s}\n" % name)
+            jobfiles.append(path)
+        jobfiles.insert(2, os.path.join(tmp, "missing.alf"))
+
+        def which (path, headers):
+            name = os.path.basename( headers.getheader("X-Tractor-Jobfile") )
+            return os.path.splitext(name)[0]
+
+        for keepalive in (False, True):
+            engine = self.standIn(answer=self.slowOrRefused(which))
+            results = self.lib.jobSpoolAll(jobfiles,
+                            self.options(engine, keepalive=keepalive))
+            self.assertEqual([r[0] for r in results], jobfiles)
+            rcs = [rc for f, rc, msg in results]
+            self.assertEqual(rcs[0], 0)
+            self.assertNotEqual(rcs[1], 0)
+            self.assertEqual(rcs[2], -1)  # IOError reading the job
+            self.assertEqual(rcs[3:], [0, 400, 0])
+            self.assertEqual(results[5][2], '{"rc": 0, "msg": "3"}')
+            self.assertEqual(engine.requests, ["/Tractor/spool"] * 5)
+
+    def testJobDeleteAll (self):
+        def which (path, headers):
+            return path.split("jid=")[1].split("&")[0]
+
+        jids = [0, "slow", 1, "refuse", 3]
+        for keepalive in (False, True):
+            engine = self.standIn(answer=self.slowOrRefused(which))
+            results = self.lib.jobDeleteAll(jids,
+                            self.options(engine, keepalive=keepalive), 2)
+            self.assertEqual([r[0] for r in results],
+                             ["J0", "Jslow", "J1", "Jrefuse", "J3"])
+            rcs = [rc for label, rc, msg in results]
+            self.assertEqual(rcs[0], 0)
+            self.assertNotEqual(rcs[1], 0)
+            self.assertEqual(rcs[2:], [0, 400, 0])
+            self.assertEqual(results[4][2], '{"rc": 0, "msg": "3"}')
+            self.assertEqual(len(engine.requests), 5)
+
+
+def trCopyTests (*mixins):
+    '''
+    Return a TestCase class for each copy of the client, running the
+    tests of the mixins.
+    '''
+    cases = []
+    for name, path in TrCopies:
+        for mixin in mixins:
+            cases.append( type("%s%s" % (name.capitalize(), mixin.__name__),
+                               (mixin, TrCopyTestCase), {"copy": name}) )
+    return cases
+
+## ------------------------------------------------------------- ##
+
+def trAllTests ():
+    return trCopyTests(KeepAliveTests, StreamTests, TransactAllTests)
+
+
+def main (argv):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--benchmark", type="int", default=0,
+            help="time this many transactions of each copy, rather "
+                 "than run the tests")
+    parser.add_option("--engine", default=None,
+            help="engine to benchmark against (host:port), rather than "
+                 "a local stand-in engine")
+    parser.add_option("-v", "--verbose", action="store_true", default=False)
+    options, args = parser.parse_args(argv)
+
+    if options.benchmark:
+        for name, path in TrCopies:
+            print name
+            benchmarkTransactions(trLoadCopy(name), options.benchmark,
+                                  options.engine)
+        return 0
+
+    suite = unittest.TestSuite()
+    for case in trAllTests():
+        suite.addTests( unittest.TestLoader().loadTestsFromTestCase(case) )
+    verbosity = options.verbose and 2 or 1
+    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    return not result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    sys.exit( main(sys.argv[1:]) )